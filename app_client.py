@@ -40,6 +40,10 @@ if __name__ == '__main__':
         app = QApplication(sys.argv)
         app.setQuitOnLastWindowClosed(True)
 
+        session_recorder = container.session_recorder()
+        session_recorder.start()
+        app.aboutToQuit.connect(session_recorder.stop)
+
         QTimer.singleShot(0, show_main_window)
         sys.exit(app.exec())
     except Exception as e:
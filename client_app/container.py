@@ -22,6 +22,7 @@ from common.services.active_work_state import ActiveWorkState
 from common.services.face_scanning.face_scanner import FaceScannerService
 from common.services.gaze.callibration import PersonGazeCallibrationService
 from common.services.gaze.estimation import HeadDataEstimatorFactory, PersonGazeEstimationService
+from common.services.session_recorder import SessionRecorder
 from common.widgets.project_data_select.container import ProjectDataSelectContainer
 from web.apps.client.app import ClientApp
 
@@ -29,6 +30,7 @@ from web.apps.client.app import ClientApp
 client_storage = Path(__file__).parent.parent / 'docs' / 'client'
 projects_storage_dir = client_storage / 'projects'
 archives_storage_dir = client_storage / 'archives'
+sessions_storage_dir = client_storage / 'sessions'
 
 class DefaultHeadDataEstimatorFactory(HeadDataEstimatorFactory):
     def __init__(self) -> None:
@@ -62,6 +64,11 @@ class ClientAppContainer(containers.DeclarativeContainer):
                                           face_scanner=face_scanner,
                                           head_data_estimator_factory=head_data_estimator_factory)
     
+    session_recorder = providers.Singleton(SessionRecorder,
+                                           face_scanner=face_scanner,
+                                           scene_initializer=scene.initializer,
+                                           sessions_dir=sessions_storage_dir)
+
     processing_mode_selector = providers.Singleton(ProcessingModeSelector)
     person_selector = providers.Singleton(ActivePersonSelector)
 
@@ -0,0 +1,244 @@
+from datetime import datetime, timedelta
+import heapq
+from typing import Iterable
+import numpy as np
+
+from common.domain.hits_window import datetime_to_ns, ns_to_datetime, timedelta_to_ns
+
+
+_PERSON_BITS = 32
+_PERSON_MASK = (1 << _PERSON_BITS) - 1
+_NO_TIMESTAMP = np.iinfo(np.int64).max
+
+
+class AttentionTensor:
+    """
+    Попадания всех операторов по всем объектам окружения сцены, сгруппированные по парам (объект, оператор).
+
+    Попадания пары хранятся столбцами (timestamp, num_hits) по возрастанию времени, а срок устаревания
+    её старейшего попадания - в куче. update() пересчитывает скользящие суммы, пороги и время максимума
+    только для пар, в которых появились новые или устарели старые попадания, и удаляет устаревшие
+    только у пар из вершины кучи, поэтому такт без изменений не обходит хранимые попадания.
+    Семантика сумм совпадает с HitsWindow.
+    """
+    # the heap is rebuilt once outdated entries outnumber the pairs this many times
+    COMPACT_RATIO = 4
+
+    def __init__(self, windows:list[timedelta], hits_thresholds:list[float]) -> None:
+        self._windows_ns = np.array([timedelta_to_ns(w) for w in windows], dtype=np.int64)
+        self._thresholds = np.array(hits_thresholds, dtype=np.float64)
+
+        self._person_id2index:dict[int, int] = dict()
+        self._person_ids:list[int] = []
+        self._tz = None
+
+        # pair key -> (timestamps, num_hits) sorted by timestamp
+        self._pairs:dict[int, tuple[np.ndarray, np.ndarray]] = dict()
+        self._obj_pairs:dict[int, set[int]] = dict()
+        self._num_records = 0
+        # (expiry, pair key) heap, entries not matching _pair_expiry are outdated and are skipped
+        self._expiry_heap:list[tuple[int, int]] = []
+        self._pair_expiry:dict[int, int] = dict()
+
+        self._pending_obj_indices:list[int] = []
+        self._pending_person_indices:list[int] = []
+        self._pending_timestamps:list[int] = []
+        self._pending_num_hits:list[int] = []
+
+        self._dirty_objs:set[int] = set()
+        self._dirty_pairs:set[int] = set()
+        # oldest aggregated hit of each scene obj, used to find objs with outdated aggregated hits
+        self._oldest_aggregated = np.full(len(windows), _NO_TIMESTAMP, dtype=np.int64)
+
+    def __len__(self):
+        return self._num_records + len(self._pending_timestamps)
+
+    def _person_index(self, person_id:int) -> int:
+        index = self._person_id2index.get(person_id)
+        if index is None:
+            index = len(self._person_ids)
+            self._person_id2index[person_id] = index
+            self._person_ids.append(person_id)
+        return index
+
+    def set_obj_window(self, obj_index:int, window:timedelta, hits_threshold:float):
+        self._windows_ns[obj_index] = timedelta_to_ns(window)
+        self._thresholds[obj_index] = hits_threshold
+        self._dirty_objs.add(obj_index)
+
+    def register(self, obj_index:int, person_id:int, timestamp:datetime, num_hits:int):
+        self._tz = timestamp.tzinfo
+        self._pending_obj_indices.append(obj_index)
+        self._pending_person_indices.append(self._person_index(person_id))
+        self._pending_timestamps.append(datetime_to_ns(timestamp))
+        self._pending_num_hits.append(int(num_hits))
+
+    def _flush_pending(self):
+        """Переносит зарегистрированные попадания в их пары, пары помечаются для пересчёта"""
+        if not self._pending_timestamps:
+            return
+        groups:dict[int, tuple[list[int], list[int]]] = dict()
+        for obj_index, person_index, timestamp, num_hits in zip(self._pending_obj_indices, self._pending_person_indices,
+                                                                 self._pending_timestamps, self._pending_num_hits):
+            if (group:=groups.get((obj_index << _PERSON_BITS) | person_index)) is None:
+                group = groups[(obj_index << _PERSON_BITS) | person_index] = ([], [])
+            group[0].append(timestamp)
+            group[1].append(num_hits)
+        self._num_records += len(self._pending_timestamps)
+        self._pending_obj_indices.clear()
+        self._pending_person_indices.clear()
+        self._pending_timestamps.clear()
+        self._pending_num_hits.clear()
+
+        for pair_key, (new_timestamps, new_num_hits) in groups.items():
+            timestamps = np.array(new_timestamps, dtype=np.int64)
+            num_hits = np.array(new_num_hits, dtype=np.int64)
+            if (pair:=self._pairs.get(pair_key)) is None:
+                self._obj_pairs.setdefault(pair_key >> _PERSON_BITS, set()).add(pair_key)
+            else:
+                timestamps = np.concatenate((pair[0], timestamps))
+                num_hits = np.concatenate((pair[1], num_hits))
+            if (timestamps[1:] < timestamps[:-1]).any():
+                order = np.argsort(timestamps, kind='stable')
+                timestamps, num_hits = timestamps[order], num_hits[order]
+            self._pairs[pair_key] = (timestamps, num_hits)
+            self._schedule_expiry(pair_key)
+            self._dirty_pairs.add(pair_key)
+
+    def _schedule_expiry(self, pair_key:int):
+        expiry = int(self._pairs[pair_key][0][0]) + int(self._windows_ns[pair_key >> _PERSON_BITS])
+        if self._pair_expiry.get(pair_key) == expiry:
+            return
+        self._pair_expiry[pair_key] = expiry
+        heapq.heappush(self._expiry_heap, (expiry, pair_key))
+        if len(self._expiry_heap) > self.COMPACT_RATIO * max(len(self._pair_expiry), 1):
+            self._expiry_heap = [(expiry, pair_key) for pair_key, expiry in self._pair_expiry.items()]
+            heapq.heapify(self._expiry_heap)
+
+    def update(self, current_timestamp:datetime) -> tuple[np.ndarray, list[int], list[datetime]]:
+        """
+        Возвращает (obj_indices, person_ids, timestamps) пар, у которых максимальная скользящая сумма
+        достигла порога объекта. Пары без изменений с прошлого вызова не пересчитываются.
+        Затем удаляет попадания старше окна своего объекта.
+        """
+        self._flush_pending()
+        if self._dirty_objs:
+            for obj_index in self._dirty_objs:
+                for pair_key in self._obj_pairs.get(obj_index, ()):
+                    # the window of the obj changed, so did the expiry of its pairs
+                    self._schedule_expiry(pair_key)
+                    self._dirty_pairs.add(pair_key)
+            self._dirty_objs.clear()
+
+        result = self._aggregate(sorted(self._dirty_pairs)) if self._dirty_pairs else self._empty_result()
+        self._dirty_pairs = set()
+        self._remove_outdated(datetime_to_ns(current_timestamp))
+        return result
+
+    def _remove_outdated(self, current_ns:int):
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= current_ns:
+            expiry, pair_key = heapq.heappop(heap)
+            if self._pair_expiry.get(pair_key) != expiry:
+                continue
+            del self._pair_expiry[pair_key]
+            timestamps, num_hits = self._pairs[pair_key]
+            keep_ns = current_ns - int(self._windows_ns[pair_key >> _PERSON_BITS])
+            num_outdated = int(np.searchsorted(timestamps, keep_ns, side='right'))
+            self._num_records -= num_outdated
+            # pairs losing records get new sums on the next update
+            self._dirty_pairs.add(pair_key)
+            if num_outdated == len(timestamps):
+                del self._pairs[pair_key]
+                obj_pairs = self._obj_pairs[pair_key >> _PERSON_BITS]
+                obj_pairs.discard(pair_key)
+                if not obj_pairs:
+                    del self._obj_pairs[pair_key >> _PERSON_BITS]
+            else:
+                self._pairs[pair_key] = (timestamps[num_outdated:], num_hits[num_outdated:])
+                self._schedule_expiry(pair_key)
+
+    def _empty_result(self):
+        return np.empty(0, dtype=np.int64), [], []
+
+    def _columns(self, pair_keys:Iterable[int]) -> tuple[np.ndarray, np.ndarray, np.ndarray]|None:
+        """(pair keys, timestamps, num_hits) попаданий пар, сгруппированные по парам и упорядоченные по времени"""
+        pairs = [(pair_key, pair) for pair_key in pair_keys if (pair:=self._pairs.get(pair_key)) is not None]
+        if not pairs:
+            return None
+        lengths = np.fromiter((len(pair[0]) for _, pair in pairs), dtype=np.int64, count=len(pairs))
+        return (np.repeat(np.fromiter((pair_key for pair_key, _ in pairs), dtype=np.int64, count=len(pairs)), lengths),
+                np.concatenate([pair[0] for _, pair in pairs]),
+                np.concatenate([pair[1] for _, pair in pairs]))
+
+    def _window_sums(self, pair_keys:Iterable[int], before_ns:int|None=None):
+        if (columns:=self._columns(pair_keys)) is None:
+            return None
+        pair_keys_column, timestamps, num_hits = columns
+        if before_ns is not None:
+            preceding = timestamps < before_ns
+            pair_keys_column, timestamps, num_hits = pair_keys_column[preceding], timestamps[preceding], num_hits[preceding]
+        if len(timestamps) == 0:
+            return None
+        obj_indices = pair_keys_column >> _PERSON_BITS
+        person_indices = pair_keys_column & _PERSON_MASK
+
+        # records are grouped by pair and sorted by time inside a group already
+        is_group_start = np.empty(len(pair_keys_column), dtype=bool)
+        is_group_start[0] = True
+        np.not_equal(pair_keys_column[1:], pair_keys_column[:-1], out=is_group_start[1:])
+        group_starts = np.flatnonzero(is_group_start)
+        group_ids = np.cumsum(is_group_start) - 1
+        windows_ns = self._windows_ns[obj_indices]
+
+        # first record of the same pair with timestamp > timestamp - window
+        first_timestamp = timestamps.min()
+        span = int(timestamps.max() - first_timestamp) + int(windows_ns.max()) + 1
+        if span * len(group_starts) < (1 << 62):
+            keys = group_ids * span + (timestamps - first_timestamp)
+            window_starts = np.searchsorted(keys, keys - windows_ns, side='right')
+        else:
+            window_starts = np.empty(len(timestamps), dtype=np.int64)
+            bounds = np.append(group_starts, len(timestamps))
+            for begin, end in zip(bounds[:-1], bounds[1:]):
+                window_starts[begin:end] = begin + np.searchsorted(timestamps[begin:end], timestamps[begin:end] - windows_ns[begin:end], side='right')
+        np.maximum(window_starts, group_starts[group_ids], out=window_starts)
+
+        hits_cum = np.cumsum(num_hits)
+        hits_cum_before = hits_cum - num_hits
+        window_sums = hits_cum - hits_cum_before[window_starts]
+        return window_sums, group_starts, group_ids, obj_indices, person_indices, timestamps
+
+    def _aggregate(self, pair_keys:Iterable[int]):
+        sums_data = self._window_sums(pair_keys)
+        if sums_data is None:
+            return self._empty_result()
+        window_sums, group_starts, group_ids, obj_indices, person_indices, timestamps = sums_data
+
+        max_sums = np.maximum.reduceat(window_sums, group_starts)
+        positions = np.arange(len(window_sums))
+        first_max_positions = np.minimum.reduceat(np.where(window_sums == max_sums[group_ids], positions, len(window_sums)), group_starts)
+
+        group_objs = obj_indices[group_starts]
+        reached = max_sums >= self._thresholds[group_objs]
+        first_max_positions = first_max_positions[reached]
+
+        return (group_objs[reached],
+                [self._person_ids[i] for i in person_indices[first_max_positions].tolist()],
+                [ns_to_datetime(ts, self._tz) for ts in timestamps[first_max_positions].tolist()])
+
+    def max_window_sum_before(self, obj_index:int, timestamp:datetime) -> int|None:
+        self._flush_pending()
+        sums_data = self._window_sums(self._obj_pairs.get(obj_index, ()), datetime_to_ns(timestamp))
+        if sums_data is None:
+            return None
+        return int(sums_data[0].max())
+
+    def objs_with_outdated_aggregated_hits(self, keep_timestamp:datetime) -> np.ndarray:
+        return np.flatnonzero(self._oldest_aggregated < datetime_to_ns(keep_timestamp))
+
+    def set_oldest_aggregated_hit(self, obj_index:int, timestamp:datetime|None):
+        self._oldest_aggregated[obj_index] = _NO_TIMESTAMP if timestamp is None else datetime_to_ns(timestamp)
+
+    def note_aggregated_hit(self, obj_index:int, timestamp:datetime):
+        self._oldest_aggregated[obj_index] = min(self._oldest_aggregated[obj_index], datetime_to_ns(timestamp))
@@ -0,0 +1,211 @@
+from collections import deque
+from datetime import datetime, timedelta, timezone, tzinfo
+import numpy as np
+
+
+_NAIVE_EPOCH = datetime(1970, 1, 1)
+_AWARE_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_NS_IN_US = 1000
+
+
+def datetime_to_ns(timestamp:datetime) -> int:
+    epoch = _NAIVE_EPOCH if timestamp.tzinfo is None else _AWARE_EPOCH
+    return (timestamp - epoch) // timedelta(microseconds=1) * _NS_IN_US
+
+
+def ns_to_datetime(timestamp_ns:int, tz:tzinfo|None=None) -> datetime:
+    delta = timedelta(microseconds=int(timestamp_ns) // _NS_IN_US)
+    if tz is None:
+        return _NAIVE_EPOCH + delta
+    return (_AWARE_EPOCH + delta).astimezone(tz)
+
+
+def timedelta_to_ns(delta:timedelta) -> int:
+    return delta // timedelta(microseconds=1) * _NS_IN_US
+
+
+class HitsWindow:
+    """
+    Скользящая сумма числа попаданий одного оператора по одному объекту окружения.
+
+    Хранит пары (timestamp_ns, num_hits) в кольцевом буфере и для каждой записи поддерживает сумму
+    попаданий в окне (timestamp - window, timestamp] по ещё не удалённым записям, а также максимум этих сумм.
+    Результат совпадает с pd.Series(...).sort_index().rolling(window, min_periods=1).sum() по сохранённым записям,
+    при этом добавление записи и удаление устаревших выполняются за амортизированное O(1).
+    """
+    def __init__(self, window:timedelta, capacity:int=64) -> None:
+        capacity = 1 << max(int(capacity) - 1, 1).bit_length()
+        self._window_ns = timedelta_to_ns(window)
+        self._tz:tzinfo|None = None
+        self._alloc(capacity)
+        # absolute indices, positions in arrays are index & mask
+        self._head = 0
+        self._tail = 0
+        # first index, whose window starts inside retained records
+        self._fixed_from = 0
+        # first index, that is inside window of the next pushed record
+        self._window_start = 0
+        self._total_hits = 0
+        # indices of records with fixed window sums, their sums are non-increasing
+        self._max_candidates:deque[int] = deque()
+
+    def _alloc(self, capacity:int):
+        self._mask = capacity - 1
+        self._timestamps = np.empty(capacity, dtype=np.int64)
+        # cumulative number of hits before the record and including it
+        self._cum_before = np.empty(capacity, dtype=np.int64)
+        self._cum = np.empty(capacity, dtype=np.int64)
+        # first index inside window of the record and the sum over that window
+        self._starts = np.empty(capacity, dtype=np.int64)
+        self._sums = np.empty(capacity, dtype=np.int64)
+
+    def _grow(self):
+        old_capacity = self._mask + 1
+        positions = np.arange(self._head, self._tail, dtype=np.int64) & self._mask
+        arrays = [arr[positions] for arr in (self._timestamps, self._cum_before, self._cum, self._starts, self._sums)]
+        self._alloc(old_capacity * 2)
+        new_positions = np.arange(self._head, self._tail, dtype=np.int64) & self._mask
+        for dst, src in zip((self._timestamps, self._cum_before, self._cum, self._starts, self._sums), arrays):
+            dst[new_positions] = src
+
+    def __len__(self):
+        return self._tail - self._head
+
+    def window(self) -> timedelta:
+        return timedelta(microseconds=self._window_ns // _NS_IN_US)
+
+    def set_window(self, window:timedelta):
+        window_ns = timedelta_to_ns(window)
+        if window_ns == self._window_ns:
+            return
+        self._window_ns = window_ns
+        self._rebuild()
+
+    def push(self, timestamp:datetime, num_hits:int):
+        self._tz = timestamp.tzinfo
+        timestamp_ns = datetime_to_ns(timestamp)
+        num_hits = int(num_hits)
+        if self._tail > self._head and timestamp_ns < self._timestamps[(self._tail - 1) & self._mask]:
+            self._insert_unordered(timestamp_ns, num_hits)
+            return
+        self._append(timestamp_ns, num_hits)
+
+    def _append(self, timestamp_ns:int, num_hits:int):
+        if self._tail - self._head > self._mask:
+            self._grow()
+        mask = self._mask
+        timestamps = self._timestamps
+        window_begin_ns = timestamp_ns - self._window_ns
+
+        start = max(self._window_start, self._head)
+        while start < self._tail and timestamps[start & mask] <= window_begin_ns:
+            start += 1
+        self._window_start = start
+
+        hits_before_window = self._cum_before[start & mask] if start < self._tail else self._total_hits
+        pos = self._tail & mask
+        timestamps[pos] = timestamp_ns
+        self._cum_before[pos] = self._total_hits
+        self._total_hits += num_hits
+        self._cum[pos] = self._total_hits
+        self._starts[pos] = start
+        window_sum = self._total_hits - hits_before_window
+        self._sums[pos] = window_sum
+
+        index = self._tail
+        self._tail += 1
+        # window of the new record starts at head or later, so its sum stays fixed until head passes that start
+        candidates = self._max_candidates
+        sums = self._sums
+        while candidates and sums[candidates[-1] & mask] < window_sum:
+            candidates.pop()
+        candidates.append(index)
+
+    def _insert_unordered(self, timestamp_ns:int, num_hits:int):
+        timestamps, hits = self._records()
+        insert_at = int(np.searchsorted(timestamps, timestamp_ns, side='right'))
+        timestamps = np.insert(timestamps, insert_at, timestamp_ns)
+        hits = np.insert(hits, insert_at, num_hits)
+        self._reset(len(timestamps))
+        for ts, num in zip(timestamps.tolist(), hits.tolist()):
+            self._append(ts, num)
+
+    def _records(self) -> tuple[np.ndarray, np.ndarray]:
+        positions = np.arange(self._head, self._tail, dtype=np.int64) & self._mask
+        return self._timestamps[positions], self._cum[positions] - self._cum_before[positions]
+
+    def _reset(self, min_capacity:int):
+        capacity = self._mask + 1
+        while capacity < min_capacity:
+            capacity *= 2
+        if capacity != self._mask + 1:
+            self._alloc(capacity)
+        self._head = self._tail = self._fixed_from = self._window_start = 0
+        self._total_hits = 0
+        self._max_candidates.clear()
+
+    def _rebuild(self):
+        timestamps, hits = self._records()
+        self._reset(len(timestamps))
+        for ts, num in zip(timestamps.tolist(), hits.tolist()):
+            self._append(ts, num)
+
+    def drop_not_after(self, keep_timestamp:datetime):
+        """Удаляет записи с timestamp <= keep_timestamp"""
+        keep_ns = datetime_to_ns(keep_timestamp)
+        mask = self._mask
+        head = self._head
+        while head < self._tail and self._timestamps[head & mask] <= keep_ns:
+            head += 1
+        if head == self._head:
+            return
+        self._head = head
+
+        fixed_from = max(self._fixed_from, head)
+        while fixed_from < self._tail and self._starts[fixed_from & mask] < head:
+            fixed_from += 1
+        self._fixed_from = fixed_from
+
+        candidates = self._max_candidates
+        while candidates and candidates[0] < fixed_from:
+            candidates.popleft()
+
+    def clear(self):
+        self._reset(0)
+
+    def max_window_sum(self) -> tuple[int, datetime]|None:
+        """Возвращает максимальную скользящую сумму и время записи, на которой она впервые достигается"""
+        if self._tail == self._head:
+            return None
+        mask = self._mask
+        best_sum, best_index = -1, -1
+        if self._fixed_from > self._head:
+            # records, whose windows were cut by dropping, sum hits from head, so the last of them is the largest
+            best_index = self._fixed_from - 1
+            best_sum = int(self._cum[best_index & mask] - self._cum_before[self._head & mask])
+        if self._max_candidates:
+            candidate = self._max_candidates[0]
+            candidate_sum = int(self._sums[candidate & mask])
+            if candidate_sum > best_sum:
+                best_sum, best_index = candidate_sum, candidate
+        return best_sum, ns_to_datetime(int(self._timestamps[best_index & mask]), self._tz)
+
+    def max_window_sum_before(self, timestamp:datetime) -> int|None:
+        """Максимальная скользящая сумма по записям с timestamp < переданного"""
+        if self._tail == self._head:
+            return None
+        timestamp_ns = datetime_to_ns(timestamp)
+        mask = self._mask
+        if self._timestamps[(self._tail - 1) & mask] < timestamp_ns:
+            res = self.max_window_sum()
+            return res[0] if res else None
+
+        positions = np.arange(self._head, self._tail, dtype=np.int64) & mask
+        timestamps = self._timestamps[positions]
+        count = int(np.searchsorted(timestamps, timestamp_ns, side='left'))
+        if count == 0:
+            return None
+        positions = positions[:count]
+        starts = np.maximum(self._starts[positions], self._head) & mask
+        sums = self._cum[positions] - self._cum_before[starts]
+        return int(sums.max())
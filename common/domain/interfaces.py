@@ -1,6 +1,6 @@
 from __future__ import annotations
 from datetime import timedelta, datetime
-from typing import Any, Protocol
+from typing import Any, Mapping, Protocol
 from abc import ABCMeta, abstractmethod, ABC
 from PySide6.QtCore import Signal, QObject
 from PySide6.QtGui import QColor, QVector3D, QQuaternion
@@ -8,7 +8,7 @@ from PySide6.QtGui import QColor, QVector3D, QQuaternion
 from common.domain.scene_timer import SceneUpdateTimer
 from common.dtos.descriptions import AttentionSceneDescription
 from common.dtos.head_data import HeadData
-from common.dtos.hits import PerformedRayCastResult, AggregatedHit, SceneObjAttentionHits
+from common.dtos.hits import ColumnarRayCastResult, PerformedRayCastResult, AggregatedHit, SceneObjAttentionHits
 from common.dtos.states import AttentionSceneState
 
 
@@ -162,11 +162,11 @@ class Person(SceneElement):
         raise NotImplementedError()
     
     @abstractmethod
-    def set_performed_ray_cast_result(self, cast_result:PerformedRayCastResult):
+    def set_performed_ray_cast_result(self, cast_result:ColumnarRayCastResult|PerformedRayCastResult):
         raise NotImplementedError()
     
     @abstractmethod
-    def performed_ray_cast_result(self) -> PerformedRayCastResult|None:
+    def performed_ray_cast_result(self) -> ColumnarRayCastResult|None:
         raise NotImplementedError()
     
     @abstractmethod
@@ -260,15 +260,15 @@ class AttentionScene(QObject):
         raise NotImplementedError()
     
     @abstractmethod
-    def scene_objs_by_id(self)->dict[Any, SceneObj]:
+    def scene_objs_by_id(self)->Mapping[Any, SceneObj]:
         raise NotImplementedError()
     
     @abstractmethod
-    def persons_by_id(self)->dict[Any, Person]:
+    def persons_by_id(self)->Mapping[Any, Person]:
         raise NotImplementedError()
     
     @abstractmethod
-    def attention_rules_by_id(self)->dict[Any, AttentionRule]:
+    def attention_rules_by_id(self)->Mapping[Any, AttentionRule]:
         raise NotImplementedError()
     
     @abstractmethod
@@ -0,0 +1,318 @@
+from dataclasses import dataclass
+import json
+import logging
+import os
+from pathlib import Path
+import struct
+from uuid import uuid4
+import numpy as np
+
+from common.domain.obj_data import OBJMeshes
+
+
+MESH_CACHE_SUFFIX = '.meshcache'
+MESH_CACHE_MAGIC = b'ATMESH01'
+# position xyz, normal xyz, texcoord uv
+VERTEX_FLOATS = 8
+VERTEX_STRIDE = VERTEX_FLOATS * 4
+_ALIGNMENT = 64
+
+
+@dataclass(frozen=True)
+class MeshCacheMaterial:
+    name:str
+    ambient:tuple[float, float, float]
+    diffuse:tuple[float, float, float]
+    specular:tuple[float, float, float]
+    shininess:float
+    opacity:float
+    # path relative to the model folder
+    diffuse_map:str|None
+
+
+@dataclass(frozen=True)
+class MeshCachePart:
+    material:str|None
+    # range in the indices of the object
+    index_offset:int
+    index_count:int
+
+
+@dataclass(frozen=True)
+class MeshCacheObject:
+    name:str
+    vertex_offset:int
+    vertex_count:int
+    index_offset:int
+    index_count:int
+    aabb_min:tuple[float, float, float]
+    aabb_max:tuple[float, float, float]
+    parts:list[MeshCachePart]
+
+
+def mesh_cache_path(obj_path:Path) -> Path:
+    return obj_path.with_name(obj_path.name + MESH_CACHE_SUFFIX)
+
+
+def _source_stamp(obj_path:Path) -> dict:
+    stat = obj_path.stat()
+    return {'name': obj_path.name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class MeshCache:
+    """
+    Предобработанная модель сцены, отображённая в память.
+
+    Файл содержит заголовок JSON с объектами модели (диапазоны вершин и индексов, части по материалам, AABB),
+    материалами из MTL и отметкой исходного OBJ, затем массив вершин float32 [n, 8] (положение, нормаль, uv)
+    и массив индексов uint32, индексы каждого объекта отсчитываются от его первой вершины.
+    """
+    def __init__(self, path:Path) -> None:
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MESH_CACHE_MAGIC)) != MESH_CACHE_MAGIC:
+                raise ValueError(f'{path} is not a mesh cache')
+            header_size, = struct.unpack('<I', f.read(4))
+            self._header = json.loads(f.read(header_size).decode('utf-8'))
+        self.source:dict = self._header['source']
+        self.materials = {m['name']: MeshCacheMaterial(m['name'], tuple(m['ambient']), tuple(m['diffuse']),
+                                                       tuple(m['specular']), m['shininess'], m['opacity'],
+                                                       m['diffuse_map'])
+                          for m in self._header['materials']}
+        self.objects = [MeshCacheObject(o['name'], o['vertex_offset'], o['vertex_count'],
+                                        o['index_offset'], o['index_count'],
+                                        tuple(o['aabb_min']), tuple(o['aabb_max']),
+                                        [MeshCachePart(**p) for p in o['parts']])
+                        for o in self._header['objects']]
+        vertices, indices = self._header['vertices'], self._header['indices']
+        self.vertices = np.memmap(path, dtype=np.float32, mode='r', offset=vertices['offset'],
+                                  shape=(vertices['count'], VERTEX_FLOATS)) if vertices['count'] else \
+            np.zeros((0, VERTEX_FLOATS), dtype=np.float32)
+        self.indices = np.memmap(path, dtype=np.uint32, mode='r', offset=indices['offset'],
+                                 shape=(indices['count'],)) if indices['count'] else np.zeros(0, dtype=np.uint32)
+
+    @staticmethod
+    def open_for(obj_path:Path) -> 'MeshCache|None':
+        """Кэш модели, если он есть и построен из текущего файла obj_path"""
+        cache_path = mesh_cache_path(obj_path)
+        if not cache_path.is_file():
+            return None
+        try:
+            cache = MeshCache(cache_path)
+            if cache.source != _source_stamp(obj_path):
+                return None
+            return cache
+        except Exception as e:
+            logging.warning(f'Failed to open mesh cache {cache_path}, it is ignored. Reason: {e}')
+            return None
+
+    def object_vertices(self, obj:MeshCacheObject) -> np.ndarray:
+        return self.vertices[obj.vertex_offset:obj.vertex_offset + obj.vertex_count]
+
+    def object_indices(self, obj:MeshCacheObject) -> np.ndarray:
+        return self.indices[obj.index_offset:obj.index_offset + obj.index_count]
+
+    def obj_meshes(self) -> OBJMeshes:
+        """Треугольники всех объектов в виде OBJMeshes, как их читает read_obj_meshes"""
+        triangles = [self.object_indices(obj).reshape(-1, 3).astype(np.int32) + obj.vertex_offset for obj in self.objects]
+        triangle_obj_indices = [np.full(obj.index_count // 3, i, dtype=np.int32) for i, obj in enumerate(self.objects)]
+        return OBJMeshes(vertices=np.array(self.vertices[:, :3]),
+                         triangles=np.concatenate(triangles) if triangles else np.zeros((0, 3), dtype=np.int32),
+                         triangle_obj_indices=np.concatenate(triangle_obj_indices) if triangle_obj_indices else np.zeros(0, dtype=np.int32),
+                         obj_names=[obj.name for obj in self.objects])
+
+
+def _parse_mtl_materials(mtl_path:Path, model_dir:Path) -> list[MeshCacheMaterial]:
+    materials = []
+    current:dict|None = None
+
+    def finish():
+        if current is not None:
+            materials.append(MeshCacheMaterial(**current))
+
+    with open(mtl_path, 'r') as file:
+        for line in file:
+            parts = line.split(maxsplit=1)
+            if not parts:
+                continue
+            key, value = parts[0], parts[1].strip() if len(parts) > 1 else ''
+            if key == 'newmtl':
+                finish()
+                current = dict(name=value, ambient=(0.0, 0.0, 0.0), diffuse=(0.8, 0.8, 0.8), specular=(0.0, 0.0, 0.0),
+                               shininess=0.0, opacity=1.0, diffuse_map=None)
+            elif current is None:
+                continue
+            elif key in ('Ka', 'Kd', 'Ks'):
+                rgb = tuple(float(c) for c in value.split()[:3])
+                current[{'Ka': 'ambient', 'Kd': 'diffuse', 'Ks': 'specular'}[key]] = rgb
+            elif key == 'Ns':
+                current['shininess'] = float(value)
+            elif key == 'd':
+                current['opacity'] = float(value)
+            elif key == 'Tr':
+                current['opacity'] = 1 - float(value)
+            elif key == 'map_Kd':
+                texture = value.strip('"\'')
+                current['diffuse_map'] = os.path.relpath(mtl_path.parent / texture, model_dir).replace(os.sep, '/')
+    finish()
+    return materials
+
+
+class _ObjectBuilder:
+    def __init__(self, name:str) -> None:
+        self.name = name
+        # (position, texcoord, normal) indices -> vertex index in the object
+        self.vertex_keys:dict[tuple[int, int, int], int] = dict()
+        self.parts:list[tuple[str|None, list[int]]] = []
+
+    def indices_for(self, material:str|None) -> list[int]:
+        if not self.parts or self.parts[-1][0] != material:
+            self.parts.append((material, []))
+        return self.parts[-1][1]
+
+    def vertex(self, key:tuple[int, int, int]) -> int:
+        index = self.vertex_keys.get(key)
+        if index is None:
+            index = self.vertex_keys[key] = len(self.vertex_keys)
+        return index
+
+
+def write_mesh_cache(obj_path:Path) -> Path:
+    """
+    Разбирает OBJ и его MTL и записывает кэш рядом с моделью.
+    Объекты и триангуляция полигонов веером совпадают с read_obj_meshes.
+    """
+    obj_path = Path(obj_path)
+    model_dir = obj_path.parent
+    positions:list[tuple[float, float, float]] = []
+    texcoords:list[tuple[float, float]] = []
+    normals:list[tuple[float, float, float]] = []
+    materials:list[MeshCacheMaterial] = []
+    objects:dict[str, _ObjectBuilder] = dict()
+    current:_ObjectBuilder|None = None
+    material:str|None = None
+    has_objects = False
+
+    def set_current_obj(name:str):
+        nonlocal current
+        current = objects.get(name)
+        if current is None:
+            current = objects[name] = _ObjectBuilder(name)
+
+    with open(obj_path, 'r') as file:
+        for line in file:
+            if line.startswith('v '):
+                x, y, z = line.split()[1:4]
+                positions.append((float(x), float(y), float(z)))
+            elif line.startswith('vt '):
+                uv = line.split()[1:3]
+                texcoords.append((float(uv[0]), float(uv[1]) if len(uv) > 1 else 0.0))
+            elif line.startswith('vn '):
+                x, y, z = line.split()[1:4]
+                normals.append((float(x), float(y), float(z)))
+            elif line.startswith('f '):
+                if current is None:
+                    set_current_obj('')
+                assert current is not None
+                face = []
+                for corner in line.split()[1:]:
+                    refs = (corner.split('/') + ['', ''])[:3]
+                    v, t, n = (int(r) if r else 0 for r in refs)
+                    # 0 marks a missing texcoord or normal, negative indices count from the end
+                    face.append(current.vertex((v - 1 if v > 0 else len(positions) + v,
+                                                t - 1 if t > 0 else (len(texcoords) + t if t < 0 else -1),
+                                                n - 1 if n > 0 else (len(normals) + n if n < 0 else -1))))
+                indices = current.indices_for(material)
+                for i in range(1, len(face) - 1):
+                    indices.extend((face[0], face[i], face[i+1]))
+            elif line.startswith('o '):
+                has_objects = True
+                set_current_obj(line[2:].strip())
+            elif line.startswith('g ') and not has_objects:
+                set_current_obj(line[2:].strip())
+            elif line.startswith('usemtl '):
+                material = line[7:].strip()
+            elif line.startswith('mtllib '):
+                mtl_path = model_dir / line[7:].strip()
+                if mtl_path.is_file():
+                    materials.extend(_parse_mtl_materials(mtl_path, model_dir))
+
+    positions_arr = np.array(positions, dtype=np.float32).reshape(-1, 3)
+    texcoords_arr = np.array(texcoords, dtype=np.float32).reshape(-1, 2)
+    normals_arr = np.array(normals, dtype=np.float32).reshape(-1, 3)
+
+    vertices_chunks, indices_chunks, objects_header = [], [], []
+    vertex_offset = index_offset = 0
+    for obj in objects.values():
+        keys = np.array(list(obj.vertex_keys), dtype=np.int64).reshape(-1, 3)
+        indices = np.array([i for _, part in obj.parts for i in part], dtype=np.uint32)
+        if not len(indices):
+            continue
+        vertices = np.zeros((len(keys), VERTEX_FLOATS), dtype=np.float32)
+        vertices[:, :3] = positions_arr[keys[:, 0]]
+        has_uv = keys[:, 1] >= 0
+        vertices[has_uv, 6:8] = texcoords_arr[keys[has_uv, 1]]
+        has_normal = keys[:, 2] >= 0
+        vertices[has_normal, 3:6] = normals_arr[keys[has_normal, 2]]
+        if not has_normal.all():
+            # smooth normals from the faces around the vertices without them
+            triangles = indices.reshape(-1, 3)
+            corners = vertices[triangles, :3]
+            face_normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+            accumulated = np.zeros((len(keys), 3), dtype=np.float32)
+            for k in range(3):
+                np.add.at(accumulated, triangles[:, k], face_normals)
+            lengths = np.linalg.norm(accumulated, axis=1, keepdims=True)
+            accumulated /= np.where(lengths > 0, lengths, 1)
+            vertices[~has_normal, 3:6] = accumulated[~has_normal]
+
+        parts_header, part_offset = [], 0
+        for part_material, part in obj.parts:
+            parts_header.append({'material': part_material, 'index_offset': part_offset, 'index_count': len(part)})
+            part_offset += len(part)
+        objects_header.append({'name': obj.name,
+                               'vertex_offset': vertex_offset, 'vertex_count': len(vertices),
+                               'index_offset': index_offset, 'index_count': len(indices),
+                               'aabb_min': vertices[:, :3].min(axis=0).tolist(),
+                               'aabb_max': vertices[:, :3].max(axis=0).tolist(),
+                               'parts': parts_header})
+        vertices_chunks.append(vertices)
+        indices_chunks.append(indices)
+        vertex_offset += len(vertices)
+        index_offset += len(indices)
+
+    all_vertices = np.concatenate(vertices_chunks) if vertices_chunks else np.zeros((0, VERTEX_FLOATS), dtype=np.float32)
+    all_indices = np.concatenate(indices_chunks) if indices_chunks else np.zeros(0, dtype=np.uint32)
+    header = {'source': _source_stamp(obj_path),
+              'materials': [m.__dict__ for m in materials],
+              'objects': objects_header,
+              'vertices': {'offset': 0, 'count': len(all_vertices)},
+              'indices': {'offset': 0, 'count': len(all_indices)}}
+
+    def aligned(offset:int) -> int:
+        return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+    # the data offsets are part of the header, its size is fixed by reserving space for them
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_offset = aligned(len(MESH_CACHE_MAGIC) + 4 + len(header_bytes) + 64)
+    header['vertices']['offset'] = data_offset
+    header['indices']['offset'] = aligned(data_offset + all_vertices.nbytes)
+    header_bytes = json.dumps(header).encode('utf-8')
+    assert len(MESH_CACHE_MAGIC) + 4 + len(header_bytes) <= data_offset
+
+    cache_path = mesh_cache_path(obj_path)
+    tmp_path = cache_path.with_name(f'{cache_path.name}.{uuid4().hex}.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(MESH_CACHE_MAGIC)
+        f.write(struct.pack('<I', len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b'\0' * (header['vertices']['offset'] - f.tell()))
+        f.write(all_vertices.tobytes())
+        f.write(b'\0' * (header['indices']['offset'] - f.tell()))
+        f.write(all_indices.tobytes())
+    try:
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return cache_path
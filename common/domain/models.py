@@ -1,17 +1,20 @@
 from collections import defaultdict
 from enum import Enum
 from pathlib import Path
-from typing import Any, TypeGuard, cast
-from PySide6.QtCore import QObject, Signal, Slot
+from types import MappingProxyType
+from typing import Any, Mapping, TypeGuard, cast
+from PySide6.QtCore import QObject, QTimer, Signal, Slot
 from PySide6.QtGui import QColor, QVector3D, QQuaternion
 from dataclasses import dataclass
 from datetime import timedelta, datetime
 import numpy as np
-import pandas as pd
+from common.domain.attention_tensor import AttentionTensor
+from common.domain.hits_window import HitsWindow
+from common.domain.rule_deadlines import RuleDeadlineScheduler
 from common.domain.scene_timer import RealTimeSceneUpdateTimer, SceneUpdateTimer
 from common.dtos.descriptions import AttentionRuleDescription, AttentionSceneDescription, PersonDescription, SceneObjDescription
 from common.dtos.head_data import HeadData
-from common.dtos.hits import PerformedRayCastResult, AggregatedHit, SceneObjAttentionHits
+from common.dtos.hits import ColumnarRayCastResult, PerformedRayCastResult, AggregatedHit, SceneObjAttentionHits
 from common.dtos.states import AttentionRuleState, AttentionSceneState, PersonState, SceneObjState
 
 from .interfaces import AttentionRule, AttentionScene, Person, SceneElement, SceneObj
@@ -29,9 +32,6 @@ class ElementModel(SceneElement):
     added_to_parent_element = Signal(object)
     removed_from_parent_element = Signal(object)
 
-    _some_parent_selected_changed = Signal(bool)
-    _some_parent_errored_changed = Signal(bool)
-
     def __init__(self, element_id:Any, element_name:str, scene:'AttentionSceneModel', parent=None):
         super().__init__(parent)
         self.state_changed = None
@@ -46,8 +46,12 @@ class ElementModel(SceneElement):
         self._is_errored = False
         self._is_tracking = True
 
-        self._cached_some_parent_selected = False
-        self._cached_some_parent_errored = False
+        # number of direct parents having selected/errored state, updated by the parents themselves
+        self._selected_parents_count = 0
+        self._errored_parents_count = 0
+        # last values sent with has_*_state_changed, the signals are batched by the scene
+        self._emitted_has_selected_state = False
+        self._emitted_has_errored_state = False
         
         self._scene:AttentionSceneModel = scene
 
@@ -110,10 +114,10 @@ class ElementModel(SceneElement):
         return self._is_tracking
 
     def has_selected_state(self):
-        return self._is_selected or self._cached_some_parent_selected
+        return self._is_selected or self._selected_parents_count > 0
     
     def has_errored_state(self):
-        return self._is_errored or self._cached_some_parent_errored
+        return self._is_errored or self._errored_parents_count > 0
     
     def has_tracking_state(self):
         raise NotImplementedError()
@@ -121,14 +125,18 @@ class ElementModel(SceneElement):
     def set_selected(self, val):
         val = bool(val)
         if self._is_selected != val:
+            had_selected_state = self.has_selected_state()
             self._is_selected = val
             self.is_selected_changed.emit(val)
+            self._propagate_selected_state(had_selected_state)
 
     def set_errored(self, val):
         val = bool(val)
         if self._is_errored != val:
+            had_errored_state = self.has_errored_state()
             self._is_errored = val
             self.is_errored_changed.emit(val)
+            self._propagate_errored_state(had_errored_state)
     
     def set_tracking(self, val):
         val = bool(val)
@@ -150,30 +158,14 @@ class ElementModel(SceneElement):
         self._child_elements.add(child_element)
         child_element._parent_elements.add(self)
 
-        self.is_selected_changed.connect(child_element._handle_some_parent_selected_changed)
-        self._some_parent_selected_changed.connect(child_element._handle_some_parent_selected_changed)
-
-        self.is_errored_changed.connect(child_element._handle_some_parent_errored_changed)
-        self._some_parent_errored_changed.connect(child_element._handle_some_parent_errored_changed)
-
         # fire signal of adding
         self.child_element_added.emit(child_element)
         child_element.added_to_parent_element.emit(self)
 
-        child_element._update_some_parent_selected()
-        child_element._update_some_parent_errored()
-
-    @Slot(bool)
-    def _handle_some_parent_selected_changed(self, val:bool):
-        if self._cached_some_parent_selected != val:
-            self._cached_some_parent_selected = val
-            self._some_parent_selected_changed.emit(val)
-
-    @Slot(bool)
-    def _handle_some_parent_errored_changed(self, val:bool):
-        if self._cached_some_parent_errored != val:
-            self._cached_some_parent_errored = val
-            self._some_parent_errored_changed.emit(val)
+        if self.has_selected_state():
+            child_element._add_selected_parents(1)
+        if self.has_errored_state():
+            child_element._add_errored_parents(1)
 
     def before_add_to_parent(self, parent:'ElementModel'):
         raise NotImplementedError(f'{self} does not support parent adding')
@@ -195,23 +187,52 @@ class ElementModel(SceneElement):
             self.child_element_removed.emit(child_element)
             child_element.removed_from_parent_element.emit(self)
 
-            child_element._update_some_parent_selected()
-            child_element._update_some_parent_errored()
+            if self.has_selected_state():
+                child_element._add_selected_parents(-1)
+            if self.has_errored_state():
+                child_element._add_errored_parents(-1)
 
         except KeyError as e:
             raise RuntimeError(f'Cannot remove child element that was not added, {e}')
-    
-    def _update_some_parent_selected(self):
-        old_val = self._cached_some_parent_selected
-        self._cached_some_parent_selected = any([parent._is_selected for parent in self._ravel_parents()])
-        if old_val != self._cached_some_parent_selected:
-            self._some_parent_selected_changed.emit(self._cached_some_parent_selected)
-    
-    def _update_some_parent_errored(self):
-        old_val = self._cached_some_parent_errored
-        self._cached_some_parent_errored = any([parent._is_errored for parent in self._ravel_parents()])
-        if old_val != self._cached_some_parent_errored:
-            self._some_parent_errored_changed.emit(self._cached_some_parent_errored)
+
+    def _add_selected_parents(self, delta:int):
+        had_selected_state = self.has_selected_state()
+        self._selected_parents_count += delta
+        self._propagate_selected_state(had_selected_state)
+
+    def _add_errored_parents(self, delta:int):
+        had_errored_state = self.has_errored_state()
+        self._errored_parents_count += delta
+        self._propagate_errored_state(had_errored_state)
+
+    def _propagate_selected_state(self, had_selected_state:bool):
+        """
+        Если состояние выделения элемента изменилось, обновляет счётчики прямых потомков,
+        каждое ребро обрабатывается за O(1)
+        """
+        if self.has_selected_state() == had_selected_state:
+            return
+        delta = -1 if had_selected_state else 1
+        for child in self._child_elements:
+            child._add_selected_parents(delta)
+        self._scene._element_state_changed(self)
+
+    def _propagate_errored_state(self, had_errored_state:bool):
+        if self.has_errored_state() == had_errored_state:
+            return
+        delta = -1 if had_errored_state else 1
+        for child in self._child_elements:
+            child._add_errored_parents(delta)
+        self._scene._element_state_changed(self)
+
+    def _emit_state_changes(self):
+        """Отправляет has_*_state_changed, если итоговое состояние отличается от отправленного ранее"""
+        if (has_selected_state:=self.has_selected_state()) != self._emitted_has_selected_state:
+            self._emitted_has_selected_state = has_selected_state
+            self.has_selected_state_changed.emit(has_selected_state)
+        if (has_errored_state:=self.has_errored_state()) != self._emitted_has_errored_state:
+            self._emitted_has_errored_state = has_errored_state
+            self.has_errored_state_changed.emit(has_errored_state)
 
 
 class SceneObjModel(ElementModel, SceneObj):
@@ -221,9 +242,10 @@ class SceneObjModel(ElementModel, SceneObj):
 
     def __init__(self, element_id:str, element_name:str, scene:'AttentionSceneModel', parent=None):
         super().__init__(element_id, element_name, scene, parent)
+        self._scene_obj_index = -1
         self._keep_attention_timedelta = timedelta(seconds=1)
         self._timestamp2aggregated_attention_hits:dict[datetime, AggregatedHit] = dict()
-        self._person_id2attention_hits:dict[int, list[tuple[datetime, int]]] = dict()
+        self._person_id2hits_window:dict[int, HitsWindow] = dict()
         self.removed_from_parent_element.connect(self._handle_removed_from_parent)
         self.added_to_parent_element.connect(self._handle_added_to_parent)
 
@@ -236,6 +258,8 @@ class SceneObjModel(ElementModel, SceneObj):
         old_val = self._keep_attention_timedelta
         self._keep_attention_timedelta = val
         if old_val != val:
+            for hits_window in self._person_id2hits_window.values():
+                hits_window.set_window(val)
             self.keep_attention_timedelta_changed.emit(val)
 
     def before_add_to_parent(self, parent: ElementModel):
@@ -255,34 +279,37 @@ class SceneObjModel(ElementModel, SceneObj):
     def rules(self) -> list[AttentionRule]:
         return cast(list[AttentionRule], list(self._parent_elements)) 
 
+    def aggregation_hits_threshold(self) -> float:
+        total_seconds = self._keep_attention_timedelta.total_seconds()
+        return total_seconds * self.NUM_HITS_PER_CASTER * self.EXPECTED_CASTS_PER_SECOND * self.MIN_CASTS_DENSITY_TO_AQUIRE_ATTENTION
+
     def register_attention(self, attention_hit:SceneObjAttentionHits) -> None:
-        if attention_hit.person_id not in self._person_id2attention_hits:
-            self._person_id2attention_hits[attention_hit.person_id] = [(attention_hit.timestamp, len(attention_hit.hit_poses_local))]
-        else:
-            self._person_id2attention_hits[attention_hit.person_id].append((attention_hit.timestamp, len(attention_hit.hit_poses_local)))
+        self.register_attention_hits(attention_hit.person_id, attention_hit.timestamp, len(attention_hit.hit_poses_local))
         self.registered_attention.emit(attention_hit)
 
+    def register_attention_hits(self, person_id:int, timestamp:datetime, num_hits:int) -> None:
+        """Учитывает попадания без построения SceneObjAttentionHits, registered_attention не отправляется"""
+        if (attention_tensor:=self._scene.attention_tensor()) is not None:
+            attention_tensor.register(self._scene_obj_index, person_id, timestamp, num_hits)
+            return
+        hits_window = self._person_id2hits_window.get(person_id)
+        if hits_window is None:
+            hits_window = HitsWindow(self._keep_attention_timedelta)
+            self._person_id2hits_window[person_id] = hits_window
+        hits_window.push(timestamp, num_hits)
+
     def process_hits_aggregation(self, current_timestamp:datetime) -> None:
         aggregated_hits:list[AggregatedHit] = []
-        
-        total_seconds = self._keep_attention_timedelta.total_seconds()
-        num_hits_threshold = total_seconds * self.NUM_HITS_PER_CASTER * self.EXPECTED_CASTS_PER_SECOND * self.MIN_CASTS_DENSITY_TO_AQUIRE_ATTENTION
-        # print(f'{self.element_name()=} {num_hits_threshold=} {self._keep_attention_timedelta=}', end=' ')
-        keep_delta = self._keep_attention_timedelta
-
-        for person_id, timestamp_num_hits_pairs in self._person_id2attention_hits.items():
-            timestamps = [pair[0] for pair in timestamp_num_hits_pairs]
-            hits_per_timestamp = [pair[1] for pair in timestamp_num_hits_pairs]
-            # print(f'{hits_per_timestamp=}', end=' ')
-            running_num_hits = pd.Series(data=hits_per_timestamp, index=pd.to_datetime(timestamps)).sort_index().\
-                                            rolling(keep_delta, min_periods=1).sum()
-            
-            estimated_max_hits_per_keep_delta = running_num_hits.max()
-            estimated_max_hits_timestamp = timestamps[running_num_hits.argmax()]
-            # print(f'{estimated_max_hits_per_keep_delta=}', end=' ')
+        num_hits_threshold = self.aggregation_hits_threshold()
+
+        for person_id, hits_window in self._person_id2hits_window.items():
+            max_hits = hits_window.max_window_sum()
+            if max_hits is None:
+                continue
+            estimated_max_hits_per_keep_delta, estimated_max_hits_timestamp = max_hits
             if estimated_max_hits_per_keep_delta >= num_hits_threshold:
                 aggregated_hits.append(AggregatedHit(estimated_max_hits_timestamp, person_id))
-        # print()
+
         self._filter_outdated_attention_hits(current_timestamp - self._keep_attention_timedelta)
         if aggregated_hits:
             self.set_aggregated_hits(aggregated_hits)
@@ -291,7 +318,7 @@ class SceneObjModel(ElementModel, SceneObj):
         added_hits:list[AggregatedHit] = []
         for hit in hits:
             if hit.timestamp not in self._timestamp2aggregated_attention_hits:
-                self._timestamp2aggregated_attention_hits
+                self._timestamp2aggregated_attention_hits[hit.timestamp] = hit
                 added_hits.append(hit)
         if added_hits:
             self.aggregated_attention_hits_added.emit(added_hits)
@@ -299,18 +326,18 @@ class SceneObjModel(ElementModel, SceneObj):
         
     def filter_outdated_aggregated_hits(self, keep_timestamp:datetime):
         new_aggreagated_hits = {timestamp:hit for timestamp, hit in self._timestamp2aggregated_attention_hits.items() if timestamp >= keep_timestamp}
-        if len(self._timestamp2aggregated_attention_hits) != new_aggreagated_hits:
+        if len(self._timestamp2aggregated_attention_hits) != len(new_aggreagated_hits):
             self._timestamp2aggregated_attention_hits = new_aggreagated_hits
             self.aggregated_attention_hits_changed.emit()
     
-    def _filter_outdated_attention_hits(self, keep_timestamp:datetime):
-        new_person_id2attention_hits:dict[int, list[tuple[datetime, int]]] = dict()
-        for person_id, hits_data in self._person_id2attention_hits.items():
-            not_outdated_hits_data = list(filter(lambda hit_data: hit_data[0] > keep_timestamp, hits_data))
-            if not_outdated_hits_data:
-                new_person_id2attention_hits[person_id] = not_outdated_hits_data
+    def clear_attention_hits(self):
+        self._person_id2hits_window.clear()
 
-        self._person_id2attention_hits = new_person_id2attention_hits
+    def _filter_outdated_attention_hits(self, keep_timestamp:datetime):
+        for person_id, hits_window in list(self._person_id2hits_window.items()):
+            hits_window.drop_not_after(keep_timestamp)
+            if len(hits_window) == 0:
+                del self._person_id2hits_window[person_id]
 
     def aggregated_hits(self) -> list[AggregatedHit]:
         return list(self._timestamp2aggregated_attention_hits.values())
@@ -318,17 +345,16 @@ class SceneObjModel(ElementModel, SceneObj):
     def attention_accumulation_progress(self, current_time:datetime):
         num_hits_threshold = self.NUM_HITS_PER_CASTER * self.EXPECTED_CASTS_PER_SECOND * self.MIN_CASTS_DENSITY_TO_AQUIRE_ATTENTION
         
-        keep_delta = self._keep_attention_timedelta
+        if (attention_tensor:=self._scene.attention_tensor()) is not None:
+            estimated_max_hits_per_keep_delta = attention_tensor.max_window_sum_before(self._scene_obj_index, current_time)
+            if estimated_max_hits_per_keep_delta is None:
+                return 0
+            return min(estimated_max_hits_per_keep_delta / num_hits_threshold, 1)
+
         max_progress = 0
-        for person, timestamp_num_hits_pairs in self._person_id2attention_hits.items():
-            precending_to_current_timestamp_pairs = list(filter(lambda pair: pair[0] < current_time, timestamp_num_hits_pairs))
-            timestamps = [pair[0] for pair in precending_to_current_timestamp_pairs]
-            hits_per_timestamp = [pair[1] for pair in precending_to_current_timestamp_pairs]
-            if len(precending_to_current_timestamp_pairs) > 0:
-                running_mean_num_hits = pd.Series(data=hits_per_timestamp, index=pd.to_datetime(timestamps)).sort_index().\
-                                                rolling(keep_delta, min_periods=1).sum()
-                
-                estimated_max_hits_per_keep_delta = running_mean_num_hits.max()
+        for hits_window in self._person_id2hits_window.values():
+            estimated_max_hits_per_keep_delta = hits_window.max_window_sum_before(current_time)
+            if estimated_max_hits_per_keep_delta is not None:
                 max_progress = min(max(max_progress, estimated_max_hits_per_keep_delta / num_hits_threshold), 1)
         
         return max_progress
@@ -347,7 +373,7 @@ class PersonModel(ElementModel, Person):
         self._head_data = HeadData()
         self.added_to_parent_element.connect(self._handle_added_to_parent)
         self.removed_from_parent_element.connect(self._handle_removed_from_parent)
-        self._performed_ray_cast_result:PerformedRayCastResult|None = None
+        self._performed_ray_cast_result:ColumnarRayCastResult|None = None
 
         if not isinstance(head_color, QColor):
             raise TypeError()
@@ -367,33 +393,20 @@ class PersonModel(ElementModel, Person):
         assert isinstance(parent, AttentionRuleModel)
         self.added_to_rule.emit(parent)
     
-    def performed_ray_cast_result(self) -> PerformedRayCastResult|None:
+    def performed_ray_cast_result(self) -> ColumnarRayCastResult|None:
         return self._performed_ray_cast_result
 
-    def set_performed_ray_cast_result(self, cast_result:PerformedRayCastResult):
+    def set_performed_ray_cast_result(self, cast_result:ColumnarRayCastResult|PerformedRayCastResult):
+        if isinstance(cast_result, PerformedRayCastResult):
+            cast_result = ColumnarRayCastResult.from_dto(cast_result)
         self._performed_ray_cast_result = cast_result
         self.performed_ray_cast_result_changed.emit()
 
-        scene_obj_grouping:dict[Any, tuple[list[QVector3D], list[QVector3D]]] = dict()
-
-        for scene_obj_id, w, l in zip(cast_result.scene_obj_ids, cast_result.hits_global, cast_result.hits_local):
-            if scene_obj_id not in scene_obj_grouping:
-                scene_obj_grouping[scene_obj_id] = ([], [])
-            scene_obj_grouping[scene_obj_id][0].append(w)
-            scene_obj_grouping[scene_obj_id][1].append(l)
-        
-        scene_objs_by_id = self._scene.scene_objs_by_id()
-
-        for scene_obj_id, hit_poses in scene_obj_grouping.items():
-            attenion_hits = SceneObjAttentionHits(timestamp=cast_result.timestamp,
-                                  person_id=self.element_id(),
-                                  scene_obj_id=scene_obj_id,
-                                  hit_poses_global=hit_poses[0],
-                                  hit_poses_local=hit_poses[1]
-                                  )
-
-            if scene_obj := scene_objs_by_id.get(scene_obj_id):
-                scene_obj.register_attention(attenion_hits)
+        # the obj ids table is interned once, then hits are counted per scene obj index, hits on unknown scene objs are dropped
+        hits_obj_indices = self._scene.scene_obj_indices(cast_result.obj_ids)[cast_result.obj_index]
+        hits_count = np.bincount(hits_obj_indices[hits_obj_indices >= 0])
+        for obj_index in np.flatnonzero(hits_count).tolist():
+            self._scene.scene_obj_by_index(obj_index).register_attention_hits(self.element_id(), cast_result.timestamp, int(hits_count[obj_index]))
     
     @Slot(object)
     def _handle_removed_from_parent(self, parent:ElementModel):
@@ -532,13 +545,8 @@ class AttentionRuleModel(AttentionRule, ElementModel):
     def set_last_refresh_timestamp(self, timestamp:datetime):
         if self._last_refresh_timestamp is None or self._last_refresh_timestamp < timestamp:
             self._last_refresh_timestamp = timestamp
-            self.last_refresh_timestamp_changed.emit(timestamp)        
-        self.compute_error_state()
-
-    def compute_error_state(self):
-        time_until_error = self.time_util_error(self._scene.timer().now())
-        # print(f'{time_until_error=}')
-        self.set_errored(time_until_error.total_seconds() < 0)
+            # the scene's RuleDeadlineScheduler re-keys the rule deadline and updates the error state
+            self.last_refresh_timestamp_changed.emit(timestamp)
 
     @Slot()
     def _handle_aggregated_hits(self) -> None:
@@ -587,12 +595,74 @@ class AttentionSceneModel(AttentionScene):
                  parent=None) -> None:
         super().__init__(parent)
         self._person_models:list[PersonModel] = list()
+        self._elements_with_changed_state:set[ElementModel] = set()
         self._scene_obj_models:list[SceneObjModel] = [SceneObjModel(_id, _id, self, self) for _id in scene_obj_ids]
         self._timer:SceneUpdateTimer = RealTimeSceneUpdateTimer()
         self._attention_rule_models:list[AttentionRuleModel] = list()
 
+        # id indexes are kept up to date on create and remove, the views are handed out instead of copies
+        self._scene_obj_index_by_id:dict[Any, int] = {scene_obj.element_id():ind for ind, scene_obj in enumerate(self._scene_obj_models)}
+        self._scene_objs_by_id:dict[Any, SceneObjModel] = {scene_obj.element_id():scene_obj for scene_obj in self._scene_obj_models}
+        self._persons_by_id:dict[Any, PersonModel] = dict()
+        self._attention_rules_by_id:dict[Any, AttentionRuleModel] = dict()
+        self._scene_objs_by_id_view = MappingProxyType(self._scene_objs_by_id)
+        self._persons_by_id_view = MappingProxyType(self._persons_by_id)
+        self._attention_rules_by_id_view = MappingProxyType(self._attention_rules_by_id)
+        # deadlines are measured by the scene timer, set_timer may replace it
+        self._rule_deadlines = RuleDeadlineScheduler(now=lambda: self._timer.now())
+
         self._reserved_numeric_ids:set[int] = set()
 
+        self._attention_tensor:AttentionTensor|None = None
+        self._max_keep_attention_timedelta = timedelta()
+        for scene_obj in self._scene_obj_models:
+            scene_obj._scene_obj_index = self._scene_obj_index_by_id[scene_obj.element_id()]
+            scene_obj.keep_attention_timedelta_changed.connect(self._handle_scene_obj_keep_attention_timedelta_changed)
+            scene_obj.aggregated_attention_hits_added.connect(self._handle_scene_obj_aggregated_hits_added)
+        self._update_max_keep_attention_timedelta()
+        self.set_batched_hits_aggregation(True)
+
+    def attention_tensor(self) -> AttentionTensor|None:
+        return self._attention_tensor
+
+    def batched_hits_aggregation(self) -> bool:
+        return self._attention_tensor is not None
+
+    def set_batched_hits_aggregation(self, enabled:bool):
+        """
+        Включает агрегацию попаданий сразу по всей сцене через AttentionTensor вместо обхода каждого SceneObjModel.
+        Накопленные до переключения попадания сбрасываются.
+        """
+        enabled = bool(enabled)
+        if enabled == self.batched_hits_aggregation():
+            return
+        if enabled:
+            self._attention_tensor = AttentionTensor([scene_obj.keep_attention_timedelta() for scene_obj in self._scene_obj_models],
+                                                     [scene_obj.aggregation_hits_threshold() for scene_obj in self._scene_obj_models])
+            for scene_obj in self._scene_obj_models:
+                scene_obj.clear_attention_hits()
+                if aggregated_hits := scene_obj.aggregated_hits():
+                    self._attention_tensor.set_oldest_aggregated_hit(scene_obj._scene_obj_index, min(hit.timestamp for hit in aggregated_hits))
+        else:
+            self._attention_tensor = None
+
+    def _update_max_keep_attention_timedelta(self):
+        timedeltas = [scene_obj.keep_attention_timedelta() for scene_obj in self._scene_obj_models] + [timedelta(seconds=20)]
+        self._max_keep_attention_timedelta = max(timedeltas)
+
+    @Slot(timedelta)
+    def _handle_scene_obj_keep_attention_timedelta_changed(self, tdelta:timedelta):
+        self._update_max_keep_attention_timedelta()
+        scene_obj = self.sender()
+        if self._attention_tensor is not None and isinstance(scene_obj, SceneObjModel):
+            self._attention_tensor.set_obj_window(scene_obj._scene_obj_index, tdelta, scene_obj.aggregation_hits_threshold())
+
+    @Slot(list)
+    def _handle_scene_obj_aggregated_hits_added(self, hits:list[AggregatedHit]):
+        scene_obj = self.sender()
+        if self._attention_tensor is not None and isinstance(scene_obj, SceneObjModel) and hits:
+            self._attention_tensor.note_aggregated_hit(scene_obj._scene_obj_index, min(hit.timestamp for hit in hits))
+
     def _generate_new_id(self):
         if len(self._reserved_numeric_ids) == 0:
             id = 0
@@ -618,9 +688,8 @@ class AttentionSceneModel(AttentionScene):
         self._create_person_from_description(description, is_restored=True)
 
     def _create_person_from_description(self, description:PersonDescription, is_restored=False):
-        for person in self._person_models:
-            if person.element_id() == description.id:
-                raise ValueError(f'Cannot create second person with id={description.id}')
+        if description.id in self._persons_by_id:
+            raise ValueError(f'Cannot create second person with id={description.id}')
         if is_restored:
             self._reserve_numeric_id(description.id)
         person = PersonModel(head_color=description.head_color,
@@ -631,6 +700,7 @@ class AttentionSceneModel(AttentionScene):
                              scene=self)
         
         self._person_models.append(person)
+        self._persons_by_id[person.element_id()] = person
         self.person_created.emit(person)
 
     def create_attention_rule(self):
@@ -642,11 +712,11 @@ class AttentionSceneModel(AttentionScene):
         self._create_attention_rule_from_description(description, is_restored=True)
 
     def _create_attention_rule_from_description(self, description:AttentionRuleDescription, is_restored=False):
-        if description.id in self.attention_rules_by_id():
+        if description.id in self._attention_rules_by_id:
             raise ValueError(f'Cannot create second rule with id={description.id}')
         
-        person_by_id = self.persons_by_id()
-        scene_obj_by_id = self.scene_objs_by_id()
+        person_by_id = self._persons_by_id
+        scene_obj_by_id = self._scene_objs_by_id
 
         if is_restored:
             self._reserve_numeric_id(description.id)
@@ -656,6 +726,8 @@ class AttentionSceneModel(AttentionScene):
                                             description.without_attention_timedelta,
                                             self, self)
         self._attention_rule_models.append(attention_rule)
+        self._attention_rules_by_id[attention_rule.element_id()] = attention_rule
+        self._rule_deadlines.add_rule(attention_rule)
         self.attention_rule_created.emit(attention_rule)
 
         for person_id in description.person_ids:
@@ -687,6 +759,7 @@ class AttentionSceneModel(AttentionScene):
         self._timer.disconnect(self)
         self._timer = timer
         self._timer.triggered_scene_update.connect(self._triggered_scene_update)
+        self._rule_deadlines.reschedule()
 
     @Slot()
     def _triggered_scene_update(self):
@@ -697,9 +770,12 @@ class AttentionSceneModel(AttentionScene):
             raise RuntimeError("You may not remove SceneObjModel from scene. If that a case, remoe it in your 3d editor")
         elif isinstance(element, PersonModel):
             self._person_models.remove(element)
+            del self._persons_by_id[element.element_id()]
             self.person_removed.emit(element)
         elif isinstance(element, AttentionRuleModel):
             self._attention_rule_models.remove(element)
+            del self._attention_rules_by_id[element.element_id()]
+            self._rule_deadlines.remove_rule(element)
             self.attention_rule_removed.emit(element)
 
     def export_state(self) -> AttentionSceneState:
@@ -710,7 +786,7 @@ class AttentionSceneModel(AttentionScene):
                                    person.camera_position(),
                                    person.camera_rotation(),
                                    person.head_data(), 
-                                   person.performed_ray_cast_result())
+                                   cast_result.to_dto() if (cast_result:=person.performed_ray_cast_result()) is not None else None)
             for person in self._person_models
         ]
 
@@ -800,28 +876,66 @@ class AttentionSceneModel(AttentionScene):
 
     
     def trigger_update(self, timestamp:datetime):
-        # timedeltas = [rule.without_attention_timedelta() for rule in self._attention_rule_models] +\
-        #       [scene_obj.keep_attention_timedelta() for scene_obj in self._scene_obj_models] + [timedelta(seconds=1)]
-        timedeltas = [scene_obj.keep_attention_timedelta() for scene_obj in self._scene_obj_models] + [timedelta(seconds=20)]
-        max_time_delta = max(*timedeltas)
-        outdate_timestamp = timestamp - max_time_delta*2
+        outdate_timestamp = timestamp - self._max_keep_attention_timedelta*2
         
         # for rule in self.attention_rules():
         #     rule.set_last_refresh_timestamp(timestamp)
 
-        for scene_obj in self._scene_obj_models:
-            scene_obj.process_hits_aggregation(timestamp)
-            scene_obj.filter_outdated_aggregated_hits(outdate_timestamp)
+        if self._attention_tensor is not None:
+            self._batched_update(self._attention_tensor, timestamp, outdate_timestamp)
+        else:
+            for scene_obj in self._scene_obj_models:
+                scene_obj.process_hits_aggregation(timestamp)
+                scene_obj.filter_outdated_aggregated_hits(outdate_timestamp)
 
+        self._flush_element_state_changes()
         self.updated.emit()
 
+    def _element_state_changed(self, element:ElementModel):
+        # many rules may flip at once, each element notifies about its final state once per cycle
+        if not self._elements_with_changed_state:
+            QTimer.singleShot(0, self._flush_element_state_changes)
+        self._elements_with_changed_state.add(element)
+
+    @Slot()
+    def _flush_element_state_changes(self):
+        elements, self._elements_with_changed_state = self._elements_with_changed_state, set()
+        for element in elements:
+            element._emit_state_changes()
+
+    def _batched_update(self, attention_tensor:AttentionTensor, timestamp:datetime, outdate_timestamp:datetime):
+        obj_indices, person_ids, hit_timestamps = attention_tensor.update(timestamp)
+
+        obj_index2aggregated_hits:dict[int, list[AggregatedHit]] = defaultdict(list)
+        for obj_index, person_id, hit_timestamp in zip(obj_indices.tolist(), person_ids, hit_timestamps):
+            obj_index2aggregated_hits[obj_index].append(AggregatedHit(hit_timestamp, person_id))
+        for obj_index, aggregated_hits in obj_index2aggregated_hits.items():
+            self._scene_obj_models[obj_index].set_aggregated_hits(aggregated_hits)
+
+        for obj_index in attention_tensor.objs_with_outdated_aggregated_hits(outdate_timestamp).tolist():
+            scene_obj = self._scene_obj_models[obj_index]
+            scene_obj.filter_outdated_aggregated_hits(outdate_timestamp)
+            remaining_hits = scene_obj.aggregated_hits()
+            attention_tensor.set_oldest_aggregated_hit(obj_index, min(hit.timestamp for hit in remaining_hits) if remaining_hits else None)
+
         
 
-    def scene_objs_by_id(self):
-        return {scene_obj.element_id():scene_obj for scene_obj in self._scene_obj_models}
+    def scene_objs_by_id(self) -> Mapping[Any, SceneObjModel]:
+        return self._scene_objs_by_id_view
 
-    def persons_by_id(self):
-        return {person.element_id():person for person in self._person_models}
+    def persons_by_id(self) -> Mapping[Any, PersonModel]:
+        return self._persons_by_id_view
     
-    def attention_rules_by_id(self):
-        return {rule.element_id():rule for rule in self._attention_rule_models}
\ No newline at end of file
+    def attention_rules_by_id(self) -> Mapping[Any, AttentionRuleModel]:
+        return self._attention_rules_by_id_view
+
+    def scene_obj_index(self, scene_obj_id:Any) -> int:
+        """Целочисленный индекс объекта сцены, -1 для неизвестного id"""
+        return self._scene_obj_index_by_id.get(scene_obj_id, -1)
+
+    def scene_obj_indices(self, scene_obj_ids:list[Any]) -> np.ndarray:
+        index_by_id = self._scene_obj_index_by_id
+        return np.fromiter((index_by_id.get(_id, -1) for _id in scene_obj_ids), dtype=np.intp, count=len(scene_obj_ids))
+
+    def scene_obj_by_index(self, index:int) -> SceneObjModel:
+        return self._scene_obj_models[index]
\ No newline at end of file
@@ -1,5 +1,7 @@
 import os, re
+from dataclasses import dataclass
 from pathlib import Path
+import numpy as np
 
 def parse_mtl_file(mtl_file_path:Path):
     texture_files:list[str] = []
@@ -77,4 +79,57 @@ class OBJData:
         
 
 
-         
\ No newline at end of file
+         
+
+@dataclass
+class OBJMeshes:
+    vertices:np.ndarray # float32 [n, 3]
+    triangles:np.ndarray # int32 [m, 3], indices into vertices
+    triangle_obj_indices:np.ndarray # int32 [m], indices into obj_names
+    obj_names:list[str]
+
+
+def read_obj_meshes(obj_path:Path) -> OBJMeshes:
+    """
+    Читает вершины и грани OBJ файла, полигоны разбиваются на треугольники веером.
+    Каждый треугольник помечается индексом объекта ('o', либо 'g' если в файле нет 'o').
+    """
+    vertices:list[tuple[float, float, float]] = []
+    triangles:list[tuple[int, int, int]] = []
+    triangle_obj_indices:list[int] = []
+    obj_names:list[str] = []
+    obj_name2index:dict[str, int] = dict()
+    has_objects = False
+    current_obj_index = -1
+
+    def set_current_obj(name:str):
+        nonlocal current_obj_index
+        if name not in obj_name2index:
+            obj_name2index[name] = len(obj_names)
+            obj_names.append(name)
+        current_obj_index = obj_name2index[name]
+
+    with open(obj_path, 'r') as file:
+        for line in file:
+            if line.startswith('v '):
+                x, y, z = line.split()[1:4]
+                vertices.append((float(x), float(y), float(z)))
+            elif line.startswith('f '):
+                num_vertices = len(vertices)
+                face = [int(v.split('/', 1)[0]) for v in line.split()[1:]]
+                face = [i - 1 if i > 0 else num_vertices + i for i in face]
+                if current_obj_index < 0:
+                    set_current_obj('')
+                for i in range(1, len(face) - 1):
+                    triangles.append((face[0], face[i], face[i+1]))
+                    triangle_obj_indices.append(current_obj_index)
+            elif line.startswith('o '):
+                has_objects = True
+                set_current_obj(line[2:].strip())
+            elif line.startswith('g ') and not has_objects:
+                set_current_obj(line[2:].strip())
+
+    return OBJMeshes(vertices=np.array(vertices, dtype=np.float32).reshape(-1, 3),
+                     triangles=np.array(triangles, dtype=np.int32).reshape(-1, 3),
+                     triangle_obj_indices=np.array(triangle_obj_indices, dtype=np.int32),
+                     obj_names=obj_names)
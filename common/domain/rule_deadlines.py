@@ -0,0 +1,111 @@
+from datetime import datetime
+import heapq
+import itertools
+from typing import Callable
+from PySide6.QtCore import QObject, QTimer, Slot
+
+from common.domain.interfaces import AttentionRule
+
+
+class RuleDeadlineScheduler(QObject):
+    """
+    Очередь сроков ошибки правил внимания.
+
+    Срок правила - last_refresh_timestamp + without_attention_timedelta. Сроки хранятся в куче,
+    таймер взводится на ближайший из них, и правило помечается ошибочным ровно в момент истечения.
+    Обновление срока правила добавляет в кучу новую запись за O(log n), устаревшие записи
+    отбрасываются при извлечении. Пока ни один срок не истёк, работы не выполняется.
+    """
+    # the heap is rebuilt once outdated entries outnumber the rules this many times
+    COMPACT_RATIO = 4
+
+    def __init__(self, now:Callable[[], datetime]=datetime.now) -> None:
+        super().__init__()
+        self._now = now
+        self._heap:list[tuple[datetime, int, AttentionRule]] = []
+        # heap entries whose seq does not match the rule's current one are outdated and are skipped
+        self._generations:dict[AttentionRule, int] = dict()
+        self._seq = itertools.count()
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._fire)
+
+    def add_rule(self, rule:AttentionRule):
+        if rule in self._generations:
+            return
+        rule.last_refresh_timestamp_changed.connect(self._handle_rule_deadline_changed)
+        rule.without_attention_timedelta_changed.connect(self._handle_rule_deadline_changed)
+        self._schedule(rule)
+
+    def remove_rule(self, rule:AttentionRule):
+        if self._generations.pop(rule, None) is None:
+            return
+        rule.last_refresh_timestamp_changed.disconnect(self._handle_rule_deadline_changed)
+        rule.without_attention_timedelta_changed.disconnect(self._handle_rule_deadline_changed)
+        self._arm()
+
+    def reschedule(self):
+        """Пересчитывает состояние и сроки всех правил, например после замены часов"""
+        self._heap.clear()
+        for rule in list(self._generations):
+            self._schedule(rule)
+
+    def clear(self):
+        for rule in list(self._generations):
+            self.remove_rule(rule)
+        self._heap.clear()
+
+    def next_deadline(self) -> datetime|None:
+        self._drop_outdated()
+        return self._heap[0][0] if self._heap else None
+
+    @staticmethod
+    def deadline(rule:AttentionRule) -> datetime:
+        return rule.last_refresh_timestamp() + rule.without_attention_timedelta()
+
+    @Slot()
+    def _handle_rule_deadline_changed(self):
+        rule = self.sender()
+        if isinstance(rule, AttentionRule) and rule in self._generations:
+            self._schedule(rule)
+
+    def _schedule(self, rule:AttentionRule):
+        deadline = self.deadline(rule)
+        expired = deadline <= self._now()
+        rule.set_errored(expired)
+        seq = next(self._seq)
+        self._generations[rule] = seq
+        if not expired:
+            heapq.heappush(self._heap, (deadline, seq, rule))
+            if len(self._heap) > self.COMPACT_RATIO * max(len(self._generations), 1):
+                self._compact()
+        self._arm()
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if self._generations.get(entry[2]) == entry[1]]
+        heapq.heapify(self._heap)
+
+    def _drop_outdated(self):
+        heap = self._heap
+        while heap and self._generations.get(heap[0][2]) != heap[0][1]:
+            heapq.heappop(heap)
+
+    def _arm(self):
+        self._drop_outdated()
+        if not self._heap:
+            self._timer.stop()
+            return
+        msec_left = (self._heap[0][0] - self._now()).total_seconds() * 1000
+        # the timer fires no earlier than requested, rounding up avoids an extra wake up
+        self._timer.start(max(int(msec_left) + 1, 0))
+
+    @Slot()
+    def _fire(self):
+        now = self._now()
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            _, seq, rule = heapq.heappop(heap)
+            if self._generations.get(rule) == seq:
+                rule.set_errored(True)
+        self._arm()
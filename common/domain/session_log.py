@@ -0,0 +1,388 @@
+from collections import deque
+from dataclasses import dataclass
+from enum import IntEnum
+import logging
+import mmap
+from pathlib import Path
+import struct
+import threading
+import time
+from typing import Any, Callable, Iterator
+import numpy as np
+
+
+SESSION_LOG_MAGIC = b'ATSLOG01'
+SESSION_LOG_VERSION = 1
+SEGMENT_SUFFIX = '.atlog'
+DEFAULT_SEGMENT_SIZE = 16 << 20
+# magic, version, reserved, segment index, creation time
+_SEGMENT_HEADER = struct.Struct('<8sHHId')
+_DATA_OFFSET = 32
+# payload length, kind, reserved, timestamp
+_RECORD_HEADER = struct.Struct('<IBxxxd')
+_STR_LENGTH = struct.Struct('<H')
+_POSE_FLOATS = 7
+_KEYPOINTS_SHAPE = (478, 3)
+
+
+class SessionRecordKind(IntEnum):
+    FACE_SCAN = 1
+    HEAD_DATA = 2
+    CAST_RESULT = 3
+    AGGREGATED_HITS = 4
+    RULE_STATE = 5
+    SCENE_UPDATE = 6
+
+
+@dataclass(frozen=True)
+class FaceScanRecord:
+    head_visible:bool
+    # x, y, z, qw, qx, qy, qz
+    head_pose:np.ndarray|None
+    keypoints:np.ndarray|None
+
+
+@dataclass(frozen=True)
+class HeadDataRecord:
+    person_id:int
+    # index of the view origin in HeadData.ViewOrigin
+    view_origin:int
+    # x, y, z, qw, qx, qy, qz of the head, left and right eye, [3, 7]
+    poses:np.ndarray|None
+    keypoints:np.ndarray|None
+
+
+@dataclass(frozen=True)
+class CastResultRecord:
+    person_id:int
+    obj_ids:list[str]
+    obj_index:np.ndarray
+    world:np.ndarray
+    local:np.ndarray
+
+
+@dataclass(frozen=True)
+class AggregatedHitsRecord:
+    scene_obj_id:str
+    hit_timestamps:np.ndarray
+    person_ids:np.ndarray
+
+
+@dataclass(frozen=True)
+class RuleStateRecord:
+    rule_id:int
+    errored:bool
+    last_refresh_timestamp:float
+
+
+@dataclass(frozen=True)
+class SessionRecord:
+    kind:SessionRecordKind
+    # seconds since epoch
+    timestamp:float
+    value:Any
+
+
+_FLAG_VISIBLE = 0b01
+_FLAG_HAS_KEYPOINTS = 0b10
+_FACE_SCAN_HEADER = struct.Struct('<B')
+_HEAD_DATA_HEADER = struct.Struct('<qBB')
+_CAST_RESULT_HEADER = struct.Struct('<qIH')
+_AGGREGATED_HITS_DTYPE = np.dtype([('timestamp', '<f8'), ('person_id', '<i8')])
+_RULE_STATE = struct.Struct('<qBd')
+
+
+def _encode_str(value:str) -> bytes:
+    encoded = value.encode('utf-8')
+    return _STR_LENGTH.pack(len(encoded)) + encoded
+
+
+def _decode_str(data:memoryview, offset:int) -> tuple[str, int]:
+    length, = _STR_LENGTH.unpack_from(data, offset)
+    offset += _STR_LENGTH.size
+    return bytes(data[offset:offset + length]).decode('utf-8'), offset + length
+
+
+def _encode_keypoints(keypoints:np.ndarray|None) -> bytes:
+    return b'' if keypoints is None else np.asarray(keypoints, dtype='<f2').reshape(_KEYPOINTS_SHAPE).tobytes()
+
+
+def _decode_keypoints(data:memoryview, offset:int) -> np.ndarray:
+    return np.frombuffer(data, dtype='<f2', count=_KEYPOINTS_SHAPE[0] * _KEYPOINTS_SHAPE[1], offset=offset).reshape(_KEYPOINTS_SHAPE)
+
+
+def encode_face_scan(head_pose:tuple[float, ...]|None, keypoints:np.ndarray|None=None) -> bytes:
+    """head_pose - x, y, z, qw, qx, qy, qz или None, если голова не видна"""
+    if head_pose is None:
+        return _FACE_SCAN_HEADER.pack(0)
+    flags = _FLAG_VISIBLE | (_FLAG_HAS_KEYPOINTS if keypoints is not None else 0)
+    return _FACE_SCAN_HEADER.pack(flags) + struct.pack(f'<{_POSE_FLOATS}f', *head_pose) + _encode_keypoints(keypoints)
+
+
+def decode_face_scan(data:memoryview) -> FaceScanRecord:
+    flags, = _FACE_SCAN_HEADER.unpack_from(data)
+    if not flags & _FLAG_VISIBLE:
+        return FaceScanRecord(False, None, None)
+    offset = _FACE_SCAN_HEADER.size
+    head_pose = np.frombuffer(data, dtype='<f4', count=_POSE_FLOATS, offset=offset)
+    keypoints = _decode_keypoints(data, offset + head_pose.nbytes) if flags & _FLAG_HAS_KEYPOINTS else None
+    return FaceScanRecord(True, head_pose, keypoints)
+
+
+def encode_head_data(person_id:int, view_origin:int, poses:tuple[float, ...]|None, keypoints:np.ndarray|None=None) -> bytes:
+    """poses - позы головы, левого и правого глаза подряд или None, если голова не видна"""
+    if poses is None:
+        return _HEAD_DATA_HEADER.pack(person_id, view_origin, 0)
+    flags = _FLAG_VISIBLE | (_FLAG_HAS_KEYPOINTS if keypoints is not None else 0)
+    return _HEAD_DATA_HEADER.pack(person_id, view_origin, flags) + struct.pack(f'<{3 * _POSE_FLOATS}f', *poses) + _encode_keypoints(keypoints)
+
+
+def decode_head_data(data:memoryview) -> HeadDataRecord:
+    person_id, view_origin, flags = _HEAD_DATA_HEADER.unpack_from(data)
+    if not flags & _FLAG_VISIBLE:
+        return HeadDataRecord(person_id, view_origin, None, None)
+    offset = _HEAD_DATA_HEADER.size
+    poses = np.frombuffer(data, dtype='<f4', count=3 * _POSE_FLOATS, offset=offset).reshape(3, _POSE_FLOATS)
+    keypoints = _decode_keypoints(data, offset + poses.nbytes) if flags & _FLAG_HAS_KEYPOINTS else None
+    return HeadDataRecord(person_id, view_origin, poses, keypoints)
+
+
+def encode_cast_result(person_id:int, obj_ids:list[str], obj_index:np.ndarray, world:np.ndarray, local:np.ndarray) -> bytes:
+    parts = [_CAST_RESULT_HEADER.pack(person_id, len(obj_index), len(obj_ids))]
+    parts.extend(_encode_str(obj_id) for obj_id in obj_ids)
+    parts.append(np.asarray(obj_index, dtype='<u2').tobytes())
+    parts.append(np.asarray(world, dtype='<f4').tobytes())
+    parts.append(np.asarray(local, dtype='<f4').tobytes())
+    return b''.join(parts)
+
+
+def decode_cast_result(data:memoryview) -> CastResultRecord:
+    person_id, num_hits, num_obj_ids = _CAST_RESULT_HEADER.unpack_from(data)
+    offset = _CAST_RESULT_HEADER.size
+    obj_ids = []
+    for _ in range(num_obj_ids):
+        obj_id, offset = _decode_str(data, offset)
+        obj_ids.append(obj_id)
+    obj_index = np.frombuffer(data, dtype='<u2', count=num_hits, offset=offset)
+    offset += obj_index.nbytes
+    world = np.frombuffer(data, dtype='<f4', count=num_hits * 3, offset=offset).reshape(num_hits, 3)
+    offset += world.nbytes
+    local = np.frombuffer(data, dtype='<f4', count=num_hits * 3, offset=offset).reshape(num_hits, 3)
+    return CastResultRecord(person_id, obj_ids, obj_index, world, local)
+
+
+def encode_aggregated_hits(scene_obj_id:str, hit_timestamps:list[float], person_ids:list[int]) -> bytes:
+    hits = np.empty(len(hit_timestamps), dtype=_AGGREGATED_HITS_DTYPE)
+    hits['timestamp'] = hit_timestamps
+    hits['person_id'] = person_ids
+    return _encode_str(scene_obj_id) + hits.tobytes()
+
+
+def decode_aggregated_hits(data:memoryview) -> AggregatedHitsRecord:
+    scene_obj_id, offset = _decode_str(data, 0)
+    hits = np.frombuffer(data, dtype=_AGGREGATED_HITS_DTYPE, offset=offset)
+    return AggregatedHitsRecord(scene_obj_id, hits['timestamp'], hits['person_id'])
+
+
+def encode_rule_state(rule_id:int, errored:bool, last_refresh_timestamp:float) -> bytes:
+    return _RULE_STATE.pack(rule_id, errored, last_refresh_timestamp)
+
+
+def decode_rule_state(data:memoryview) -> RuleStateRecord:
+    rule_id, errored, last_refresh_timestamp = _RULE_STATE.unpack_from(data)
+    return RuleStateRecord(rule_id, bool(errored), last_refresh_timestamp)
+
+
+_DECODERS:dict[SessionRecordKind, Callable[[memoryview], Any]] = {
+    SessionRecordKind.FACE_SCAN: decode_face_scan,
+    SessionRecordKind.HEAD_DATA: decode_head_data,
+    SessionRecordKind.CAST_RESULT: decode_cast_result,
+    SessionRecordKind.AGGREGATED_HITS: decode_aggregated_hits,
+    SessionRecordKind.RULE_STATE: decode_rule_state,
+    SessionRecordKind.SCENE_UPDATE: lambda data: None,
+}
+
+
+def segment_path(session_dir:Path, index:int) -> Path:
+    return session_dir / f'segment-{index:05d}{SEGMENT_SUFFIX}'
+
+
+class _Segment:
+    def __init__(self, path:Path, index:int, size:int) -> None:
+        self.path = path
+        self._file = open(path, 'w+b')
+        # the file is sized up front, appending then only writes to mapped pages
+        self._file.truncate(size)
+        self.mm = mmap.mmap(self._file.fileno(), size)
+        _SEGMENT_HEADER.pack_into(self.mm, 0, SESSION_LOG_MAGIC, SESSION_LOG_VERSION, 0, index, time.time())
+        self.offset = _DATA_OFFSET
+
+    def free(self) -> int:
+        return len(self.mm) - self.offset
+
+    def append(self, kind:int, timestamp:float, payload:bytes):
+        data_offset = self.offset + _RECORD_HEADER.size
+        self.mm[data_offset:data_offset + len(payload)] = payload
+        # the header goes last, so a reader never sees a record without its payload
+        _RECORD_HEADER.pack_into(self.mm, self.offset, len(payload), kind, timestamp)
+        self.offset = data_offset + len(payload)
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        self.mm.flush()
+        self.mm.close()
+        # unused preallocated tail is not kept on disk
+        self._file.truncate(self.offset)
+        self._file.close()
+
+
+class SessionLogWriter:
+    """
+    Запись журнала сессии в отображаемые в память сегменты заданного размера.
+
+    append только кладёт значение и функцию кодирования в очередь, поэтому его можно вызывать
+    из обработчиков сигналов конвейера. Фоновый поток кодирует записи, дописывает их в текущий сегмент
+    и сбрасывает его на диск раз в flush_interval_sec. При переполнении очереди записи отбрасываются.
+    """
+    def __init__(self,
+                 session_dir:Path,
+                 segment_size:int=DEFAULT_SEGMENT_SIZE,
+                 flush_interval_sec:float=0.5,
+                 max_queued:int=1 << 16) -> None:
+        self._session_dir = session_dir
+        self._session_dir.mkdir(parents=True, exist_ok=True)
+        self._segment_size = segment_size
+        self._flush_interval_sec = flush_interval_sec
+        self._max_queued = max_queued
+        self._queue:deque[tuple[int, float, Any, Callable[[Any], bytes]]] = deque()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._dropped = 0
+        self._written = 0
+        self._segment:_Segment|None = None
+        self._segments_count = 0
+        self._thread = threading.Thread(target=self._run, name='SessionLogWriter', daemon=True)
+        self._thread.start()
+
+    def session_dir(self) -> Path:
+        return self._session_dir
+
+    def written(self) -> int:
+        return self._written
+
+    def dropped(self) -> int:
+        return self._dropped
+
+    def append(self, kind:SessionRecordKind, timestamp:float, value:Any, encode:Callable[[Any], bytes]) -> bool:
+        if self._closed or len(self._queue) >= self._max_queued:
+            self._dropped += 1
+            return False
+        self._queue.append((kind, timestamp, value, encode))
+        return True
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            self._wakeup.wait(self._flush_interval_sec)
+            self._wakeup.clear()
+            closed = self._closed
+            self._write_queued()
+            if self._segment is not None and (closed or time.monotonic() - last_flush >= self._flush_interval_sec):
+                self._segment.flush()
+                last_flush = time.monotonic()
+            if closed:
+                break
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+    def _write_queued(self):
+        queue = self._queue
+        while queue:
+            kind, timestamp, value, encode = queue.popleft()
+            try:
+                payload = encode(value)
+            except Exception as e:
+                logging.warning(f'Failed to encode session record of kind {kind}: {e}')
+                continue
+            self._segment_for(_RECORD_HEADER.size + len(payload)).append(kind, timestamp, payload)
+            self._written += 1
+
+    def _segment_for(self, record_size:int) -> _Segment:
+        if self._segment is not None and self._segment.free() >= record_size:
+            return self._segment
+        if self._segment is not None:
+            self._segment.close()
+        # a record larger than a segment gets a segment of its own size
+        size = max(self._segment_size, _DATA_OFFSET + record_size)
+        self._segment = _Segment(segment_path(self._session_dir, self._segments_count), self._segments_count, size)
+        self._segments_count += 1
+        return self._segment
+
+
+class SessionLogReader:
+    """
+    Чтение журнала сессии для разбора после записи.
+
+    Сегменты отображаются в память, массивы в значениях записей ссылаются на отображение без копирования
+    и действительны до вызова close. Читать можно и журнал, который ещё пишется.
+    """
+    def __init__(self, session_dir:Path) -> None:
+        self._session_dir = session_dir
+        self._maps:list[mmap.mmap] = []
+
+    def __enter__(self) -> 'SessionLogReader':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def segments(self) -> list[Path]:
+        return sorted(self._session_dir.glob(f'segment-*{SEGMENT_SUFFIX}'))
+
+    def raw_records(self) -> Iterator[tuple[SessionRecordKind, float, memoryview]]:
+        for path in self.segments():
+            if path.stat().st_size < _DATA_OFFSET:
+                continue
+            with open(path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps.append(mm)
+            magic, version, _, _, _ = _SEGMENT_HEADER.unpack_from(mm)
+            if magic != SESSION_LOG_MAGIC or version != SESSION_LOG_VERSION:
+                logging.warning(f'Skipping session log segment {path} of unknown format')
+                continue
+            data = memoryview(mm)
+            offset, end = _DATA_OFFSET, len(mm)
+            while offset + _RECORD_HEADER.size <= end:
+                length, kind, timestamp = _RECORD_HEADER.unpack_from(data, offset)
+                # the zero filled tail of a segment that is still written or was not closed
+                if kind == 0:
+                    break
+                offset += _RECORD_HEADER.size
+                if offset + length > end:
+                    break
+                yield SessionRecordKind(kind), timestamp, data[offset:offset + length]
+                offset += length
+
+    def records(self, kinds:set[SessionRecordKind]|None=None) -> Iterator[SessionRecord]:
+        for kind, timestamp, payload in self.raw_records():
+            if kinds is None or kind in kinds:
+                yield SessionRecord(kind, timestamp, _DECODERS[kind](payload))
+
+    def close(self):
+        maps, self._maps = self._maps, []
+        for mm in maps:
+            try:
+                mm.close()
+            except BufferError:
+                # arrays returned from records still reference the map, it is closed with them
+                pass
@@ -1,5 +1,8 @@
 from datetime import datetime
+from typing import Sequence
+import numpy as np
 from pydantic import TypeAdapter, model_validator
+from PySide6.QtGui import QVector3D
 from pydantic.dataclasses import dataclass
 
 from common.dtos.utils import BaseConfig, PersonId, SceneObjId, Vec3D
@@ -47,6 +50,61 @@ class PersonPerformedRayCastResult:
     person_id:PersonId
     cast_result:PerformedRayCastResult
 
+
+def _points_array(points:Sequence[QVector3D]) -> np.ndarray:
+    return np.array([(p.x(), p.y(), p.z()) for p in points], dtype=np.float32).reshape(len(points), 3)
+
+
+class ColumnarRayCastResult:
+    """
+    Результат броска лучей по столбцам для внутренних производителей и потребителей.
+
+    obj_index - индексы в таблице obj_ids (int32 [n]), world и local - точки попаданий (float32 [n, 3]).
+    Конструктор данные не проверяет, в PerformedRayCastResult результат переводится только для сериализации.
+    """
+    __slots__ = ('timestamp', 'obj_ids', 'obj_index', 'world', 'local')
+
+    def __init__(self,
+                 timestamp:datetime,
+                 obj_ids:Sequence[str],
+                 obj_index:np.ndarray,
+                 world:np.ndarray,
+                 local:np.ndarray) -> None:
+        self.timestamp = timestamp
+        self.obj_ids = obj_ids
+        self.obj_index = obj_index
+        self.world = world
+        self.local = local
+
+    def __len__(self) -> int:
+        return len(self.obj_index)
+
+    @classmethod
+    def from_points(cls,
+                    timestamp:datetime,
+                    scene_obj_ids:Sequence[str],
+                    hits_global:Sequence[QVector3D],
+                    hits_local:Sequence[QVector3D]) -> 'ColumnarRayCastResult':
+        obj_ids = list(dict.fromkeys(scene_obj_ids))
+        obj_id2index = {obj_id: index for index, obj_id in enumerate(obj_ids)}
+        obj_index = np.fromiter((obj_id2index[obj_id] for obj_id in scene_obj_ids), dtype=np.int32, count=len(scene_obj_ids))
+        return cls(timestamp, obj_ids, obj_index, _points_array(hits_global), _points_array(hits_local))
+
+    @classmethod
+    def from_dto(cls, cast_result:PerformedRayCastResult) -> 'ColumnarRayCastResult':
+        return cls.from_points(cast_result.timestamp, cast_result.scene_obj_ids, cast_result.hits_global, cast_result.hits_local)
+
+    def hit_obj_ids(self) -> list[str]:
+        obj_ids = self.obj_ids
+        return [obj_ids[i] for i in self.obj_index.tolist()]
+
+    def to_dto(self) -> PerformedRayCastResult:
+        return PerformedRayCastResult(self.timestamp,
+                                      self.hit_obj_ids(),
+                                      [QVector3D(*p) for p in self.world.tolist()],
+                                      [QVector3D(*p) for p in self.local.tolist()])
+
+
 SceneObjAttentionHitsAdapter = TypeAdapter(SceneObjAttentionHits)
 SceneObjAggregatedHitsAdapter = TypeAdapter(SceneObjAggregatedHits)
 PerformedRayCastResultAdapter = TypeAdapter(PerformedRayCastResult)
@@ -0,0 +1,140 @@
+from datetime import datetime
+from typing import cast
+import numpy as np
+from PySide6.QtGui import QQuaternion, QVector3D
+
+from common.domain.interfaces import Person
+from common.dtos.head_data import EyesTransforms, HeadData, HeadProps
+from common.dtos.hits import ColumnarRayCastResult
+from common.rays_casting.bvh import TrianglesBVH
+
+
+# offset of the entity between eyes in head space, same as in Person3DModelEntity
+BETWEEN_EYES_POSITION = (0, 0.025, -0.025)
+
+
+def quat_to_matrix(q:QQuaternion) -> np.ndarray:
+    w, x, y, z = q.scalar(), q.x(), q.y(), q.z()
+    norm = np.sqrt(w*w + x*x + y*y + z*z) or 1.0
+    w, x, y, z = w/norm, x/norm, y/norm, z/norm
+    return np.array([
+        [1 - 2*(y*y + z*z), 2*(x*y - z*w), 2*(x*z + y*w)],
+        [2*(x*y + z*w), 1 - 2*(x*x + z*z), 2*(y*z - x*w)],
+        [2*(x*z - y*w), 2*(y*z + x*w), 1 - 2*(x*x + y*y)],
+    ])
+
+
+def transform_matrix(position:QVector3D|tuple[float, float, float], rotation:QQuaternion|None=None) -> np.ndarray:
+    mat = np.eye(4)
+    if rotation is not None:
+        mat[:3, :3] = quat_to_matrix(rotation)
+    if isinstance(position, QVector3D):
+        position = (position.x(), position.y(), position.z())
+    mat[:3, 3] = position
+    return mat
+
+
+def cone_directions(num:int, angle:float, rotation_angle:float) -> np.ndarray:
+    """
+    Направления лучей MultipleRayCastersEntity в пространстве глаза:
+    веер из num лучей в пределах [-angle, angle) градусов вокруг оси X, повернутый на rotation_angle вокруг -Z.
+    """
+    fan = np.deg2rad(np.linspace(-angle, angle, num=num, endpoint=False))
+    phi = np.deg2rad(rotation_angle)
+    return np.stack([np.sin(fan) * np.sin(phi),
+                     np.sin(fan) * np.cos(phi),
+                     -np.cos(fan)], axis=1)
+
+
+def person_eyes_transforms(person:Person) -> list[np.ndarray]:
+    """Мировые матрицы точки между глаз, левого и правого глаза, либо пустой список, если голова не видна"""
+    head_data = person.head_data()
+    if head_data.view_origin == HeadData.ViewOrigin.NOT_VISIBLE:
+        return []
+    head_props = cast(HeadProps, head_data.head_props)
+    eyes_transforms = cast(EyesTransforms, head_data.eyes_transforms)
+
+    head = transform_matrix(person.camera_position(), person.camera_rotation()) @\
+           transform_matrix(head_props.position, head_props.rotation)
+    return [
+        head @ transform_matrix(BETWEEN_EYES_POSITION),
+        head @ transform_matrix(eyes_transforms.left_eye_transform.position, eyes_transforms.left_eye_transform.rotation),
+        head @ transform_matrix(eyes_transforms.right_eye_transform.position, eyes_transforms.right_eye_transform.rotation),
+    ]
+
+
+class BatchedPersonsRayCaster:
+    """
+    Бросает лучи внимания всех отслеживаемых операторов одним вызовом TrianglesBVH.cast,
+    не завися от цикла отрисовки Qt3D. Геометрия лучей повторяет MultipleRayCastersEntity.
+    """
+    def __init__(self,
+                 bvh:TrianglesBVH,
+                 num_rays_per_eye:int=10,
+                 cone_angle:float=10,
+                 rotation_period_sec:float=1,
+                 length:float=50) -> None:
+        self._bvh = bvh
+        self._num_rays_per_eye = num_rays_per_eye
+        self._cone_angle = cone_angle
+        self._rotation_period_sec = rotation_period_sec
+        self._length = length
+        self._persons:list[Person] = []
+
+    def bvh(self) -> TrianglesBVH:
+        return self._bvh
+
+    def num_rays_per_eye(self) -> int:
+        return self._num_rays_per_eye
+
+    def set_num_rays_per_eye(self, num:int):
+        self._num_rays_per_eye = max(int(num), 1)
+
+    def persons(self) -> list[Person]:
+        return list(self._persons)
+
+    def add_person(self, person:Person):
+        if person not in self._persons:
+            self._persons.append(person)
+
+    def remove_person(self, person:Person):
+        if person in self._persons:
+            self._persons.remove(person)
+
+    def cast(self, timestamp:datetime) -> dict[Person, ColumnarRayCastResult]:
+        rotation_angle = (timestamp.timestamp() % self._rotation_period_sec) / self._rotation_period_sec * 360
+        local_directions = cone_directions(self._num_rays_per_eye, self._cone_angle, rotation_angle)
+
+        origins:list[np.ndarray] = []
+        directions:list[np.ndarray] = []
+        casting_persons:list[Person] = []
+        for person in self._persons:
+            eyes = person_eyes_transforms(person)
+            if not eyes:
+                continue
+            casting_persons.append(person)
+            for eye in eyes:
+                origins.append(np.broadcast_to(eye[:3, 3], local_directions.shape))
+                directions.append(local_directions @ eye[:3, :3].T)
+
+        results:dict[Person, ColumnarRayCastResult] = dict()
+        if not casting_persons:
+            return results
+
+        all_directions = np.concatenate(directions)
+        all_directions /= np.linalg.norm(all_directions, axis=1, keepdims=True)
+        hits = self._bvh.cast(np.concatenate(origins), all_directions, self._length)
+
+        rays_per_person = 3 * len(local_directions)
+        hit_persons = hits.ray_indices // rays_per_person
+        on_scene_obj = hits.obj_indices >= 0
+        obj_names = self._bvh.obj_names
+        for person_index, person in enumerate(casting_persons):
+            person_hits = np.flatnonzero((hit_persons == person_index) & on_scene_obj)
+            points = hits.points[person_hits]
+            # only hit objs go to the obj ids table, not the whole BVH names list
+            hit_objs, obj_index = np.unique(hits.obj_indices[person_hits], return_inverse=True)
+            obj_ids = [obj_names[i] for i in hit_objs.tolist()]
+            # scene objs are loaded without own transforms, so local coordinates match world ones
+            results[person] = ColumnarRayCastResult(timestamp, obj_ids, obj_index.astype(np.int32), points, points)
+        return results
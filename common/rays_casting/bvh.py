@@ -0,0 +1,147 @@
+from dataclasses import dataclass
+from pathlib import Path
+import numpy as np
+
+from common.domain.obj_data import OBJMeshes, read_obj_meshes
+
+
+_EPS = 1e-9
+
+
+def _morton_codes(points:np.ndarray) -> np.ndarray:
+    lo = points.min(axis=0)
+    extent = np.maximum(points.max(axis=0) - lo, _EPS)
+    quantized = ((points - lo) / extent * 1023).astype(np.uint64)
+    codes = np.zeros(len(points), dtype=np.uint64)
+    for bit in range(10):
+        for axis in range(3):
+            codes |= ((quantized[:, axis] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(3 * bit + axis)
+    return codes
+
+
+@dataclass
+class RaysHits:
+    ray_indices:np.ndarray # int64 [k], only rays that hit something
+    obj_indices:np.ndarray # int32 [k], -1 for triangles without object
+    distances:np.ndarray # float32 [k]
+    points:np.ndarray # float32 [k, 3]
+
+
+class TrianglesBVH:
+    """
+    Иерархия ограничивающих объёмов над треугольниками сцены, каждый треугольник помечен индексом объекта.
+
+    Треугольники упорядочены по коду Мортона центров и сгруппированы в листья по leaf_size,
+    узлы верхних уровней объединяют пары соседних узлов нижнего уровня.
+    Лучи обходят дерево уровень за уровнем сразу для всех лучей.
+    """
+    def __init__(self, meshes:OBJMeshes, leaf_size:int=8) -> None:
+        self.obj_names = list(meshes.obj_names)
+        self._leaf_size = leaf_size
+        corners = meshes.vertices.astype(np.float64)[meshes.triangles] # [m, 3, 3]
+        if len(corners):
+            order = np.argsort(_morton_codes(corners.mean(axis=1)), kind='stable')
+            corners = corners[order]
+            self._triangle_obj_indices = meshes.triangle_obj_indices[order]
+        else:
+            self._triangle_obj_indices = meshes.triangle_obj_indices
+        self._v0 = corners[:, 0]
+        self._edge1 = corners[:, 1] - corners[:, 0]
+        self._edge2 = corners[:, 2] - corners[:, 0]
+
+        # levels of boxes from leaves up to the root
+        self._levels_min:list[np.ndarray] = []
+        self._levels_max:list[np.ndarray] = []
+        if len(corners):
+            leaf_starts = np.arange(0, len(corners), leaf_size)
+            self._levels_min.append(np.minimum.reduceat(corners.min(axis=1), leaf_starts))
+            self._levels_max.append(np.maximum.reduceat(corners.max(axis=1), leaf_starts))
+            while len(self._levels_min[-1]) > 1:
+                self._levels_min.append(self._merge_pairs(self._levels_min[-1], np.minimum))
+                self._levels_max.append(self._merge_pairs(self._levels_max[-1], np.maximum))
+
+    @staticmethod
+    def _merge_pairs(boxes:np.ndarray, reduce) -> np.ndarray:
+        if len(boxes) % 2:
+            boxes = np.concatenate((boxes, boxes[-1:]))
+        return reduce(boxes[0::2], boxes[1::2])
+
+    @classmethod
+    def from_obj_file(cls, obj_path:Path, leaf_size:int=8) -> 'TrianglesBVH':
+        return cls(read_obj_meshes(obj_path), leaf_size)
+
+    def num_triangles(self) -> int:
+        return len(self._v0)
+
+    def cast(self, origins:np.ndarray, directions:np.ndarray, max_length:float) -> RaysHits:
+        """Ищет ближайшее пересечение каждого луча (directions нормированы) на расстоянии до max_length"""
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        if not self._levels_min or len(origins) == 0:
+            return self._no_hits()
+
+        safe_directions = np.where(np.abs(directions) < _EPS, _EPS, directions)
+        inv_directions = 1.0 / safe_directions
+
+        ray_indices = np.arange(len(origins))
+        node_indices = np.zeros(len(origins), dtype=np.int64)
+        for level in range(len(self._levels_min) - 1, -1, -1):
+            if level != len(self._levels_min) - 1:
+                num_nodes = len(self._levels_min[level])
+                ray_indices = np.repeat(ray_indices, 2)
+                node_indices = (np.repeat(node_indices, 2) * 2) + np.tile([0, 1], len(node_indices))
+                existing = node_indices < num_nodes
+                ray_indices, node_indices = ray_indices[existing], node_indices[existing]
+            t_lo = (self._levels_min[level][node_indices] - origins[ray_indices]) * inv_directions[ray_indices]
+            t_hi = (self._levels_max[level][node_indices] - origins[ray_indices]) * inv_directions[ray_indices]
+            t_enter = np.minimum(t_lo, t_hi).max(axis=1)
+            t_exit = np.maximum(t_lo, t_hi).min(axis=1)
+            crossed = (t_enter <= t_exit) & (t_exit >= 0) & (t_enter <= max_length)
+            ray_indices, node_indices = ray_indices[crossed], node_indices[crossed]
+            if len(ray_indices) == 0:
+                return self._no_hits()
+
+        # expand leaves to triangles
+        leaf_offsets = np.arange(self._leaf_size)
+        triangle_indices = (node_indices[:, None] * self._leaf_size + leaf_offsets[None, :]).ravel()
+        ray_indices = np.repeat(ray_indices, self._leaf_size)
+        existing = triangle_indices < len(self._v0)
+        ray_indices, triangle_indices = ray_indices[existing], triangle_indices[existing]
+
+        distances = self._intersect(origins[ray_indices], directions[ray_indices], triangle_indices)
+        hit = (distances > _EPS) & (distances <= max_length)
+        ray_indices, triangle_indices, distances = ray_indices[hit], triangle_indices[hit], distances[hit]
+
+        # closest hit of every ray
+        order = np.lexsort((distances, ray_indices))
+        ray_indices, triangle_indices, distances = ray_indices[order], triangle_indices[order], distances[order]
+        first = np.ones(len(ray_indices), dtype=bool)
+        first[1:] = ray_indices[1:] != ray_indices[:-1]
+        ray_indices, triangle_indices, distances = ray_indices[first], triangle_indices[first], distances[first]
+
+        points = origins[ray_indices] + directions[ray_indices] * distances[:, None]
+        return RaysHits(ray_indices,
+                        self._triangle_obj_indices[triangle_indices].astype(np.int32),
+                        distances.astype(np.float32),
+                        points.astype(np.float32))
+
+    @staticmethod
+    def _no_hits() -> RaysHits:
+        return RaysHits(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32),
+                        np.empty(0, dtype=np.float32), np.empty((0, 3), dtype=np.float32))
+
+    def _intersect(self, origins:np.ndarray, directions:np.ndarray, triangle_indices:np.ndarray) -> np.ndarray:
+        # Möller–Trumbore, returns distance along ray or nan
+        edge1 = self._edge1[triangle_indices]
+        edge2 = self._edge2[triangle_indices]
+        p = np.cross(directions, edge2)
+        det = np.einsum('ij,ij->i', edge1, p)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv_det = 1.0 / det
+            s = origins - self._v0[triangle_indices]
+            u = np.einsum('ij,ij->i', s, p) * inv_det
+            q = np.cross(s, edge1)
+            v = np.einsum('ij,ij->i', directions, q) * inv_det
+            t = np.einsum('ij,ij->i', edge2, q) * inv_det
+        valid = (np.abs(det) > _EPS) & (u >= 0) & (v >= 0) & (u + v <= 1)
+        return np.where(valid, t, np.nan)
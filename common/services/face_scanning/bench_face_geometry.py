@@ -0,0 +1,57 @@
+"""
+Сравнение времени на кадр get_metric_landmarks_of_refined и MetricLandmarksSolver.
+
+    python -m common.services.face_scanning.bench_face_geometry [--frames 500] [--batch 32]
+"""
+import argparse
+import timeit
+import numpy as np
+
+from common.services.face_scanning.face_geometry import (PCF, MetricLandmarksSolver, canonical_metric_landmarks,
+                                                          get_metric_landmarks_of_refined)
+
+
+def synthetic_screen_landmarks(pcf:PCF, rng:np.random.Generator, num_landmarks:int=478) -> np.ndarray:
+    """Канонические точки, повернутые случайно и спроецированные в нормированные экранные координаты"""
+    points = np.concatenate((canonical_metric_landmarks,
+                             canonical_metric_landmarks[:, :num_landmarks - canonical_metric_landmarks.shape[1]]), axis=1)
+    rotation = np.linalg.qr(rng.normal(size=(3, 3)))[0]
+    if np.linalg.det(rotation) < 0:
+        rotation[:, 0] *= -1
+    points = rotation @ points * 0.5 + np.array([[0], [0], [-40]])
+    bounds = pcf.frame_bounds
+    x = (points[0] / -points[2] * pcf.near - bounds.left) / (bounds.right - bounds.left)
+    y = 1 - (points[1] / -points[2] * pcf.near - bounds.bottom) / (bounds.top - bounds.bottom)
+    z = points[2] / 200
+    return np.stack((x, y, z)) + rng.normal(scale=1e-3, size=(3, num_landmarks))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=500)
+    parser.add_argument('--batch', type=int, default=32)
+    args = parser.parse_args()
+
+    pcf = PCF(640, 480)
+    solver = MetricLandmarksSolver(pcf)
+    rng = np.random.default_rng(0)
+    frame = synthetic_screen_landmarks(pcf, rng)
+    batch = np.stack([synthetic_screen_landmarks(pcf, rng) for _ in range(args.batch)])
+
+    reference = get_metric_landmarks_of_refined(frame.copy(), pcf)
+    solved = solver.solve(frame)
+    max_error = max(float(np.abs(ref - res).max()) for ref, res in zip(reference, solved))
+
+    reference_sec = timeit.timeit(lambda: get_metric_landmarks_of_refined(frame.copy(), pcf), number=args.frames) / args.frames
+    solver_sec = timeit.timeit(lambda: solver.solve(frame), number=args.frames) / args.frames
+    num_batches = max(args.frames // args.batch, 1)
+    batch_sec = timeit.timeit(lambda: solver.solve_batch(batch), number=num_batches) / num_batches / args.batch
+
+    print(f'max abs difference:             {max_error:.3e}')
+    print(f'get_metric_landmarks_of_refined: {reference_sec * 1e6:8.1f} us/frame')
+    print(f'MetricLandmarksSolver.solve:     {solver_sec * 1e6:8.1f} us/frame')
+    print(f'solve_batch (K={args.batch}):            {batch_sec * 1e6:8.1f} us/frame')
+
+
+if __name__ == '__main__':
+    main()
@@ -312,4 +312,129 @@ def combine_transform_matrix(r_and_s, t):
     result = np.eye(4)
     result[:3, :3] = r_and_s
     result[:3, 3] = t    
-    return result
\ No newline at end of file
+    return result
+
+class MetricLandmarksSolver:
+    """
+    То же, что get_metric_landmarks_of_refined, для фиксированного PCF.
+
+    Всё, что зависит только от канонических точек и весов, вычисляется один раз, а задача
+    взвешенной ортогональной Прокрустовой задачи сводится к произведениям 3x468 на 468x3 и SVD матрицы 3x3.
+    solve_batch решает K кадров одним набором векторных операций.
+    """
+    NUM_POSE_LANDMARKS = 468
+
+    def __init__(self, pcf:PCF) -> None:
+        self._pcf = pcf
+        bounds = pcf.frame_bounds
+        self._x_scale = bounds.right - bounds.left
+        self._y_scale = bounds.top - bounds.bottom
+        self._x_translation = bounds.left
+        self._y_translation = bounds.bottom
+        self._near = pcf.near
+
+        sqrt_weights = np.sqrt(landmark_weights)
+        weights = landmark_weights
+        total_weight = np.sum(weights)
+        weighted_sources = canonical_metric_landmarks * sqrt_weights[None, :]
+        source_center_of_mass = canonical_metric_landmarks @ weights / total_weight
+        centered_weighted_sources = weighted_sources - source_center_of_mass[:, None] * sqrt_weights[None, :]
+
+        self._total_weight = total_weight
+        self._weights = np.ascontiguousarray(weights)
+        # design matrix = targets @ design_projection, as targets are weighted by sqrt_weights once more
+        self._design_projection = np.ascontiguousarray((centered_weighted_sources * sqrt_weights[None, :]).T)
+        self._scale_denominator = np.sum(centered_weighted_sources * weighted_sources)
+        # weighted sum of canonical landmarks, used for translation
+        self._weighted_sources_sum = canonical_metric_landmarks @ weights
+        self._buffers:dict[tuple[int, int], tuple[np.ndarray, np.ndarray]] = dict()
+
+    def pcf(self) -> PCF:
+        return self._pcf
+
+    def _solve_pose(self, targets:np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """targets [K, 3, 468] -> rotation [K, 3, 3], scale [K], translation [K, 3]"""
+        design = targets @ self._design_projection
+        u, _, vh = np.linalg.svd(design)
+        flip = np.linalg.det(u) * np.linalg.det(vh) < 0
+        u[flip, :, 2] *= -1
+        rotation = u @ vh
+        scale = np.einsum('kij,kij->k', rotation, design) / self._scale_denominator
+        targets_sum = targets @ self._weights
+        translation = (targets_sum - scale[:, None] * (rotation @ self._weighted_sources_sum)) / self._total_weight
+        return rotation, scale, translation
+
+    def _buffers_for(self, num_frames:int, num_landmarks:int) -> tuple[np.ndarray, np.ndarray]:
+        key = (num_frames, num_landmarks)
+        if (buffers:=self._buffers.get(key)) is None:
+            buffers = self._buffers[key] = (np.empty((num_frames, 3, num_landmarks)),
+                                            np.empty((num_frames, 3, num_landmarks)))
+        return buffers
+
+    def solve_batch(self, screen_landmarks:np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        screen_landmarks [K, 3, N] нормированных экранных координат.
+        Возвращает (metric_landmarks_reversed [K, 3, N], metric_landmarks [K, 3, N], pose_transform_mat [K, 4, 4]).
+        Массивы точек переиспользуются следующим вызовом с той же формой.
+        """
+        screen_landmarks = np.asarray(screen_landmarks, dtype=np.float64)
+        num_frames, _, num_landmarks = screen_landmarks.shape
+        pose_count = self.NUM_POSE_LANDMARKS
+        metric, reversed_metric = self._buffers_for(num_frames, num_landmarks)
+        x, y, z = metric[:, 0], metric[:, 1], metric[:, 2]
+
+        # project_xy, z of projected landmarks is kept in reversed_metric as scratch
+        projected_z = reversed_metric[:, 2]
+        np.multiply(screen_landmarks[:, 0], self._x_scale, out=x)
+        x += self._x_translation
+        np.subtract(1.0, screen_landmarks[:, 1], out=y)
+        y *= self._y_scale
+        y += self._y_translation
+        np.multiply(screen_landmarks[:, 2], self._x_scale, out=projected_z)
+        depth_offset = projected_z[:, :pose_count].mean(axis=1)
+
+        # first iteration: change_handedness of projected landmarks
+        np.negative(projected_z, out=z)
+        _, first_scale, _ = self._solve_pose(metric[:, :, :pose_count])
+
+        # second iteration: move_and_rescale_z, unproject_xy, change_handedness
+        xy = reversed_metric[:, :2]
+        xy[:] = metric[:, :2]
+        self._unproject(xy, projected_z, depth_offset, first_scale, metric)
+        _, second_scale, _ = self._solve_pose(metric[:, :, :pose_count])
+
+        metric[:, :2] = xy
+        self._unproject(metric[:, :2], projected_z, depth_offset, first_scale * second_scale, metric)
+        rotation, scale, translation = self._solve_pose(metric[:, :, :pose_count])
+
+        pose_transform_mat = np.zeros((num_frames, 4, 4))
+        pose_transform_mat[:, :3, :3] = rotation * scale[:, None, None]
+        pose_transform_mat[:, :3, 3] = translation
+        pose_transform_mat[:, 3, 3] = 1
+
+        # inverse of s*R, t is R^T/s, -R^T t/s
+        inv_rotation = np.swapaxes(rotation, 1, 2) / scale[:, None, None]
+        inv_translation = -(inv_rotation @ translation[:, :, None])
+        np.matmul(inv_rotation, metric, out=reversed_metric)
+        reversed_metric += inv_translation
+        return reversed_metric, metric, pose_transform_mat
+
+    def _unproject(self, xy:np.ndarray, projected_z:np.ndarray, depth_offset:np.ndarray, scale:np.ndarray, out:np.ndarray):
+        z = out[:, 2]
+        np.subtract(projected_z, (depth_offset - self._near)[:, None], out=z)
+        z /= scale[:, None]
+        out[:, 0] = xy[:, 0] * z / self._near
+        out[:, 1] = xy[:, 1] * z / self._near
+        np.negative(z, out=z)
+
+    def solve(self, screen_landmarks:np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Один кадр [3, N], результат как у get_metric_landmarks_of_refined"""
+        reversed_metric, metric, pose_transform_mat = self.solve_batch(screen_landmarks[None])
+        return reversed_metric[0], metric[0], pose_transform_mat[0]
+
+
+def landmarks_to_array(landmarks) -> np.ndarray:
+    """Список NormalizedLandmark mediapipe -> массив [3, N]"""
+    count = len(landmarks)
+    coords = np.fromiter((c for lm in landmarks for c in (lm.x, lm.y, lm.z)), dtype=np.float64, count=3 * count)
+    return coords.reshape(count, 3).T
@@ -2,13 +2,13 @@ from dataclasses import dataclass
 import logging
 from pathlib import Path
 import pickle
+import threading
 import time
 from typing import cast
 import numpy as np
 from datetime import datetime
-from PIL import Image
 from PySide6.QtCore import Slot, Signal, QObject, QThread, QRunnable, QThreadPool, QBuffer
-from PySide6.QtGui import QImage, QVector3D, QQuaternion, QMatrix3x3
+from PySide6.QtGui import QVector3D, QQuaternion, QMatrix3x3
 from PySide6.QtWidgets import QApplication
 
 import mediapipe as mp # type: ignore
@@ -19,28 +19,14 @@ from common.dtos.head_data import HeadProps # type: ignore
 
 from common.services.video.types import VideoService
 
-from .face_geometry import PCF, get_metric_landmarks_of_refined
-from PIL import Image
+from .face_geometry import PCF, MetricLandmarksSolver
+from .frame_adapter import StageTiming, StageTimings, VideoFrameAdapter
+from .landmarks_detection import DetectedHead, create_face_landmarker, detect_head
+from .process_pool import LandmarkerProcessPool
 import sys
 
 from transforms3d.axangles import axangle2mat # type: ignore
 
-logging.getLogger('PIL').setLevel(logging.WARNING)
-
-
-def qimage_to_pil_image(qimage:QImage):
-    """Convert QImage to PIL Image."""
-    format = qimage.format()
-    # QImage.Format_RGB32 means the image is stored using a 32-bit RGB format (0xffRRGGBB).
-    if not(format == QImage.Format.Format_RGB32 or format == QImage.Format.Format_ARGB32):
-        qimage = qimage.convertToFormat(QImage.Format.Format_ARGB32)
-    buffer = qimage.bits()#.asarray(qimage.sizeInBytes())
-    pil_image = Image.frombytes("RGBA", (qimage.width(), qimage.height()), buffer)
-    return pil_image
-
-def pil_image2mp_image(pil_image:Image.Image):
-    return mp.Image(mp.ImageFormat.SRGB, np.array(pil_image.convert('RGB')))
-
 
 @dataclass(frozen=True)
 class FaceScanResult:
@@ -55,28 +41,80 @@ class _ScannerSignals(QObject):
     finished = Signal()
 
 
+@dataclass(frozen=True)
+class FrameMailboxStats:
+    received:int
+    processed:int
+    dropped:int
+
+
+class FrameMailbox:
+    """
+    Ячейка для последнего кадра между потоком камеры и потоком распознавания.
+    Новый кадр вытесняет ещё не взятый, take() ждёт кадр без опроса.
+    """
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._frame:VideoService.TimestampedFrame|None = None
+        self._closed = False
+        self._received = 0
+        self._processed = 0
+        self._dropped = 0
+
+    def put(self, frame:VideoService.TimestampedFrame):
+        with self._condition:
+            if self._closed:
+                return
+            self._received += 1
+            if self._frame is not None:
+                self._dropped += 1
+            self._frame = frame
+            self._condition.notify()
+
+    def take(self, timeout:float|None=None) -> VideoService.TimestampedFrame|None:
+        """Возвращает последний кадр или None, если ячейка закрыта либо истёк timeout"""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._frame is not None or self._closed, timeout):
+                return None
+            frame, self._frame = self._frame, None
+            if frame is not None:
+                self._processed += 1
+            return frame
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._frame = None
+            self._condition.notify_all()
+
+    def is_closed(self) -> bool:
+        with self._condition:
+            return self._closed
+
+    def stats(self) -> FrameMailboxStats:
+        with self._condition:
+            return FrameMailboxStats(self._received, self._processed, self._dropped)
+
+
 class _Scanner(QRunnable):
     def __init__(self) -> None:
         super().__init__()
         self.signals = _ScannerSignals()
-        self._current_frame:VideoService.TimestampedFrame|None = None
+        self.mailbox = FrameMailbox()
+        self._running = False
         self._pcf:PCF|None = None
+        self._solver:MetricLandmarksSolver|None = None
         self.detector:vision.FaceLandmarker = None
         self.first_detection_in_sequence = True
         self.smoothed_rotation_quat = QQuaternion()
         self.smoothed_translation = QVector3D()
+        self.timings = StageTimings()
+        self._frame_adapter = VideoFrameAdapter(self.timings)
 
-    def initialize_at_first_image(self, image:QImage):
-        self._pcf = PCF(image.width(),image.height())
-        run_video_mode = vision_task_running_mode.VisionTaskRunningMode.VIDEO
-        
-        base_options = python.BaseOptions(model_asset_path=str(Path(__file__).parent / 'face_landmarker.task'))
-        options = vision.FaceLandmarkerOptions(base_options=base_options,
-                                            output_face_blendshapes=False,
-                                            output_facial_transformation_matrixes=True,
-                                            num_faces=1, running_mode=run_video_mode)
-        
-        self.detector = vision.FaceLandmarker.create_from_options(options)
+    def initialize_at_first_image(self, width:int, height:int):
+        self._pcf = PCF(width, height)
+        self._solver = MetricLandmarksSolver(self._pcf)
+        self.detector = create_face_landmarker()
 
     def is_running(self):
         return self._running
@@ -88,69 +126,41 @@ class _Scanner(QRunnable):
         last_frame_mcs = 0
         self._running = True
         try:
-            while self._running:
-                # time.sleep(0.1)
-                # print('_Scanner.run time =', time.time())
-                # return
-                timestamp = datetime.now()
+            # blocks while camera is paused, wakes up as soon as a frame arrives or scanner is stopped
+            while (frame:=self.mailbox.take()) is not None:
+                rgb = self._frame_adapter.to_rgb(frame.frame)
+
+                if self._pcf is None:
+                    self.initialize_at_first_image(rgb.shape[1], rgb.shape[0])
+                    start_timestamp = datetime.now()
+
+                timestamp = frame.timestamp
                 timestamp_mcs = int((timestamp - start_timestamp).total_seconds()*1000)
                 timestamp_mcs = max(timestamp_mcs, last_frame_mcs+1)
 
-                if (frame:=self._current_frame) is not None:
-                    self._current_frame = None
-                    qimage = frame.frame.toImage()
-
-                    
-                    if self._pcf is None:
-                        self.initialize_at_first_image(qimage)
-                        start_timestamp = datetime.now()
-
-                    timestamp = frame.timestamp
-                    timestamp_mcs = int((timestamp - start_timestamp).total_seconds()*1000)
-                    timestamp_mcs = max(timestamp_mcs, last_frame_mcs+1)
-
-                    
-                    # continue
-                    time_start_scan = time.time()
-                    scan_res = self._do_scan(qimage, timestamp, timestamp_mcs)
-                    # print('time scan', time.time() - time_start_scan)
-                    # if scan_res.head_props:
-                    #     print(f'{scan_res.head_props.translation}')
-                    self.signals.face_scanned.emit(scan_res)
-                    
+                scan_res = self._do_scan(rgb, timestamp, timestamp_mcs)
+                self.signals.face_scanned.emit(scan_res)
                 last_frame_mcs = timestamp_mcs
-                time.sleep(0.01)
         except Exception as e:
             import traceback
             print('Exception in _Scanner', e, traceback.format_exc())
             
         finally:
+            self._running = False
             print('finished')
             self.signals.finished.emit()
 
-    def _do_scan(self, qimage:QImage, raw_timestamp, timestamp_mcs:int):
-        # print('before Image.fromqimage')
-        start_time = time.time()
-        pil_img = qimage_to_pil_image(qimage)
-        # print('after Image.fromqimage')
-        mp_image = pil_image2mp_image(pil_img)
-        # print('convert images time', time.time() - start_time)
-
-        self.detection_result = self.detector.detect_for_video(mp_image, timestamp_mcs)
-        
-        if self.detection_result.face_landmarks:
-            
-            self.raw_landmarks = self.detection_result.face_landmarks[0]
-            landmarks = np.array([(lm.x,lm.y,lm.z) for lm in self.raw_landmarks])
-            
-            landmarks = landmarks.T
+    def _do_scan(self, rgb:np.ndarray, raw_timestamp, timestamp_mcs:int):
+        with self.timings.measure('detect'):
+            detected_head = detect_head(self.detector, rgb, timestamp_mcs, cast(MetricLandmarksSolver, self._solver))
 
-            landmarks_head_space, _, head2cam_transform_mat = get_metric_landmarks_of_refined(landmarks, cast(PCF, self._pcf))
-            head2cam_transform_mat = cast(np.ndarray, self.detection_result.facial_transformation_matrixes[0])
-            landmarks_head_space = landmarks_head_space / 100
+        with self.timings.measure('postprocess'):
+            return self._apply_detected_head(raw_timestamp, detected_head)
 
-            head2cam_transform_mat = head2cam_transform_mat
-            head2cam_transform_mat[:3, 3] /= 100
+    def _apply_detected_head(self, raw_timestamp, detected_head:DetectedHead|None):
+        if detected_head is not None:
+            head2cam_transform_mat = detected_head.head2cam_transform_mat
+            landmarks_head_space = detected_head.landmarks_head_space
 
             rotate_opposite_direction_quat = QQuaternion.fromAxisAndAngle(QVector3D(0, 1, 0), 180)
             rotation_mat = head2cam_transform_mat[:3, :3]
@@ -178,10 +188,96 @@ class _Scanner(QRunnable):
         return self.last_scan_result
 
     def process_frame(self, frame: VideoService.TimestampedFrame):
-        self._current_frame = frame
+        self.mailbox.put(frame)
 
     def stop(self):
         self._running = False
+        self.mailbox.close()
+
+
+class _PoolScanner(_Scanner):
+    """
+    Сканер, распознающий кадры в пуле процессов.
+    Текущий поток подготавливает и отправляет кадры, отдельный поток собирает результаты в порядке кадров
+    и сглаживает положение головы.
+    """
+    def __init__(self, num_workers:int) -> None:
+        super().__init__()
+        self._num_workers = num_workers
+        self._pool:LandmarkerProcessPool|None = None
+        self._seq2timestamp:dict[int, datetime] = dict()
+        self._feeding_finished = threading.Event()
+
+    @Slot()
+    def run(self):
+        self.signals.started.emit()
+        self._running = True
+        start_timestamp = datetime.now()
+        last_frame_mcs = 0
+        collector:threading.Thread|None = None
+        try:
+            while True:
+                # while all slots are busy newer frames replace older ones in the mailbox
+                slot = None
+                if self._pool is not None:
+                    while (slot:=self._pool.acquire_slot(timeout=0.5)) is None and not self.mailbox.is_closed() \
+                            and not self._pool.is_failed():
+                        pass
+                    if slot is None:
+                        break
+                if (frame:=self.mailbox.take()) is None:
+                    break
+
+                rgb = self._frame_adapter.to_rgb(frame.frame)
+                if self._pool is None:
+                    self._pool = LandmarkerProcessPool(self._num_workers, rgb.shape[1], rgb.shape[0])
+                    collector = threading.Thread(target=self._collect_results, daemon=True)
+                    collector.start()
+                    start_timestamp = datetime.now()
+                    slot = self._pool.acquire_slot()
+                slot = cast(int, slot)
+                if not self._pool.fits(rgb):
+                    logging.warning(f'Frame {rgb.shape} does not fit into shared memory slots, skipping')
+                    self._pool.release_slot(slot)
+                    continue
+
+                timestamp_mcs = int((frame.timestamp - start_timestamp).total_seconds()*1000)
+                timestamp_mcs = max(timestamp_mcs, last_frame_mcs+1)
+                last_frame_mcs = timestamp_mcs
+
+                with self.timings.measure('submit'):
+                    self._seq2timestamp[self._pool.next_seq()] = frame.timestamp
+                    self._pool.submit(slot, rgb, timestamp_mcs)
+        except Exception as e:
+            import traceback
+            print('Exception in _PoolScanner', e, traceback.format_exc())
+        finally:
+            self._feeding_finished.set()
+            if collector is not None:
+                collector.join()
+            if self._pool is not None:
+                self._pool.close()
+            self._running = False
+            self.signals.finished.emit()
+
+    def _collect_results(self):
+        pool = cast(LandmarkerProcessPool, self._pool)
+        idle_after_feeding = 0
+        while not (self._feeding_finished.is_set() and pool.pending() == 0):
+            if pool.is_failed():
+                logging.error('Face landmarker process pool failed, scanning stopped')
+                break
+            if (result:=pool.next_result(timeout=0.1)) is None:
+                # do not wait forever for results of a worker that died
+                if self._feeding_finished.is_set():
+                    idle_after_feeding += 1
+                    if idle_after_feeding > 50:
+                        break
+                continue
+            raw_timestamp = self._seq2timestamp.pop(result.seq)
+            with self.timings.measure('postprocess'):
+                scan_res = self._apply_detected_head(raw_timestamp, result.detected_head)
+            self.signals.face_scanned.emit(scan_res)
 
 
 class FaceScannerService(QObject):
@@ -190,9 +286,12 @@ class FaceScannerService(QObject):
     video_available_changed = Signal(bool)
     def __init__(self, 
                  video_service:VideoService,
+                 num_worker_processes:int=0,
                  parent=None) -> None:
+        """num_worker_processes > 0 включает распознавание в пуле процессов FaceLandmarker"""
         super().__init__(parent)
         self._video_service = video_service
+        self._num_worker_processes = num_worker_processes
         self._video_service.is_available_changed.connect(self._observe_is_active_changed)
         self._video_service.frame_changed.connect(self._handle_frame_captured)
         self._scanner: _Scanner|None = None
@@ -236,11 +335,23 @@ class FaceScannerService(QObject):
     def last_scan_result(self):
         return self._last_scan_res
 
+    def stage_timings(self) -> dict[str, StageTiming]:
+        """Время стадий обработки кадров текущего сканирования: map, convert, detect, submit, postprocess"""
+        if self._scanner is None:
+            return dict()
+        return self._scanner.timings.snapshot()
+
+    def frames_stats(self) -> FrameMailboxStats|None:
+        """Число полученных, обработанных и пропущенных кадров текущего сканирования"""
+        if self._scanner is None:
+            return None
+        return self._scanner.mailbox.stats()
+
     def start(self):
         if self.is_scanning():
             return
 
-        self._scanner = _Scanner()
+        self._scanner = _PoolScanner(self._num_worker_processes) if self._num_worker_processes > 0 else _Scanner()
         self._scanner.signals.face_scanned.connect(self._handle_threader_scanner_process_result)
         self._scanner.signals.started.connect(self._handle_scanning_started)
         self._scanner.signals.finished.connect(self._handle_scanning_finished)
@@ -0,0 +1,202 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+import time
+import numpy as np
+from PySide6.QtGui import QImage
+from PySide6.QtMultimedia import QVideoFrame, QVideoFrameFormat
+
+
+PixelFormat = QVideoFrameFormat.PixelFormat
+
+# slice of R, G, B channels inside a 4-byte pixel, a slice keeps the plane a view
+_PACKED_RGB_CHANNELS = {
+    PixelFormat.Format_BGRA8888: slice(2, None, -1),
+    PixelFormat.Format_BGRX8888: slice(2, None, -1),
+    PixelFormat.Format_RGBA8888: slice(0, 3),
+    PixelFormat.Format_RGBX8888: slice(0, 3),
+    PixelFormat.Format_ARGB8888: slice(1, 4),
+    PixelFormat.Format_XRGB8888: slice(1, 4),
+    PixelFormat.Format_ABGR8888: slice(3, 0, -1),
+    PixelFormat.Format_XBGR8888: slice(3, 0, -1),
+}
+
+# BT.601 limited range, fixed point with 8 fractional bits
+_Y_SCALE = 298
+_V_TO_R = 409
+_U_TO_G = -100
+_V_TO_G = -208
+_U_TO_B = 516
+
+
+@dataclass
+class StageTiming:
+    count:int = 0
+    total_sec:float = 0
+    last_sec:float = 0
+
+    def mean_sec(self) -> float:
+        return self.total_sec / self.count if self.count else 0
+
+
+class StageTimings:
+    """Счётчики времени стадий обработки кадра"""
+    def __init__(self) -> None:
+        self._stages:dict[str, StageTiming] = dict()
+
+    @contextmanager
+    def measure(self, stage:str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage:str, duration_sec:float):
+        timing = self._stages.get(stage)
+        if timing is None:
+            timing = self._stages[stage] = StageTiming()
+        timing.count += 1
+        timing.total_sec += duration_sec
+        timing.last_sec = duration_sec
+
+    def snapshot(self) -> dict[str, StageTiming]:
+        return {stage: StageTiming(t.count, t.total_sec, t.last_sec) for stage, t in self._stages.items()}
+
+    def reset(self):
+        self._stages.clear()
+
+
+class VideoFrameAdapter:
+    """
+    Переводит QVideoFrame в RGB массив для mediapipe без промежуточных QImage/PIL копий.
+
+    Кадр отображается в память один раз, плоскости читаются как представления NumPy с учётом bytesPerLine,
+    а перестановка каналов, поворот и отражение выполняются одним копированием в переиспользуемый буфер.
+    Неподдерживаемые форматы переводятся через QVideoFrame.toImage().
+    """
+    def __init__(self, timings:StageTimings|None=None) -> None:
+        self._timings = timings if timings is not None else StageTimings()
+        self._rgb:np.ndarray|None = None
+        self._yuv_scratch:dict[str, np.ndarray] = dict()
+
+    def timings(self) -> StageTimings:
+        return self._timings
+
+    def _buffer(self, height:int, width:int) -> np.ndarray:
+        if self._rgb is None or self._rgb.shape[:2] != (height, width):
+            self._rgb = np.empty((height, width, 3), dtype=np.uint8)
+        return self._rgb
+
+    def _scratch(self, name:str, shape:tuple[int, ...], dtype) -> np.ndarray:
+        arr = self._yuv_scratch.get(name)
+        if arr is None or arr.shape != shape or arr.dtype != dtype:
+            arr = self._yuv_scratch[name] = np.empty(shape, dtype=dtype)
+        return arr
+
+    def to_rgb(self, frame:QVideoFrame) -> np.ndarray:
+        """
+        Возвращает RGB кадр формы (height, width, 3) с учётом поворота и отражения кадра.
+        Массив переиспользуется следующим вызовом.
+        """
+        pixel_format = frame.pixelFormat()
+        if pixel_format not in _PACKED_RGB_CHANNELS and pixel_format not in (PixelFormat.Format_NV12,
+                                                                            PixelFormat.Format_NV21,
+                                                                            PixelFormat.Format_YUV420P,
+                                                                            PixelFormat.Format_YV12):
+            return self._to_rgb_through_image(frame)
+
+        with self._timings.measure('map'):
+            if not frame.map(QVideoFrame.MapMode.ReadOnly):
+                return self._to_rgb_through_image(frame)
+        try:
+            width, height = frame.width(), frame.height()
+            if frame.rotationAngle() in (QVideoFrame.RotationAngle.Rotation90, QVideoFrame.RotationAngle.Rotation270):
+                out = self._buffer(width, height)
+            else:
+                out = self._buffer(height, width)
+            with self._timings.measure('convert'):
+                if pixel_format in _PACKED_RGB_CHANNELS:
+                    pixels = self._plane(frame, 0, height).reshape(height, -1)[:, :width * 4].reshape(height, width, 4)
+                    # channel swap and orientation are views, the only copy is into the output buffer
+                    np.copyto(out, self._orient(pixels[:, :, _PACKED_RGB_CHANNELS[pixel_format]], frame))
+                else:
+                    # channels are written through a view of the output buffer in the frame orientation
+                    self._yuv_to_rgb(frame, pixel_format, width, height, self._unorient(out, frame))
+        finally:
+            frame.unmap()
+        return out
+
+    @staticmethod
+    def _plane(frame:QVideoFrame, plane:int, rows:int) -> np.ndarray:
+        bytes_per_line = frame.bytesPerLine(plane)
+        data = np.frombuffer(frame.bits(plane), dtype=np.uint8, count=frame.mappedBytes(plane))
+        # last row may be shorter than the stride
+        if len(data) < bytes_per_line * rows:
+            data = np.concatenate((data, np.zeros(bytes_per_line * rows - len(data), dtype=np.uint8)))
+        return data[:bytes_per_line * rows].reshape(rows, bytes_per_line)
+
+    @staticmethod
+    def _orient(rgb:np.ndarray, frame:QVideoFrame) -> np.ndarray:
+        if frame.mirrored():
+            rgb = rgb[:, ::-1]
+        angle = frame.rotationAngle()
+        if angle == QVideoFrame.RotationAngle.Rotation90:
+            rgb = np.rot90(rgb, k=-1)
+        elif angle == QVideoFrame.RotationAngle.Rotation180:
+            rgb = rgb[::-1, ::-1]
+        elif angle == QVideoFrame.RotationAngle.Rotation270:
+            rgb = np.rot90(rgb, k=1)
+        return rgb
+
+    @staticmethod
+    def _unorient(out:np.ndarray, frame:QVideoFrame) -> np.ndarray:
+        """Представление out, запись кадра в которое даёт в out результат _orient"""
+        angle = frame.rotationAngle()
+        if angle == QVideoFrame.RotationAngle.Rotation90:
+            out = np.rot90(out, k=1)
+        elif angle == QVideoFrame.RotationAngle.Rotation180:
+            out = out[::-1, ::-1]
+        elif angle == QVideoFrame.RotationAngle.Rotation270:
+            out = np.rot90(out, k=-1)
+        if frame.mirrored():
+            out = out[:, ::-1]
+        return out
+
+    def _yuv_to_rgb(self, frame:QVideoFrame, pixel_format, width:int, height:int, rgb:np.ndarray):
+        chroma_height, chroma_width = (height + 1) // 2, (width + 1) // 2
+        luma = self._plane(frame, 0, height)[:, :width]
+        if pixel_format in (PixelFormat.Format_NV12, PixelFormat.Format_NV21):
+            uv = self._plane(frame, 1, chroma_height)[:, :chroma_width * 2].reshape(chroma_height, chroma_width, 2)
+            u, v = (uv[:, :, 0], uv[:, :, 1]) if pixel_format == PixelFormat.Format_NV12 else (uv[:, :, 1], uv[:, :, 0])
+        else:
+            u_plane, v_plane = (1, 2) if pixel_format == PixelFormat.Format_YUV420P else (2, 1)
+            u = self._plane(frame, u_plane, chroma_height)[:, :chroma_width]
+            v = self._plane(frame, v_plane, chroma_height)[:, :chroma_width]
+
+        y = self._scratch('y', (height, width), np.int32)
+        np.subtract(luma, 16, out=y, dtype=np.int32)
+        y *= _Y_SCALE
+        y += 128
+        chroma_u = self._scratch('u', (chroma_height, chroma_width), np.int32)
+        chroma_v = self._scratch('v', (chroma_height, chroma_width), np.int32)
+        np.subtract(u, 128, out=chroma_u, dtype=np.int32)
+        np.subtract(v, 128, out=chroma_v, dtype=np.int32)
+
+        channel = self._scratch('channel', (height, width), np.int32)
+        for index, (u_coef, v_coef) in enumerate(((0, _V_TO_R), (_U_TO_G, _V_TO_G), (_U_TO_B, 0))):
+            chroma = chroma_u * u_coef + chroma_v * v_coef
+            # every chroma sample covers 2x2 luma samples
+            np.add(y, np.repeat(np.repeat(chroma, 2, axis=0), 2, axis=1)[:height, :width], out=channel)
+            channel >>= 8
+            np.clip(channel, 0, 255, out=channel)
+            rgb[:, :, index] = channel
+
+    def _to_rgb_through_image(self, frame:QVideoFrame) -> np.ndarray:
+        with self._timings.measure('convert'):
+            image = frame.toImage().convertToFormat(QImage.Format.Format_RGB888)
+            width, height = image.width(), image.height()
+            pixels = np.frombuffer(image.constBits(), dtype=np.uint8, count=image.sizeInBytes())
+            pixels = pixels.reshape(height, image.bytesPerLine())[:, :width * 3].reshape(height, width, 3)
+            out = self._buffer(height, width)
+            np.copyto(out, pixels)
+        return out
@@ -0,0 +1,46 @@
+from dataclasses import dataclass
+from pathlib import Path
+import numpy as np
+
+import mediapipe as mp # type: ignore
+from mediapipe.tasks import python # type: ignore
+from mediapipe.tasks.python import vision # type: ignore
+from mediapipe.tasks.python.vision.core import vision_task_running_mode  # type: ignore
+
+from .face_geometry import MetricLandmarksSolver, landmarks_to_array
+
+
+FACE_LANDMARKER_MODEL_PATH = Path(__file__).parent / 'face_landmarker.task'
+
+
+@dataclass
+class DetectedHead:
+    """Результат распознавания лица в виде массивов, пригодных для передачи между процессами"""
+    head2cam_transform_mat:np.ndarray # [4, 4], translation in meters
+    landmarks_head_space:np.ndarray # [3, n], meters
+
+
+def create_face_landmarker() -> vision.FaceLandmarker:
+    run_video_mode = vision_task_running_mode.VisionTaskRunningMode.VIDEO
+    base_options = python.BaseOptions(model_asset_path=str(FACE_LANDMARKER_MODEL_PATH))
+    options = vision.FaceLandmarkerOptions(base_options=base_options,
+                                           output_face_blendshapes=False,
+                                           output_facial_transformation_matrixes=True,
+                                           num_faces=1, running_mode=run_video_mode)
+    return vision.FaceLandmarker.create_from_options(options)
+
+
+def detected_head_from_result(detection_result, solver:MetricLandmarksSolver) -> DetectedHead|None:
+    if not detection_result.face_landmarks:
+        return None
+    landmarks = landmarks_to_array(detection_result.face_landmarks[0])
+
+    landmarks_head_space, _, _ = solver.solve(landmarks)
+    head2cam_transform_mat = np.array(detection_result.facial_transformation_matrixes[0], dtype=np.float64)
+    head2cam_transform_mat[:3, 3] /= 100
+    return DetectedHead(head2cam_transform_mat, landmarks_head_space / 100)
+
+
+def detect_head(detector:vision.FaceLandmarker, rgb:np.ndarray, timestamp_mcs:int, solver:MetricLandmarksSolver) -> DetectedHead|None:
+    mp_image = mp.Image(mp.ImageFormat.SRGB, rgb)
+    return detected_head_from_result(detector.detect_for_video(mp_image, timestamp_mcs), solver)
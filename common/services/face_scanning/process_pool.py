@@ -0,0 +1,209 @@
+from dataclasses import dataclass
+import heapq
+import logging
+import multiprocessing as mp_processing
+from multiprocessing import shared_memory
+import queue
+import threading
+import traceback
+import numpy as np
+
+from .face_geometry import PCF, MetricLandmarksSolver
+from .landmarks_detection import DetectedHead, create_face_landmarker, detect_head
+
+
+@dataclass
+class PoolScanTask:
+    seq:int
+    slot:int
+    height:int
+    width:int
+    timestamp_mcs:int
+
+
+@dataclass
+class PoolScanResult:
+    seq:int
+    slot:int
+    detected_head:DetectedHead|None
+    error:str|None=None
+
+
+def _worker_main(slot_names:list[str], tasks, results):
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    try:
+        detector = create_face_landmarker()
+        solvers:dict[tuple[int, int], MetricLandmarksSolver] = dict()
+        while (task:=tasks.get()) is not None:
+            try:
+                rgb = np.ndarray((task.height, task.width, 3), dtype=np.uint8, buffer=slots[task.slot].buf)
+                if (solver:=solvers.get((task.width, task.height))) is None:
+                    solver = solvers[(task.width, task.height)] = MetricLandmarksSolver(PCF(task.width, task.height))
+                # mp.Image copies pixels, so the slot may be reused right after detection
+                detected_head = detect_head(detector, rgb, task.timestamp_mcs, solver)
+                del rgb
+                results.put(PoolScanResult(task.seq, task.slot, detected_head))
+            except Exception:
+                results.put(PoolScanResult(task.seq, task.slot, None, traceback.format_exc()))
+    finally:
+        for slot in slots:
+            slot.close()
+
+
+class LandmarkerProcessPool:
+    """
+    Пул процессов, каждый со своим FaceLandmarker.
+
+    Кадры передаются через слоты разделяемой памяти, задача ставится в очередь процесса с наименьшим числом
+    кадров в работе, в порядке поступления, поэтому метки времени каждого процесса возрастают, как требует режим VIDEO.
+    Результаты выдаются в порядке отправки кадров. Все кадры процесса, завершившегося аварийно, выдаются
+    как результаты с ошибкой, а процесс перезапускается. После MAX_RESPAWNS перезапусков пул считается неисправным.
+    """
+    MAX_RESPAWNS = 3
+
+    def __init__(self, num_workers:int, max_width:int, max_height:int, slots_per_worker:int=2) -> None:
+        self._num_workers = max(int(num_workers), 1)
+        # slot fits a frame rotated by 90 degrees too
+        side = max(max_width, max_height)
+        self._slot_size = side * side * 3
+        self._slots = [shared_memory.SharedMemory(create=True, size=self._slot_size)
+                       for _ in range(self._num_workers * slots_per_worker)]
+
+        self._free_slots:list[int] = list(range(len(self._slots)))
+        self._free_slots_condition = threading.Condition()
+        self._closed = False
+
+        self._context = mp_processing.get_context('spawn')
+        self._results = self._context.Queue()
+        # every worker has its own task queue, so the pool knows which frames a dead worker took with it
+        self._task_queues = [self._context.Queue() for _ in range(self._num_workers)]
+        self._workers = [self._spawn_worker(index) for index in range(self._num_workers)]
+        self._respawns = 0
+        self._failed = False
+
+        self._next_seq = 0
+        self._next_result_seq = 0
+        self._reorder_heap:list[tuple[int, PoolScanResult]] = []
+        # seq -> (worker index, slot) of the submitted frames without a result yet
+        self._in_flight:dict[int, tuple[int, int]] = dict()
+        self._in_flight_lock = threading.Lock()
+        # frames reported lost, their real results are dropped if they still arrive
+        self._lost_seqs:set[int] = set()
+
+    def num_workers(self) -> int:
+        return self._num_workers
+
+    def is_failed(self) -> bool:
+        return self._failed
+
+    def _spawn_worker(self, index:int):
+        worker = self._context.Process(target=_worker_main,
+                                       args=([slot.name for slot in self._slots], self._task_queues[index], self._results),
+                                       daemon=True)
+        worker.start()
+        return worker
+
+    def _check_workers(self):
+        """Выдаёт кадры завершившихся процессов как результаты с ошибкой и перезапускает процессы"""
+        for index, worker in enumerate(self._workers):
+            if worker.is_alive() or self._closed:
+                continue
+            logging.error(f'Face landmarker worker {index} exited with code {worker.exitcode}')
+            respawn = self._respawns < self.MAX_RESPAWNS
+            with self._in_flight_lock:
+                lost = [(seq, slot) for seq, (worker_index, slot) in self._in_flight.items() if worker_index == index]
+                for seq, _ in lost:
+                    del self._in_flight[seq]
+                if respawn:
+                    # tasks left in the old queue are reported lost, new ones go to the respawned worker
+                    self._task_queues[index] = self._context.Queue()
+            for seq, slot in lost:
+                self._lost_seqs.add(seq)
+                self.release_slot(slot)
+                heapq.heappush(self._reorder_heap, (seq, PoolScanResult(seq, slot, None, f'worker exited with code {worker.exitcode}')))
+            if not respawn:
+                self._failed = True
+                # wakes up the feeding thread waiting for a slot
+                with self._free_slots_condition:
+                    self._free_slots_condition.notify_all()
+                return
+            self._respawns += 1
+            self._workers[index] = self._spawn_worker(index)
+
+    def next_seq(self) -> int:
+        return self._next_seq
+
+    def fits(self, rgb:np.ndarray) -> bool:
+        return rgb.nbytes <= self._slot_size
+
+    def acquire_slot(self, timeout:float|None=None) -> int|None:
+        """Ждёт свободный слот, возвращает None если пул закрыт или истёк timeout"""
+        with self._free_slots_condition:
+            if not self._free_slots_condition.wait_for(lambda: self._free_slots or self._closed or self._failed, timeout):
+                return None
+            if self._closed or self._failed:
+                return None
+            return self._free_slots.pop()
+
+    def release_slot(self, slot:int):
+        with self._free_slots_condition:
+            self._free_slots.append(slot)
+            self._free_slots_condition.notify()
+
+    def submit(self, slot:int, rgb:np.ndarray, timestamp_mcs:int) -> int:
+        """Копирует кадр в слот и отправляет на распознавание, возвращает порядковый номер кадра"""
+        height, width = rgb.shape[:2]
+        np.copyto(np.ndarray((height, width, 3), dtype=np.uint8, buffer=self._slots[slot].buf), rgb)
+        seq = self._next_seq
+        self._next_seq += 1
+        with self._in_flight_lock:
+            loads = [0] * self._num_workers
+            for worker_index, _ in self._in_flight.values():
+                loads[worker_index] += 1
+            worker_index = loads.index(min(loads))
+            self._in_flight[seq] = (worker_index, slot)
+            self._task_queues[worker_index].put(PoolScanTask(seq, slot, height, width, timestamp_mcs))
+        return seq
+
+    def next_result(self, timeout:float|None=None) -> PoolScanResult|None:
+        """Следующий по порядку отправки результат либо None, если он не готов за timeout"""
+        while not (self._reorder_heap and self._reorder_heap[0][0] == self._next_result_seq):
+            if self._failed:
+                return None
+            try:
+                result:PoolScanResult = self._results.get(timeout=timeout)
+            except queue.Empty:
+                self._check_workers()
+                if self._reorder_heap and self._reorder_heap[0][0] == self._next_result_seq:
+                    break
+                return None
+            if result.seq in self._lost_seqs:
+                self._lost_seqs.discard(result.seq)
+                continue
+            with self._in_flight_lock:
+                self._in_flight.pop(result.seq, None)
+            self.release_slot(result.slot)
+            if result.error is not None:
+                logging.error(f'Face landmarker worker failed on frame {result.seq}: {result.error}')
+            heapq.heappush(self._reorder_heap, (result.seq, result))
+        self._next_result_seq += 1
+        return heapq.heappop(self._reorder_heap)[1]
+
+    def pending(self) -> int:
+        return self._next_seq - self._next_result_seq
+
+    def close(self):
+        with self._free_slots_condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._free_slots_condition.notify_all()
+        for tasks in self._task_queues:
+            tasks.put(None)
+        for worker in self._workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        for slot in self._slots:
+            slot.close()
+            slot.unlink()
@@ -0,0 +1,150 @@
+import logging
+from pathlib import Path
+from PySide6.QtCore import QByteArray, QObject, QTimer, QUrl, Signal, Slot
+from PySide6.Qt3DCore import Qt3DCore
+from PySide6.Qt3DRender import Qt3DRender
+from PySide6.Qt3DExtras import Qt3DExtras
+from PySide6.QtGui import QColor
+
+from common.domain.mesh_cache import VERTEX_STRIDE, MeshCache, MeshCacheMaterial, MeshCacheObject
+
+
+def _color(rgb:tuple[float, float, float]) -> QColor:
+    return QColor.fromRgbF(*(min(max(c, 0.0), 1.0) for c in rgb))
+
+
+def _vertex_attribute(parent:Qt3DCore.QNode, buffer:Qt3DCore.QBuffer, name:str,
+                      size:int, byte_offset:int, count:int) -> Qt3DCore.QAttribute:
+    attribute = Qt3DCore.QAttribute(parent)
+    attribute.setName(name)
+    attribute.setAttributeType(Qt3DCore.QAttribute.AttributeType.VertexAttribute)
+    attribute.setVertexBaseType(Qt3DCore.QAttribute.VertexBaseType.Float)
+    attribute.setVertexSize(size)
+    attribute.setBuffer(buffer)
+    attribute.setByteStride(VERTEX_STRIDE)
+    attribute.setByteOffset(byte_offset)
+    attribute.setCount(count)
+    return attribute
+
+
+class CachedSceneLoader(QObject):
+    """
+    Замена QSceneLoader для модели с MeshCache.
+
+    Создаёт под bind_entity по сущности на каждый объект кэша с именем объекта, его геометрией
+    и материалом первой части, остальные части объекта становятся дочерними сущностями.
+    Буферы вершин и индексов загружаются из отображённого в память кэша без разбора OBJ.
+    Повторяет используемую сервисом сцены часть интерфейса QSceneLoader.
+    """
+    statusChanged = Signal(Qt3DRender.QSceneLoader.Status)
+
+    def __init__(self, cache:MeshCache, bind_entity:Qt3DCore.QEntity) -> None:
+        super().__init__()
+        self._cache = cache
+        self._bind_entity = bind_entity
+        self._model_dir = cache.path.parent
+        self._status = Qt3DRender.QSceneLoader.Status.None_
+        self._entities:dict[str, Qt3DCore.QEntity] = dict()
+        self._materials:dict[str|None, Qt3DRender.QMaterial] = dict()
+        # like QSceneLoader, the scene is ready asynchronously
+        QTimer.singleShot(0, self._load)
+
+    def status(self) -> Qt3DRender.QSceneLoader.Status:
+        return self._status
+
+    def entityNames(self) -> list[str]:
+        return list(self._entities)
+
+    def entity(self, name:str) -> Qt3DCore.QEntity|None:
+        return self._entities.get(name)
+
+    def entities(self) -> list[Qt3DCore.QEntity]:
+        # the entities the loader is bound to, as for the QSceneLoader component
+        return [self._bind_entity]
+
+    def _set_status(self, status:Qt3DRender.QSceneLoader.Status):
+        if status != self._status:
+            self._status = status
+            self.statusChanged.emit(status)
+
+    @Slot()
+    def _load(self):
+        self._set_status(Qt3DRender.QSceneLoader.Status.Loading)
+        try:
+            for obj in self._cache.objects:
+                self._entities[obj.name] = self._make_object_entity(obj)
+        except Exception as e:
+            logging.exception(f'Failed to load mesh cache {self._cache.path}: {e}')
+            self._set_status(Qt3DRender.QSceneLoader.Status.Error)
+            return
+        self._set_status(Qt3DRender.QSceneLoader.Status.Ready)
+
+    def _make_object_entity(self, obj:MeshCacheObject) -> Qt3DCore.QEntity:
+        entity = Qt3DCore.QEntity(self._bind_entity)
+        entity.setObjectName(obj.name)
+
+        vertex_buffer = Qt3DCore.QBuffer(entity)
+        vertex_buffer.setData(QByteArray(self._cache.object_vertices(obj).tobytes()))
+        index_buffer = Qt3DCore.QBuffer(entity)
+        index_buffer.setData(QByteArray(self._cache.object_indices(obj).tobytes()))
+
+        for i, part in enumerate(obj.parts):
+            part_entity = entity if i == 0 else Qt3DCore.QEntity(entity)
+            geometry = Qt3DCore.QGeometry(part_entity)
+            geometry.addAttribute(_vertex_attribute(geometry, vertex_buffer, Qt3DCore.QAttribute.defaultPositionAttributeName(),
+                                                    3, 0, obj.vertex_count))
+            geometry.addAttribute(_vertex_attribute(geometry, vertex_buffer, Qt3DCore.QAttribute.defaultNormalAttributeName(),
+                                                    3, 3 * 4, obj.vertex_count))
+            geometry.addAttribute(_vertex_attribute(geometry, vertex_buffer, Qt3DCore.QAttribute.defaultTextureCoordinateAttributeName(),
+                                                    2, 6 * 4, obj.vertex_count))
+            index_attribute = Qt3DCore.QAttribute(geometry)
+            index_attribute.setAttributeType(Qt3DCore.QAttribute.AttributeType.IndexAttribute)
+            index_attribute.setVertexBaseType(Qt3DCore.QAttribute.VertexBaseType.UnsignedInt)
+            index_attribute.setVertexSize(1)
+            index_attribute.setBuffer(index_buffer)
+            index_attribute.setByteOffset(part.index_offset * 4)
+            index_attribute.setCount(part.index_count)
+            geometry.addAttribute(index_attribute)
+
+            renderer = Qt3DRender.QGeometryRenderer(part_entity)
+            renderer.setPrimitiveType(Qt3DRender.QGeometryRenderer.PrimitiveType.Triangles)
+            renderer.setGeometry(geometry)
+            part_entity.addComponent(renderer)
+            part_entity.addComponent(self._material(part.material))
+        return entity
+
+    def _material(self, name:str|None) -> Qt3DRender.QMaterial:
+        material = self._materials.get(name)
+        if material is None:
+            desc = self._cache.materials.get(name) if name is not None else None
+            material = self._materials[name] = self._make_material(desc)
+        return material
+
+    def _make_material(self, desc:MeshCacheMaterial|None) -> Qt3DRender.QMaterial:
+        if desc is None:
+            return Qt3DExtras.QPhongMaterial(self._bind_entity)
+        if desc.diffuse_map is not None:
+            material = Qt3DExtras.QDiffuseSpecularMaterial(self._bind_entity)
+            texture = Qt3DRender.QTexture2D(material)
+            image = Qt3DRender.QTextureImage(texture)
+            image.setSource(QUrl.fromLocalFile(str(self._model_dir / desc.diffuse_map)))
+            texture.addTextureImage(image)
+            material.setDiffuse(texture)
+            material.setAmbient(_color(desc.ambient))
+            material.setSpecular(_color(desc.specular))
+            material.setShininess(desc.shininess)
+            return material
+        if desc.opacity < 1:
+            alpha_material = Qt3DExtras.QPhongAlphaMaterial(self._bind_entity)
+            alpha_material.setAmbient(_color(desc.ambient))
+            alpha_material.setDiffuse(_color(desc.diffuse))
+            alpha_material.setSpecular(_color(desc.specular))
+            alpha_material.setShininess(desc.shininess)
+            alpha_material.setAlpha(desc.opacity)
+            return alpha_material
+        phong_material = Qt3DExtras.QPhongMaterial(self._bind_entity)
+        phong_material.setAmbient(_color(desc.ambient))
+        phong_material.setDiffuse(_color(desc.diffuse))
+        phong_material.setSpecular(_color(desc.specular))
+        phong_material.setShininess(desc.shininess)
+        return phong_material
@@ -0,0 +1,139 @@
+from dataclasses import dataclass, field
+import logging
+import os
+from pathlib import Path
+import threading
+from dataclasses_json import DataClassJsonMixin
+
+from common.services.scene.utils import ProjectInfo
+from .config import CATALOG_FILE_NAME, DESCRIPTION_FILE_NAME, INFO_FILE_NAME, MODEL_FOLDER_NAME
+
+
+@dataclass
+class ProjectCatalogEntry(DataClassJsonMixin):
+    folder_name:str
+    info:ProjectInfo
+    # [st_mtime_ns, st_size] of the info file the entry was read from
+    info_stamp:list[int] = field(default_factory=list)
+
+
+@dataclass
+class _CatalogIndex(DataClassJsonMixin):
+    entries:list[ProjectCatalogEntry] = field(default_factory=list)
+
+
+def _file_stamp(path:Path) -> list[int]|None:
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class ProjectsCatalog:
+    """
+    Сохраняемый на диске индекс папок проектов хранилища.
+
+    Для каждой папки хранится информация о проекте и отметка (время изменения, размер) файла информации.
+    refresh проверяет отметки и перечитывает только изменённые папки, описания сцен при этом не читаются.
+    Поиск по unique_id выполняется по словарю.
+    """
+    def __init__(self, storage_dir:Path, index_file_name:str=CATALOG_FILE_NAME) -> None:
+        self._storage_dir = storage_dir
+        self._index_path = storage_dir / index_file_name
+        self._lock = threading.Lock()
+        self._by_folder:dict[str, ProjectCatalogEntry] = dict()
+        self._by_id:dict[str, ProjectCatalogEntry] = dict()
+        self._load()
+
+    def entries(self) -> list[ProjectCatalogEntry]:
+        with self._lock:
+            return list(self._by_folder.values())
+
+    def entry_by_id(self, project_id:str) -> ProjectCatalogEntry|None:
+        with self._lock:
+            return self._by_id.get(project_id)
+
+    def refresh(self):
+        changed = False
+        folder_names = set()
+        for d in self._storage_dir.iterdir():
+            if not d.is_dir():
+                continue
+            folder_names.add(d.name)
+            changed |= self._refresh_folder(d)
+        with self._lock:
+            for folder_name in self._by_folder.keys() - folder_names:
+                self._remove_locked(folder_name)
+                changed = True
+        if changed:
+            self._save()
+
+    def update_folder(self, folder:Path):
+        """Перечитывает одну папку, например после импорта или сохранения проекта"""
+        if self._refresh_folder(folder):
+            self._save()
+
+    def remove_folder(self, folder:Path):
+        with self._lock:
+            if folder.name not in self._by_folder:
+                return
+            self._remove_locked(folder.name)
+        self._save()
+
+    def _refresh_folder(self, folder:Path) -> bool:
+        info_stamp = _file_stamp(folder / INFO_FILE_NAME)
+        valid = info_stamp is not None and (folder / DESCRIPTION_FILE_NAME).is_file() \
+            and (folder / MODEL_FOLDER_NAME).is_dir()
+        with self._lock:
+            entry = self._by_folder.get(folder.name)
+            if valid and entry is not None and entry.info_stamp == info_stamp:
+                return False
+            if entry is not None:
+                self._remove_locked(folder.name)
+        if not valid:
+            return entry is not None
+
+        try:
+            info = ProjectInfo.read_from_json(folder / INFO_FILE_NAME)
+        except Exception as e:
+            logging.warning(f'Failed to read attention project info from directory {folder}, ignoring it. Reason: {e}')
+            return entry is not None
+        with self._lock:
+            self._add_locked(ProjectCatalogEntry(folder.name, info, info_stamp))
+        return True
+
+    def _add_locked(self, entry:ProjectCatalogEntry):
+        self._by_folder[entry.folder_name] = entry
+        self._by_id[entry.info.unique_id] = entry
+
+    def _remove_locked(self, folder_name:str):
+        entry = self._by_folder.pop(folder_name)
+        project_id = entry.info.unique_id
+        if self._by_id.get(project_id) is entry:
+            del self._by_id[project_id]
+            # another folder with the same id may still be in the catalog
+            if (other:=next((e for e in self._by_folder.values() if e.info.unique_id == project_id), None)) is not None:
+                self._by_id[project_id] = other
+
+    def _load(self):
+        if not self._index_path.is_file():
+            return
+        try:
+            index = _CatalogIndex.from_json(self._index_path.read_text(encoding='utf-8'))
+        except Exception as e:
+            logging.warning(f'Failed to read projects catalog {self._index_path}, it will be rebuilt. Reason: {e}')
+            return
+        with self._lock:
+            for entry in index.entries:
+                self._add_locked(entry)
+
+    def _save(self):
+        with self._lock:
+            index = _CatalogIndex(list(self._by_folder.values()))
+        tmp_path = self._index_path.with_name(self._index_path.name + '.tmp')
+        try:
+            tmp_path.write_text(index.to_json(ensure_ascii=False, indent=4), encoding='utf-8')
+            os.replace(tmp_path, self._index_path)
+        except OSError as e:
+            logging.warning(f'Failed to write projects catalog {self._index_path}. Reason: {e}')
@@ -1,3 +1,4 @@
 DESCRIPTION_FILE_NAME = 'desc.json'
 INFO_FILE_NAME = 'meta.json'
-MODEL_FOLDER_NAME = 'mdl'
\ No newline at end of file
+MODEL_FOLDER_NAME = 'mdl'
+CATALOG_FILE_NAME = 'catalog.json'
@@ -1,12 +1,39 @@
 from abc import abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+import os
 from pathlib import Path
+from uuid import uuid4
 import zipfile
+import zlib
 from PySide6.QtCore import QObject, Signal
 from common.domain.obj_data import OBJData
 from common.services.scene.project_data import AttentionProjectData
 from common.services.scene.utils import ProjectInfo, ProjectStorageStructure
 
 
+# already compressed formats, deflating them again only costs time
+STORED_SUFFIXES = frozenset(('.png', '.jpg', '.jpeg', '.webp', '.ktx2', '.dds', '.basis', '.zip', '.gz'))
+COPY_CHUNK_SIZE = 1 << 20
+
+
+def project_files(storage:ProjectStorageStructure) -> list[Path]:
+    """Файлы проекта: модель с её mtl и текстурами, описание сцены и информация о проекте"""
+    info = ProjectInfo.read_from_json(storage.info_file_path)
+    model_path = storage.model_folder_path / info.model_file_name
+    match(model_path.suffix):
+        case '.obj':
+            obj_data = OBJData(model_path)
+            obj_data.analize_includes()
+            files = [obj_data.obj_path, *obj_data.includes['mtl'], *obj_data.includes['textures']]
+        case _:
+            raise ValueError('Unsupported model type, valid options: [".obj"]')
+    project_folder = storage.project_folder.resolve()
+    files = [f.resolve() for f in files]
+    files.append(storage.description_path.resolve())
+    files.append(storage.info_file_path.resolve())
+    return [project_folder / f.relative_to(project_folder) for f in files]
+
+
 class BaseAttentionProjectExported(QObject):
     export_complete = Signal()
     export_failed = Signal(str)
@@ -27,46 +54,92 @@ class BaseAttentionProjectExported(QObject):
 
 
 class ProjectArchiverExporter(BaseAttentionProjectExported):
+    """
+    Архив файлов проекта.
+
+    Уже сжатые форматы (текстуры) сохраняются без сжатия, файлы больше parallel_min_size
+    сжимаются параллельно в max_workers потоках. Архив пишется во временный файл
+    и появляется по export_archive_path только целиком.
+    """
+    # share of the processed bytes of all files, from 0 to 1
+    export_progress = Signal(float)
+
     def __init__(self, save_file_path:Path,
-                 project_data:AttentionProjectData) -> None:
+                 project_data:AttentionProjectData,
+                 parallel_min_size:int=4 << 20,
+                 max_workers:int|None=None) -> None:
         super().__init__(project_data)
         if save_file_path.suffix != '.zip':
             save_file_path = save_file_path.parent / (save_file_path.name + '.zip')
         
         self.export_archive_path = save_file_path
+        self.parallel_min_size = parallel_min_size
+        self.max_workers = max_workers
 
     def do_export(self, storage: ProjectStorageStructure):        
+        part_path = self.export_archive_path.with_name(f'{self.export_archive_path.name}.{uuid4().hex}.part')
         try:
             self.export_archive_path.parent.mkdir(exist_ok=True)
-            with zipfile.ZipFile(self.export_archive_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                
-                info = ProjectInfo.read_from_json(storage.info_file_path)
-                model_path = storage.model_folder_path / info.model_file_name
-                project_folder = storage.project_folder
-                match(model_path.suffix):
-                    case '.obj':
-                        obj_data = OBJData(model_path)
-                        obj_data.analize_includes()
-                        mtls = obj_data.includes['mtl']
-                        textures = obj_data.includes['textures']
-
-                        arc_name = obj_data.obj_path.relative_to(project_folder)
-                        zipf.write(obj_data.obj_path, arc_name)
-                        
-                        for mtl in mtls:
-                            arc_name = mtl.relative_to(project_folder)
-                            zipf.write(mtl, arc_name)
-                        
-                        for texture in textures:
-                            arc_name = texture.relative_to(project_folder)
-                            zipf.write(texture, arc_name)
-                    case _:
-                        raise ValueError('Unsupported model type, valid options: [".obj"]')
-                zipf.write(storage.description_path, storage.description_file_name)
-                zipf.write(storage.info_file_path, storage.info_file_name)
+            self._write_archive(part_path, storage)
+            os.replace(part_path, self.export_archive_path)
         except Exception as e:
-            if self.export_archive_path.exists():
-                self.export_archive_path.unlink()
+            part_path.unlink(missing_ok=True)
             self.export_failed.emit(str(e))
             return
         self.export_complete.emit()
+
+    def _write_archive(self, archive_path:Path, storage:ProjectStorageStructure):
+        members = [(file_path, zipfile.ZipInfo.from_file(file_path, file_path.relative_to(storage.project_folder)))
+                   for file_path in project_files(storage)]
+        total_size = sum(zinfo.file_size for _, zinfo in members) or 1
+        done_size = 0
+        with ThreadPoolExecutor(self.max_workers) as pool, \
+                zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            deflated:dict[str, Future[tuple[int, bytes]]] = dict()
+            for file_path, zinfo in members:
+                if self._compress_type(file_path) == zipfile.ZIP_DEFLATED \
+                        and self.parallel_min_size <= zinfo.file_size < zipfile.ZIP64_LIMIT:
+                    deflated[zinfo.filename] = pool.submit(_deflate_file, file_path)
+
+            # members are written in the project files order, large ones as soon as their worker is done
+            for file_path, zinfo in members:
+                if (future:=deflated.get(zinfo.filename)) is not None:
+                    crc, data = future.result()
+                    _write_deflated_member(zipf, zinfo, crc, data)
+                else:
+                    zipf.write(file_path, zinfo.filename, self._compress_type(file_path))
+                done_size += zinfo.file_size
+                self.export_progress.emit(done_size / total_size)
+
+    @staticmethod
+    def _compress_type(file_path:Path) -> int:
+        return zipfile.ZIP_STORED if file_path.suffix.lower() in STORED_SUFFIXES else zipfile.ZIP_DEFLATED
+
+
+def _deflate_file(file_path:Path) -> tuple[int, bytes]:
+    """CRC-32 и сжатое без заголовков содержимое файла, zlib отпускает GIL на время сжатия"""
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    crc = 0
+    chunks = []
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(COPY_CHUNK_SIZE):
+            crc = zlib.crc32(chunk, crc)
+            chunks.append(compressor.compress(chunk))
+    chunks.append(compressor.flush())
+    return crc, b''.join(chunks)
+
+
+def _write_deflated_member(zipf:zipfile.ZipFile, zinfo:zipfile.ZipInfo, crc:int, data:bytes):
+    # ZipFile has no API for already compressed data: the local header and the data are written
+    # the same way ZipFile.write does, the central directory is written by ZipFile on close
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.CRC = crc
+    zinfo.compress_size = len(data)
+    if zipf.fp is None:
+        raise ValueError('Attempt to write to ZIP archive that was already closed')
+    zinfo.header_offset = zipf.fp.tell()
+    zipf.fp.write(zinfo.FileHeader(False))
+    zipf.fp.write(data)
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+    zipf.start_dir = zipf.fp.tell()
@@ -5,15 +5,22 @@ from PySide6.Qt3DExtras import Qt3DExtras
 from PySide6.Qt3DRender import Qt3DRender
 from PySide6.QtGui import QColor
 
+from common.services.scene.scene_assets import SceneAssetsCache
+
 
 class Hit3DPoint(Qt3DCore.QEntity):
-    def __init__(self, color:QColor|None=None, parent=None) -> None:
+    def __init__(self, color:QColor|None=None, parent=None, assets:SceneAssetsCache|None=None) -> None:
         super().__init__(parent)
-        self.material = Qt3DExtras.QPhongMaterial(self)
-        self.material.setAmbient(QColor('yellow'))# if color is None else color)
-        
-        self.sphereMesh = Qt3DRender.QMesh()
-        self.sphereMesh.setSource(QUrl.fromLocalFile(Path(__file__).parent/'src3d/attention_point.obj'))
+        self._assets = assets
+        if assets is not None:
+            self.material = assets.phong_material(QColor('yellow'))
+            self.sphereMesh = assets.mesh('attention_point.obj')
+        else:
+            self.material = Qt3DExtras.QPhongMaterial(self)
+            self.material.setAmbient(QColor('yellow'))# if color is None else color)
+            
+            self.sphereMesh = Qt3DRender.QMesh()
+            self.sphereMesh.setSource(QUrl.fromLocalFile(Path(__file__).parent/'src3d/attention_point.obj'))
         # self.sphereMesh.statusChanged.connect(lambda status: print(f'{status=}, {self.sphereMesh.status()=}'))
         self.sphereTransform = Qt3DCore.QTransform()
         
@@ -22,7 +29,14 @@ class Hit3DPoint(Qt3DCore.QEntity):
         self.addComponent(self.sphereMesh)
 
     def set_color(self, color):
-        self.material.setAmbient(color)
+        if self._assets is None:
+            self.material.setAmbient(color)
+            return
+        material = self._assets.phong_material(color)
+        if material is not self.material:
+            self.removeComponent(self.material)
+            self.material = material
+            self.addComponent(self.material)
     
     def transform(self):
         return self.sphereTransform
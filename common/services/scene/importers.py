@@ -2,18 +2,44 @@ from abc import abstractmethod
 from dataclasses import replace
 import json
 from pathlib import Path
+import shutil
 from tempfile import TemporaryDirectory, tempdir
+import threading
 import zipfile
 from PySide6.QtCore import QObject, Signal
 from common.dtos.descriptions import AttentionSceneDescription
 from common.domain.obj_data import OBJData
-from common.services.scene.config import INFO_FILE_NAME
+from common.services.scene.config import DESCRIPTION_FILE_NAME, INFO_FILE_NAME, MODEL_FOLDER_NAME
 from common.services.scene.utils import ProjectInfo, ProjectStorageStructure, clear_directory_except_itself, copy_directory_contents, copy_obj_file_data_to_folder, read_scene_desc_from_file, write_scene_desc_to_file
 
 
+COPY_CHUNK_SIZE = 1 << 20
+
+
+class ImportCancelledError(Exception):
+    pass
+
+
 class AttentionProjectImporter(QObject):
     import_complete = Signal()
     import_failed = Signal(str)
+    # share of the imported data, from 0 to 1
+    import_progress = Signal(float)
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._cancel_event = threading.Event()
+
+    def cancel(self):
+        """Прерывает perform_import, выполняемый в другом потоке, при следующей проверке"""
+        self._cancel_event.set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def _check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise ImportCancelledError('Import cancelled')
     
     @abstractmethod
     def get_project_info(self) -> ProjectInfo:
@@ -56,50 +82,101 @@ class ProjectModelDataImporter(AttentionProjectImporter):
 
 
 class ProjectFromLocalArchiveImporter(AttentionProjectImporter):
+    """
+    Проект из архива, созданного ProjectArchiverExporter.
+
+    Состав архива проверяется по его оглавлению до записи файлов, затем каждый файл
+    распаковывается по частям сразу на своё место в папке проекта. Контрольная сумма CRC-32
+    файла проверяется zipfile по мере чтения, повреждённый архив прерывает импорт.
+    """
     def __init__(self, project_archive_path:Path,
-                 info_file_name=INFO_FILE_NAME) -> None:
+                 info_file_name=INFO_FILE_NAME,
+                 description_file_name=DESCRIPTION_FILE_NAME,
+                 model_folder_name=MODEL_FOLDER_NAME) -> None:
         super().__init__()
         self.project_archive_path = project_archive_path
         self.info_file_name = info_file_name
+        self.description_file_name = description_file_name
+        self.model_folder_name = model_folder_name
 
     def get_project_info(self) -> ProjectInfo:
         with zipfile.ZipFile(self.project_archive_path, 'r') as zipf:
             return ProjectInfo.from_json(zipf.open(self.info_file_name).read())
 
     def perform_import(self, storage: ProjectStorageStructure):
-        with TemporaryDirectory() as d:
-            tmp_dir_path = Path(d)
-            try:
-                self._unzip_to_folder_and_verify_content(self.project_archive_path, storage)
-                clear_directory_except_itself(storage.project_folder)
-                copy_directory_contents(tmp_dir_path, storage.project_folder)
-            except Exception as e:
-                self.import_failed.emit(str(e))
-                return
-            self.import_complete.emit()
-    
-    @staticmethod
-    def _unzip_to_folder_and_verify_content(project_archive_path:Path, 
-                                            storage:ProjectStorageStructure):
-        with zipfile.ZipFile(project_archive_path, 'r') as zipf:
-            # Extract all the contents of the zip file into the directory
-            zipf.extractall(storage.project_folder)
-        if not storage.description_path.exists():
+        with zipfile.ZipFile(self.project_archive_path, 'r') as zipf:
+            members = self._verified_members(zipf, storage)
+            total_size = sum(zinfo.file_size for zinfo, _ in members) or 1
+            done_size = 0
+            for zinfo, dst in members:
+                self._check_cancelled()
+                if zinfo.is_dir():
+                    dst.mkdir(parents=True, exist_ok=True)
+                    continue
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                with zipf.open(zinfo) as src, open(dst, 'wb') as f:
+                    while chunk := src.read(COPY_CHUNK_SIZE):
+                        self._check_cancelled()
+                        f.write(chunk)
+                        done_size += len(chunk)
+                        self.import_progress.emit(done_size / total_size)
+        self.import_complete.emit()
+
+    def _verified_members(self, zipf:zipfile.ZipFile, 
+                          storage:ProjectStorageStructure) -> list[tuple[zipfile.ZipInfo, Path]]:
+        project_folder = storage.project_folder.resolve()
+        members = []
+        for zinfo in zipf.infolist():
+            dst = (project_folder / zinfo.filename).resolve()
+            if not dst.is_relative_to(project_folder) or dst == project_folder:
+                raise ValueError(f'archive member {zinfo.filename} is outside of the project folder')
+            members.append((zinfo, dst))
+        names = {zinfo.filename.rstrip('/') for zinfo, _ in members}
+
+        if self.description_file_name not in names:
             raise ValueError('description file not found')
-        if not storage.info_file_path.exists():
+        if self.info_file_name not in names:
             raise ValueError('project meta file not found')
+        meta = ProjectInfo.from_json(zipf.read(self.info_file_name))
+        model_file_name = f'{self.model_folder_name}/{meta.model_file_name}'
+        if model_file_name not in names:
+            raise ValueError('model file not found')
+        if Path(meta.model_file_name).suffix != '.obj':
+            raise ValueError('Unsupported model type, valid files: [".obj"]')
+        return members
+
+
+class ProjectFromFilesImporter(AttentionProjectImporter):
+    """Проект из отдельных файлов, files - пути файлов относительно папки проекта и их расположение на диске"""
+    def __init__(self, files:dict[str, Path],
+                 info_file_name=INFO_FILE_NAME) -> None:
+        super().__init__()
+        self.files = files
+        self.info_file_name = info_file_name
+
+    def get_project_info(self) -> ProjectInfo:
+        if (info_path:=self.files.get(self.info_file_name)) is None:
+            raise ValueError('project meta file not found')
+        return ProjectInfo.read_from_json(info_path)
+
+    def perform_import(self, storage: ProjectStorageStructure):
+        project_folder = storage.project_folder.resolve()
+        for i, (rel_path, src) in enumerate(self.files.items(), 1):
+            self._check_cancelled()
+            dst = (project_folder / rel_path).resolve()
+            if not dst.is_relative_to(project_folder):
+                raise ValueError(f'file {rel_path} is outside of the project folder')
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy(src, dst)
+            self.import_progress.emit(i / len(self.files))
+        if not storage.description_path.exists():
+            raise ValueError('description file not found')
         if not storage.model_folder_path.exists():
             raise ValueError('model data folder not found')
-        meta = ProjectInfo.read_from_json(storage.description_path)
-        # verity that files in valid format
-
-        try:
-            model_file_path = storage.model_folder_path / meta.model_file_name
-            match(model_file_path.suffix):
-                case '.obj':
-                    obj_data = OBJData(model_file_path)
-                    obj_data.analize_includes()
-                case _:
-                    raise ValueError('Unsupported model type, valid files: [".obj"]')
-        except Exception as e:
-            raise Exception(f'Error when analizing model file: {e}')
+        model_file_path = storage.model_folder_path / self.get_project_info().model_file_name
+        match(model_file_path.suffix):
+            case '.obj':
+                obj_data = OBJData(model_file_path)
+                obj_data.analize_includes()
+            case _:
+                raise ValueError('Unsupported model type, valid files: [".obj"]')
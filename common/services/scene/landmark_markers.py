@@ -0,0 +1,228 @@
+from typing import cast
+import numpy as np
+from PySide6.QtCore import QByteArray
+from PySide6.Qt3DCore import Qt3DCore
+from PySide6.Qt3DRender import Qt3DRender
+from PySide6.QtGui import QColor
+
+from common.dtos.head_data import HeadData, HeadProps
+from common.dtos.utils import FACE_KEYPOINTS_SHAPE
+
+
+MARKER_HALF_SIZE = 0.0025 # same size as src3d/small_cube.obj
+
+
+# RHI takes Vulkan style GLSL, Qt3D fills the blocks at bindings 0 and 1, material parameters go to binding 2
+_VERTEX_SHADER_RHI = b'''
+#version 450
+layout(location = 0) in vec3 vertexPosition;
+layout(location = 1) in vec3 instanceOffset;
+layout(std140, binding = 1) uniform qt3d_command_uniforms {
+    mat4 modelMatrix;
+    mat4 inverseModelMatrix;
+    mat4 modelViewMatrix;
+    mat3 modelNormalMatrix;
+    mat4 inverseModelViewMatrix;
+    mat4 mvp;
+    mat4 inverseModelViewProjectionMatrix;
+};
+void main()
+{
+    gl_Position = mvp * vec4(instanceOffset + vertexPosition, 1.0);
+}
+'''
+
+_FRAGMENT_SHADER_RHI = b'''
+#version 450
+layout(std140, binding = 2) uniform qt3d_custom_uniforms {
+    vec4 markerColor;
+};
+layout(location = 0) out vec4 fragColor;
+void main()
+{
+    fragColor = markerColor;
+}
+'''
+
+_VERTEX_SHADER_GL3 = b'''
+#version 150 core
+in vec3 vertexPosition;
+in vec3 instanceOffset;
+uniform mat4 modelViewProjection;
+void main()
+{
+    gl_Position = modelViewProjection * vec4(instanceOffset + vertexPosition, 1.0);
+}
+'''
+
+_FRAGMENT_SHADER_GL3 = b'''
+#version 150 core
+uniform vec4 markerColor;
+out vec4 fragColor;
+void main()
+{
+    fragColor = markerColor;
+}
+'''
+
+_VERTEX_SHADER_GL2 = b'''
+attribute vec3 vertexPosition;
+attribute vec3 instanceOffset;
+uniform mat4 modelViewProjection;
+void main()
+{
+    gl_Position = modelViewProjection * vec4(instanceOffset + vertexPosition, 1.0);
+}
+'''
+
+_FRAGMENT_SHADER_GL2 = b'''
+#ifdef GL_ES
+precision mediump float;
+#endif
+uniform vec4 markerColor;
+void main()
+{
+    gl_FragColor = markerColor;
+}
+'''
+
+
+def _cube_triangles(half_size:float) -> np.ndarray:
+    """Вершины куба списком треугольников, [36, 3] float32"""
+    corners = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=np.float32) * half_size
+    faces = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+    triangles = [(a, b, c, a, c, d) for a, b, c, d in faces]
+    return corners[np.array(triangles).ravel()]
+
+
+def _make_technique(api:Qt3DRender.QGraphicsApiFilter.Api,
+                    profile:Qt3DRender.QGraphicsApiFilter.OpenGLProfile,
+                    major:int, minor:int,
+                    vertex_code:bytes, fragment_code:bytes, parent:Qt3DCore.QNode) -> Qt3DRender.QTechnique:
+    technique = Qt3DRender.QTechnique(parent)
+    api_filter = technique.graphicsApiFilter()
+    api_filter.setApi(api)
+    api_filter.setProfile(profile)
+    api_filter.setMajorVersion(major)
+    api_filter.setMinorVersion(minor)
+
+    filter_key = Qt3DRender.QFilterKey(technique)
+    filter_key.setName('renderingStyle')
+    filter_key.setValue('forward')
+    technique.addFilterKey(filter_key)
+
+    program = Qt3DRender.QShaderProgram(technique)
+    program.setVertexShaderCode(QByteArray(vertex_code))
+    program.setFragmentShaderCode(QByteArray(fragment_code))
+    render_pass = Qt3DRender.QRenderPass(technique)
+    render_pass.setShaderProgram(program)
+    technique.addRenderPass(render_pass)
+    return technique
+
+
+class LandmarkMarkersResources(Qt3DCore.QNode):
+    """
+    Общие для всех операторов ресурсы отрисовки ключевых точек лица:
+    вершины куба-маркера и материал с инстансингом, смещающий куб на позицию точки.
+    """
+    def __init__(self, color:QColor|None=None, parent=None) -> None:
+        super().__init__(parent)
+        cube = _cube_triangles(MARKER_HALF_SIZE)
+        self._num_cube_vertices = len(cube)
+        self._cube_buffer = Qt3DCore.QBuffer(self)
+        self._cube_buffer.setData(QByteArray(cube.tobytes()))
+
+        self._color_parameter = Qt3DRender.QParameter('markerColor', QColor('green') if color is None else color, self)
+        self._material = Qt3DRender.QMaterial(self)
+        self._material.addParameter(self._color_parameter)
+        effect = Qt3DRender.QEffect(self._material)
+        Api = Qt3DRender.QGraphicsApiFilter.Api
+        Profile = Qt3DRender.QGraphicsApiFilter.OpenGLProfile
+        effect.addTechnique(_make_technique(Api.RHI, Profile.NoProfile, 1, 0,
+                                            _VERTEX_SHADER_RHI, _FRAGMENT_SHADER_RHI, effect))
+        effect.addTechnique(_make_technique(Api.OpenGL, Profile.CoreProfile, 3, 2,
+                                            _VERTEX_SHADER_GL3, _FRAGMENT_SHADER_GL3, effect))
+        effect.addTechnique(_make_technique(Api.OpenGL, Profile.NoProfile, 2, 0,
+                                            _VERTEX_SHADER_GL2, _FRAGMENT_SHADER_GL2, effect))
+        effect.addTechnique(_make_technique(Api.OpenGLES, Profile.NoProfile, 2, 0,
+                                            _VERTEX_SHADER_GL2, _FRAGMENT_SHADER_GL2, effect))
+        self._material.setEffect(effect)
+
+    def material(self) -> Qt3DRender.QMaterial:
+        return self._material
+
+    def color(self) -> QColor:
+        return cast(QColor, self._color_parameter.value())
+
+    def set_color(self, color:QColor):
+        self._color_parameter.setValue(color)
+
+    def make_cube_position_attribute(self, parent:Qt3DCore.QNode) -> Qt3DCore.QAttribute:
+        attribute = Qt3DCore.QAttribute(parent)
+        attribute.setName(Qt3DCore.QAttribute.defaultPositionAttributeName())
+        attribute.setAttributeType(Qt3DCore.QAttribute.AttributeType.VertexAttribute)
+        attribute.setVertexBaseType(Qt3DCore.QAttribute.VertexBaseType.Float)
+        attribute.setVertexSize(3)
+        attribute.setByteStride(3 * 4)
+        attribute.setCount(self._num_cube_vertices)
+        attribute.setBuffer(self._cube_buffer)
+        return attribute
+
+    def num_cube_vertices(self) -> int:
+        return self._num_cube_vertices
+
+
+class LandmarkMarkersEntity(Qt3DCore.QEntity):
+    """
+    Ключевые точки лица оператора, отрисованные одним вызовом с инстансингом.
+
+    Позиции точек передаются одним буфером атрибута на экземпляр за кадр,
+    вершины куба и материал берутся из общих LandmarkMarkersResources.
+    """
+    def __init__(self, resources:LandmarkMarkersResources, parent=None) -> None:
+        super().__init__(parent)
+        self._resources = resources
+        self._num_markers = FACE_KEYPOINTS_SHAPE[0]
+
+        self._offsets_buffer = Qt3DCore.QBuffer(self)
+        self._offsets_buffer.setData(QByteArray(np.zeros(FACE_KEYPOINTS_SHAPE, dtype=np.float32).tobytes()))
+
+        offsets_attribute = Qt3DCore.QAttribute(self)
+        offsets_attribute.setName('instanceOffset')
+        offsets_attribute.setAttributeType(Qt3DCore.QAttribute.AttributeType.VertexAttribute)
+        offsets_attribute.setVertexBaseType(Qt3DCore.QAttribute.VertexBaseType.Float)
+        offsets_attribute.setVertexSize(3)
+        offsets_attribute.setByteStride(3 * 4)
+        offsets_attribute.setDivisor(1)
+        offsets_attribute.setCount(self._num_markers)
+        offsets_attribute.setBuffer(self._offsets_buffer)
+
+        self._geometry = Qt3DCore.QGeometry(self)
+        self._geometry.addAttribute(resources.make_cube_position_attribute(self._geometry))
+        self._geometry.addAttribute(offsets_attribute)
+
+        self._renderer = Qt3DRender.QGeometryRenderer(self)
+        self._renderer.setPrimitiveType(Qt3DRender.QGeometryRenderer.PrimitiveType.Triangles)
+        self._renderer.setGeometry(self._geometry)
+        self._renderer.setVertexCount(resources.num_cube_vertices())
+        self._renderer.setInstanceCount(self._num_markers)
+        self.addComponent(self._renderer)
+        self.addComponent(resources.material())
+
+        self._transform = Qt3DCore.QTransform(self)
+        self.addComponent(self._transform)
+
+    def set_keypoints(self, keypoints:np.ndarray):
+        """keypoints: [478, 3] в системе координат головы"""
+        offsets = np.ascontiguousarray(keypoints, dtype=np.float32)
+        self._offsets_buffer.setData(QByteArray(offsets.tobytes()))
+
+    def set_head_data(self, head_data:HeadData):
+        if head_data.head_props:
+            self._transform.setTranslation(head_data.head_props.position)
+            self._transform.setRotation(head_data.head_props.rotation)
+        if head_data.view_origin == HeadData.ViewOrigin.NOT_VISIBLE:
+            self.setEnabled(False)
+            return
+        self.setEnabled(True)
+        self.set_keypoints(cast(HeadProps, head_data.head_props).keypoints)
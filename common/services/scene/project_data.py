@@ -11,12 +11,14 @@ class AttentionProjectData(QObject):
     name_changed = Signal(str)
     def __init__(self,
                  folder:Path,
+                 info:ProjectInfo|None=None,
                  ) -> None:
+        """info - уже прочитанная информация о проекте, описание сцены читается при первом обращении"""
         super().__init__()
         self.project_folder:Path = folder
 
-        self._desc:AttentionSceneDescription = read_scene_desc_from_file(self.project_folder / DESCRIPTION_FILE_NAME)
-        self.info = ProjectInfo.read_from_json(self.project_folder / INFO_FILE_NAME)
+        self._desc:AttentionSceneDescription|None = None
+        self.info = info if info is not None else ProjectInfo.read_from_json(self.project_folder / INFO_FILE_NAME)
 
     def __eq__(self, __value: object) -> bool:
         if not isinstance(__value, AttentionProjectData):
@@ -39,6 +41,8 @@ class AttentionProjectData(QObject):
         return self.info.creation_date
 
     def description(self) -> AttentionSceneDescription:
+        if self._desc is None:
+            self._desc = read_scene_desc_from_file(self.project_folder / DESCRIPTION_FILE_NAME)
         return self._desc
     
     def storage(self):
@@ -48,5 +52,5 @@ class AttentionProjectData(QObject):
         self._desc = desc
 
     def save(self):
-        write_scene_desc_to_file(self._desc, self.project_folder / DESCRIPTION_FILE_NAME)
+        write_scene_desc_to_file(self.description(), self.project_folder / DESCRIPTION_FILE_NAME)
         self.info.write_to_json(self.project_folder / INFO_FILE_NAME)
\ No newline at end of file
@@ -4,6 +4,7 @@ from datetime import datetime
 import json
 import logging
 from re import S
+import threading
 from typing import cast
 from uuid import uuid4
 from dataclasses_json import DataClassJsonMixin
@@ -11,7 +12,9 @@ import shutil
 from PySide6.QtCore import QObject, Signal, Slot
 
 from pathlib import Path
-from common.services.scene.importers import AttentionProjectImporter
+from common.domain.mesh_cache import write_mesh_cache
+from common.services.scene.catalog import ProjectCatalogEntry, ProjectsCatalog
+from common.services.scene.importers import AttentionProjectImporter, ImportCancelledError
 
 from common.services.scene.project_data import AttentionProjectData
 from common.services.scene.utils import ProjectInfo, ProjectStorageStructure, clear_directory_except_itself, init_project_storage_struct
@@ -27,6 +30,8 @@ class ProjectImportProcess(QObject):
     complete = Signal()
     failed = Signal(str)
     cancelled = Signal()
+    # share of the imported data, from 0 to 1
+    progress = Signal(float)
 
     def __init__(self, 
                  repo:'AttentionProjectsRepo',
@@ -35,10 +40,14 @@ class ProjectImportProcess(QObject):
         super().__init__()
         self.repo = repo
         self.importer = importer
+        self.importer.import_progress.connect(self.progress)
         self.project_info:ProjectInfo = self.importer.get_project_info()
         storage = self.repo.create_new_storage_for_project()
         self.storage = storage
+        # cancel may be called from the GUI thread while run works in the background
+        self._state_lock = threading.Lock()
         self._cancelled = False
+        self._running = False
     
     def project_name(self):
         return self.project_info.project_name
@@ -47,27 +56,59 @@ class ProjectImportProcess(QObject):
         return next(filter(lambda proj: proj.project_id()==_id, self.repo.projects_data()), None)
 
     def project_already_exists(self):
-        return self._find_project(self.project_info.unique_id) is not None
+        return self.repo.has_project(self.project_info.unique_id)
     
     def run(self, override_if_exists=False):
-        if self._cancelled:
-            self.failed.emit('Import cancelled')
-            return
+        with self._state_lock:
+            if self._cancelled:
+                self.failed.emit('Import cancelled')
+                return
+            self._running = True
         if self.project_already_exists() and not override_if_exists:
+            with self._state_lock:
+                self._running = False
             self.failed.emit('project already exists')
             return
+        self.started.emit()
         try:
             self.importer.perform_import(self.storage)
             if self._cancelled:
-                raise Exception('Import cancelled')
+                raise ImportCancelledError('Import cancelled')
         except Exception as e:
-            shutil.rmtree(self.storage.project_folder)
-            self.failed.emit(str(e))
+            shutil.rmtree(self.storage.project_folder, ignore_errors=True)
+            with self._state_lock:
+                self._running = False
+            if isinstance(e, ImportCancelledError):
+                self.cancelled.emit()
+            else:
+                self.failed.emit(str(e))
             return
+        with self._state_lock:
+            self._running = False
+        self._write_model_cache()
         self.complete.emit()
 
+    def _write_model_cache(self):
+        # scene loading falls back to the OBJ when the cache is missing, so a failure is not fatal
+        model_path = self.storage.model_folder_path / self.project_info.model_file_name
+        if model_path.suffix != '.obj':
+            return
+        try:
+            write_mesh_cache(model_path)
+        except Exception as e:
+            logging.warning(f'Failed to write mesh cache for {model_path}: {e}')
+
+    def run_in_background(self, override_if_exists=False):
+        """run в отдельном потоке, сигналы процесса доставляются в поток получателей"""
+        threading.Thread(target=self.run, args=(override_if_exists,), daemon=True).start()
+
     def cancel(self):
-        self._cancelled = True
+        with self._state_lock:
+            self._cancelled = True
+            self.importer.cancel()
+            if self._running:
+                # run stops at the next chunk, removes the project folder and reports cancellation
+                return
         if self.storage.project_folder.exists():
             shutil.rmtree(self.storage.project_folder)
             self.cancelled.emit()
@@ -82,30 +123,30 @@ class AttentionProjectsRepo(QObject):
         self.storage_dir = storage_dir
         self.storage_dir.mkdir(parents=True, exist_ok=True)
         self._cached_id2projects_data:dict[str, AttentionProjectData] = dict()
-
-    def _scan_projects(self) -> list[AttentionProjectData]:
-        projects:list[AttentionProjectData] = []
-        for d in self.storage_dir.iterdir():
-            meta_path = d / INFO_FILE_NAME
-            desc_path = d / DESCRIPTION_FILE_NAME
-            model_folder_path = d / MODEL_FOLDER_NAME
-            if meta_path.exists() and meta_path.is_file() and\
-                desc_path.exists() and desc_path.is_file() and\
-                model_folder_path.exists() and model_folder_path.is_dir():
-                try:
-                    proj = AttentionProjectData(d)
-                except Exception as e:
-                    logging.warning(f'Failed to create attention project from directory {d}, ignoring it. Reason: {e}')
-                    continue
-                projects.append(proj)
-        return projects
+        self._catalog = ProjectsCatalog(self.storage_dir)
+        self._catalog.refresh()
 
     def projects_data(self) -> list[AttentionProjectData]:
-        for proj in self._scan_projects():
-            if proj.project_id() not in self._cached_id2projects_data:
-                self._cached_id2projects_data[proj.project_id()] = proj
+        self._catalog.refresh()
+        id2entries:dict[str, list[ProjectCatalogEntry]] = dict()
+        for entry in self._catalog.entries():
+            id2entries.setdefault(entry.info.unique_id, []).append(entry)
+        for project_id, entries in id2entries.items():
+            cached = self._cached_id2projects_data.get(project_id)
+            # a folder sharing the id (an import overriding the project) does not replace the cached project
+            if cached is None or all(cached.project_folder != self.storage_dir / entry.folder_name for entry in entries):
+                entry = entries[0]
+                self._cached_id2projects_data[project_id] = AttentionProjectData(self.storage_dir / entry.folder_name,
+                                                                                 replace(entry.info))
+        # projects whose folders are gone
+        for project_id in self._cached_id2projects_data.keys() - id2entries.keys():
+            del self._cached_id2projects_data[project_id]
         return list(self._cached_id2projects_data.values())
 
+    def has_project(self, id:str) -> bool:
+        """Проверка по каталогу, можно вызывать из потока импорта"""
+        return self._catalog.entry_by_id(id) is not None
+
     def _get_free_project_folder(self):
         dirs = list_numeric_subfolders_names(self.storage_dir)
         print(f'{dirs=}')
@@ -121,8 +162,10 @@ class AttentionProjectsRepo(QObject):
         return storage
     
     def remove_project_data(self, proj:AttentionProjectData):
-        del self._cached_id2projects_data[proj.project_id()]
+        if self._cached_id2projects_data.get(proj.project_id()) is proj:
+            del self._cached_id2projects_data[proj.project_id()]
         shutil.rmtree(proj.storage().project_folder)
+        self._catalog.remove_folder(proj.project_folder)
         proj.removed.emit()
 
     def create_import_project_process(self, 
@@ -135,11 +178,17 @@ class AttentionProjectsRepo(QObject):
     def _project_imported(self):
         storage = cast(ProjectImportProcess, self.sender()).storage
         proj = AttentionProjectData(storage.project_folder)
-        
-        maybe_old_project = self._cached_id2projects_data.get(proj.project_id())
-        if maybe_old_project:
+
+        cached = self._cached_id2projects_data.get(proj.project_id())
+        for entry in self._catalog.entries():
+            old_folder = self.storage_dir / entry.folder_name
+            if entry.info.unique_id != proj.project_id() or old_folder == proj.project_folder:
+                continue
             # папка с проектом с таким же project_id будет удалена, проект по факту создан с нуля
-            self.remove_project_data(maybe_old_project)
+            self.remove_project_data(cached if cached is not None and cached.project_folder == old_folder
+                                     else AttentionProjectData(old_folder))
+        self._catalog.update_folder(storage.project_folder)
+        self._cached_id2projects_data[proj.project_id()] = proj
         self.project_data_imported.emit(proj)
 
     def get_project_data_by_id(self, id:str) -> AttentionProjectData|None:
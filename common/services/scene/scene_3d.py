@@ -18,15 +18,22 @@ from dataclasses import dataclass
 from datetime import timedelta, datetime
 import numpy as np
 from functools import partial
+import threading
 import traceback
 from common.domain.interfaces import Person, SceneObj
+from common.domain.mesh_cache import MeshCache, write_mesh_cache
 from common.dtos.head_data import EyesTransforms
 from common.dtos.head_data import HeadData, HeadProps
-from common.dtos.hits import PerformedRayCastResult
+from common.dtos.hits import ColumnarRayCastResult
+from common.rays_casting.batched_caster import BatchedPersonsRayCaster
+from common.rays_casting.bvh import TrianglesBVH
 from common.rays_casting.casters import AggregatedCastResult, MultipleRayCastersEntity
 
+from common.services.scene.cached_scene import CachedSceneLoader
 from common.services.scene.caster_pointer import CasterPointerEntity
 from common.services.scene.hit_3d_point import Hit3DPoint
+from common.services.scene.landmark_markers import LandmarkMarkersEntity
+from common.services.scene.scene_assets import SceneAssetsCache
 from common.widgets.render_window import RenderWindow
 
 
@@ -37,6 +44,10 @@ class ViewState(Enum):
     Selected=1
     Errored=2
 
+class RayCastingBackend(Enum):
+    Qt3D=0
+    CPU=1
+
 src3d = Path(__file__).parent/"src3d"
 
 
@@ -128,68 +139,20 @@ class SceneObj3dViewComponent(Qt3DCore.QComponent):
             if material_to_set not in obj_ent.components():
                 obj_ent.addComponent(material_to_set)
 
-class SmallMarkerCube(Qt3DCore.QEntity):
-    def __init__(self, parent=None) -> None:
-        super().__init__(parent)
-        self._cube_mesh = Qt3DRender.QMesh(self)
-        self._cube_mesh.setSource(QUrl.fromLocalFile(src3d / 'small_cube.obj'))
-        self.addComponent(self._cube_mesh)
-
-        self._material:Qt3DRender.QMaterial = Qt3DExtras.QPhongMaterial()
-        self._material.setAmbient(QColor('green'))
-        self.addComponent(self._material)
-
-        self._transform = Qt3DCore.QTransform(self)
-        self.addComponent(self._transform)
-        
-    def set_material(self, material:Qt3DRender.QMaterial):
-        self.removeComponent(self._material)
-        self._material = material
-        self.addComponent(self._material)
-
-    def set_position(self, pos:QVector3D):
-        self._transform.setTranslation(pos)
-
-
-class FaceFromCubes(Qt3DCore.QEntity):
-    def __init__(self, parent=None) -> None:
-        super().__init__(parent)
-        self._cubes = [SmallMarkerCube(self) for _ in range(478)]
-        self._transform = Qt3DCore.QTransform()
-        self.addComponent(self._transform)
-    
-    def set_material(self, material:Qt3DRender.QMaterial):
-        for p in self._cubes:
-            p.set_material(material)
-
-    def set_head_data(self, head_data:HeadData):
-        if head_data.head_props:
-            self._transform.setTranslation(head_data.head_props.position)
-            self._transform.setRotation(head_data.head_props.rotation)
-        if head_data.view_origin == HeadData.ViewOrigin.NOT_VISIBLE:
-            self.setEnabled(False)
-            return
-        self.setEnabled(True)
-        for marker_cube, kp in zip(self._cubes, cast(HeadProps, head_data.head_props).keypoints):
-            pos = QVector3D(*kp)
-            marker_cube.set_position(pos)
-
-
 class Person3DModelEntity(Qt3DCore.QEntity):
     def __init__(self, person:Person,
                  scene_objs_picking_layer:Qt3DRender.QLayer,
+                 assets:SceneAssetsCache,
                  parent:Qt3DCore.QEntity) -> None:
         super().__init__(parent)
         self._person = person
+        self._assets = assets
         self._workspace_transform = Qt3DCore.QTransform(self)
         self.addComponent(self._workspace_transform)
 
         self._camera = Qt3DCore.QEntity(self)
         self._camera.setObjectName('camera')
-        self._camera_loader = Qt3DRender.QSceneLoader(self._camera)
-        self._camera.addComponent(self._camera_loader)
-        self._camera_loader.setSource(QUrl.fromLocalFile(src3d / "webcam.obj"))
-        # self._camera_loader.statusChanged.connect(lambda status: print(status, self._camera_loader.status()))
+        self._camera_model = assets.instantiate_scene('webcam.obj', self._camera)
         self._camera_transform = Qt3DCore.QTransform()
         # self._camera_transform.setRotationY(180)
         self._camera.addComponent(self._camera_transform)
@@ -201,34 +164,22 @@ class Person3DModelEntity(Qt3DCore.QEntity):
         self._head_transform.setRotationY(180)
         self._head_entity.addComponent(self._head_transform)
 
-        self._head_mesh = Qt3DRender.QMesh(self._head_entity)
-        self._head_mesh.setSource(QUrl.fromLocalFile(src3d / 'canonical head processed.obj'))
-        # self._head_mesh.statusChanged.connect(lambda status: print(status, self._head_mesh.status()))
-        self._head_mesh_material = Qt3DExtras.QPhongMaterial(self._head_entity)
-        self._head_mesh_material.setAmbient(self._person.head_color())
+        self._head_mesh = assets.mesh('canonical head processed.obj')
+        self._head_mesh_material = assets.phong_material(self._person.head_color())
         self._head_entity.addComponent(self._head_mesh)
         self._head_entity.addComponent(self._head_mesh_material)
 
-        self._errored_material = Qt3DExtras.QPhongMaterial(self._head_entity)
-        self._errored_material.setAmbient(QColor(240, 20, 20))
-
-        self._selected_material = Qt3DExtras.QPhongMaterial(self._head_entity)
-        self._selected_material.setAmbient(QColor(220, 200, 20))
-
-        eye_obj_url = QUrl.fromLocalFile(src3d / 'canonical head eyes.obj')
+        self._errored_material = assets.phong_material(QColor(240, 20, 20))
+        self._selected_material = assets.phong_material(QColor(220, 200, 20))
 
         self._left_eye = Qt3DCore.QEntity(self._head_entity)
-        left_eye_loader = Qt3DRender.QSceneLoader(self._left_eye)
-        left_eye_loader.setSource(eye_obj_url)
-        self._left_eye.addComponent(left_eye_loader)
+        assets.instantiate_scene('canonical head eyes.obj', self._left_eye)
         self._left_eye_transform = Qt3DCore.QTransform(self._left_eye)
         self._left_eye_transform.setTranslation(QVector3D(-0.032, 0.025, -0.025))
         self._left_eye.addComponent(self._left_eye_transform)
 
         self._right_eye = Qt3DCore.QEntity(self._head_entity)
-        right_eye_loader = Qt3DRender.QSceneLoader(self._right_eye)
-        right_eye_loader.setSource(eye_obj_url)
-        self._right_eye.addComponent(right_eye_loader)
+        assets.instantiate_scene('canonical head eyes.obj', self._right_eye)
         self._right_eye_transform = Qt3DCore.QTransform(self._right_eye)
         self._right_eye_transform.setTranslation(QVector3D(0.032, 0.025, -0.025))
         self._right_eye.addComponent(self._right_eye_transform)
@@ -238,15 +189,15 @@ class Person3DModelEntity(Qt3DCore.QEntity):
         self._between_eyes_transform.setTranslation(QVector3D(0, 0.025, -0.025))
         self._between_eyes.addComponent(self._between_eyes_transform)
 
-        self._between_eyes_pointer = CasterPointerEntity(parent=self._between_eyes)
-        self._left_eye_pointer = CasterPointerEntity(parent=self._left_eye)
-        self._right_eye_pointer = CasterPointerEntity(parent=self._right_eye)
+        self._between_eyes_pointer = CasterPointerEntity(parent=self._between_eyes, assets=assets)
+        self._left_eye_pointer = CasterPointerEntity(parent=self._left_eye, assets=assets)
+        self._right_eye_pointer = CasterPointerEntity(parent=self._right_eye, assets=assets)
 
         self._between_eyes_caster = MultipleRayCastersEntity(parent=self._between_eyes)
         self._left_eye_caster = MultipleRayCastersEntity(parent=self._left_eye)
         self._right_eye_caster = MultipleRayCastersEntity(parent=self._right_eye)
 
-        self._attention_hit_points = [Hit3DPoint(self._person.head_color(), self) for _ in range(10)]
+        self._attention_hit_points = [Hit3DPoint(self._person.head_color(), self, assets) for _ in range(10)]
         for p in self._attention_hit_points:
             p.setEnabled(False)
         # self._per_point_hit_result:list[tuple[SceneObj, QVector3D, QVector3D]|None] =\
@@ -270,7 +221,7 @@ class Person3DModelEntity(Qt3DCore.QEntity):
 
         self._person.head_data_changed.connect(self._handle_person_head_data_changed)
 
-        self._head_from_cubes = FaceFromCubes(self._camera)
+        self._landmark_markers = LandmarkMarkersEntity(assets.landmark_markers(), self._camera)
 
         self._obj_picker = Qt3DRender.QObjectPicker(self)
         self._obj_picker.clicked.connect(self._handle_obj_clicked)
@@ -298,7 +249,7 @@ class Person3DModelEntity(Qt3DCore.QEntity):
 
     @Slot(HeadData)
     def _handle_person_head_data_changed(self, data:HeadData):
-        self._head_from_cubes.set_head_data(data)
+        self._landmark_markers.set_head_data(data)
 
         if data.view_origin == HeadData.ViewOrigin.NOT_VISIBLE:
             self._head_entity.setEnabled(False)
@@ -340,9 +291,9 @@ class Person3DModelEntity(Qt3DCore.QEntity):
                     pos_loc.append(pos_local)
 
         now = datetime.now()
-        performed_cast_result = PerformedRayCastResult(now, 
-                                                      scene_obj_ids, 
-                                                      pos_glob, pos_loc)
+        performed_cast_result = ColumnarRayCastResult.from_points(now, 
+                                                                  scene_obj_ids, 
+                                                                  pos_glob, pos_loc)
         self._person.set_performed_ray_cast_result(performed_cast_result)
 
     @Slot()
@@ -354,10 +305,10 @@ class Person3DModelEntity(Qt3DCore.QEntity):
         if self._last_shown_hits_results_timestamp < performed_hits_result.timestamp:
             self._last_shown_hits_results_timestamp = performed_hits_result.timestamp
 
-            enable_points = self._attention_hit_points[:len(performed_hits_result.hits_global)]
-            disable_points = self._attention_hit_points[len(performed_hits_result.hits_global):]
-            for p, hit_world in zip(enable_points, performed_hits_result.hits_global):
-                p.transform().setTranslation(hit_world)
+            enable_points = self._attention_hit_points[:len(performed_hits_result)]
+            disable_points = self._attention_hit_points[len(performed_hits_result):]
+            for p, hit_world in zip(enable_points, performed_hits_result.world.tolist()):
+                p.transform().setTranslation(QVector3D(*hit_world))
                 if not p.isEnabled():
                     p.setEnabled(True)
             for p in disable_points:
@@ -389,7 +340,12 @@ class Person3DModelEntity(Qt3DCore.QEntity):
 
     @Slot(QColor)
     def _handle_head_color_changed(self, color:QColor):
-        self._head_mesh_material.setAmbient(color)
+        material = self._assets.phong_material(color)
+        if material is not self._head_mesh_material:
+            if self._head_mesh_material in self._head_entity.components():
+                self._head_entity.removeComponent(self._head_mesh_material)
+                self._head_entity.addComponent(material)
+            self._head_mesh_material = material
         for p in self._attention_hit_points:
             p.set_color(color)
 
@@ -465,6 +421,9 @@ class AttentionScene3DService(QObject):
     callibration_point_enabled_changed = Signal(bool)
     callibration_point_position_changed = Signal(QPointF)
 
+    # emitted from the BVH building thread, delivered on the GUI thread
+    _cpu_bvh_built = Signal(int, object)
+
     def __init__(self, render_window:RenderWindow) -> None:
         super().__init__()
         self._render_window:RenderWindow = render_window
@@ -488,11 +447,13 @@ class AttentionScene3DService(QObject):
         self._scene_objs_root.addComponent(self._scene_objs_root_tr)
         self._scene_objs_root.addComponent(self._scene_objs_pick_layer)
 
-        self._scene_objs_loader:Qt3DRender.QSceneLoader|None = None
+        self._scene_objs_loader:Qt3DRender.QSceneLoader|CachedSceneLoader|None = None
+        self._mesh_cache:MeshCache|None = None
 
         self._person_entities_root = Qt3DCore.QEntity(self._scene_3d)
         self._person_entities_root.addComponent(Qt3DCore.QTransform(self._person_entities_root))
         self._person_entities_root.setObjectName('Root for all person entities')
+        self._assets = SceneAssetsCache(self._scene_3d)
 
         self._is_loading = False
         self._person_entities:list[Person3DModelEntity] = []
@@ -508,6 +469,87 @@ class AttentionScene3DService(QObject):
         self._screen_caster.hitsChanged.connect(self._process_screen_hit)
         self._scene_3d.addComponent(self._screen_caster)
 
+        self._objs_file_path:Path|None = None
+        self._tracked_persons:list[Person] = []
+        self._ray_casting_backend = RayCastingBackend.Qt3D
+        self._cpu_caster:BatchedPersonsRayCaster|None = None
+        # BVHs built for an older generation are dropped
+        self._cpu_caster_generation = 0
+        self._cpu_bvh_built.connect(self._install_cpu_caster)
+        self._cpu_cast_timer = QTimer(self)
+        self._cpu_cast_timer.setInterval(40)
+        self._cpu_cast_timer.setSingleShot(False)
+        self._cpu_cast_timer.timeout.connect(self._perform_cpu_cast)
+
+    def ray_casting_backend(self) -> RayCastingBackend:
+        return self._ray_casting_backend
+
+    def set_ray_casting_backend(self, backend:RayCastingBackend):
+        if backend == self._ray_casting_backend:
+            return
+        tracked_persons = list(self._tracked_persons)
+        for person in tracked_persons:
+            self.set_tracking(person, False)
+        self._ray_casting_backend = backend
+        if backend == RayCastingBackend.CPU:
+            self._build_cpu_caster()
+        else:
+            self._drop_cpu_caster()
+        for person in tracked_persons:
+            self.set_tracking(person, True)
+
+    def cpu_caster(self) -> BatchedPersonsRayCaster|None:
+        return self._cpu_caster
+
+    def _drop_cpu_caster(self):
+        self._cpu_caster = None
+        self._cpu_caster_generation += 1
+        self._update_cpu_cast_timer()
+
+    def _build_cpu_caster(self):
+        """Строит BVH сцены в фоновом потоке, caster заменяется по готовности"""
+        self._drop_cpu_caster()
+        if self._objs_file_path is None or self._is_loading:
+            return
+        threading.Thread(target=self._build_bvh,
+                         args=(self._cpu_caster_generation, self._objs_file_path, self._mesh_cache),
+                         daemon=True).start()
+
+    def _build_bvh(self, generation:int, objs_file_path:Path, mesh_cache:MeshCache|None):
+        try:
+            bvh = TrianglesBVH(mesh_cache.obj_meshes()) if mesh_cache is not None else \
+                TrianglesBVH.from_obj_file(objs_file_path)
+        except Exception as e:
+            logging.exception(f'Failed to build BVH for {objs_file_path}: {e}')
+            return
+        self._cpu_bvh_built.emit(generation, bvh)
+
+    @Slot(int, object)
+    def _install_cpu_caster(self, generation:int, bvh:TrianglesBVH):
+        if generation != self._cpu_caster_generation:
+            return
+        self._cpu_caster = BatchedPersonsRayCaster(bvh)
+        for person in self._tracked_persons:
+            self._cpu_caster.add_person(person)
+        self._update_cpu_cast_timer()
+
+    def _update_cpu_cast_timer(self):
+        if self._cpu_caster is not None and self._cpu_caster.persons():
+            if not self._cpu_cast_timer.isActive():
+                self._cpu_cast_timer.start()
+        else:
+            self._cpu_cast_timer.stop()
+
+    @Slot()
+    def _perform_cpu_cast(self):
+        if self._cpu_caster is None:
+            return
+        for person in self._cpu_caster.persons():
+            if person.is_removed_from_scene():
+                self.set_tracking(person, False)
+        for person, cast_result in self._cpu_caster.cast(datetime.now()).items():
+            person.set_performed_ray_cast_result(cast_result)
+
     def enable_callibration_point(self, enable:bool):
         print(f'enable_callibration_point({enable=})')
         self._calib_point.setEnabled(enable)
@@ -559,6 +601,20 @@ class AttentionScene3DService(QObject):
         print(f'set_tracking({person=}, {is_tracking=})')
         def filter_person(ent:Person3DModelEntity) -> TypeGuard[Person3DModelEntity]:
             return ent._person.element_id() == person.element_id()
+        if is_tracking and person not in self._tracked_persons:
+            self._tracked_persons.append(person)
+        elif not is_tracking and person in self._tracked_persons:
+            self._tracked_persons.remove(person)
+
+        if self._ray_casting_backend == RayCastingBackend.CPU:
+            if self._cpu_caster is not None:
+                if is_tracking:
+                    self._cpu_caster.add_person(person)
+                else:
+                    self._cpu_caster.remove_person(person)
+                self._update_cpu_cast_timer()
+            return
+
         person_ent = next(filter(filter_person, self._person_entities), None)
         print(f'{self._person_entities=}')
         if person_ent:
@@ -589,6 +645,7 @@ class AttentionScene3DService(QObject):
         
         p = Person3DModelEntity(person, 
                             self._scene_objs_pick_layer, 
+                            self._assets,
                             self._person_entities_root)
         p.set_selectable_by_picking(self._elements_selectable_by_picking)
         self._person_entities.append(p)
@@ -603,7 +660,10 @@ class AttentionScene3DService(QObject):
             return
         self._remove_old_workspaces()
         self._remove_old_scene_objs()
-        url = QUrl.fromLocalFile(str(Path(file_path).resolve()))
+        # operator assets are parsed while the project's scene objs are loading
+        self._assets.prewarm()
+        self._objs_file_path = Path(file_path).resolve()
+        url = QUrl.fromLocalFile(str(self._objs_file_path))
         self._make_new_scene_obj_loader(url)
         self._is_loading = True
         self.scene_objs_loading_started.emit(url)
@@ -642,9 +702,12 @@ class AttentionScene3DService(QObject):
         
         self._remove_old_workspaces()
         self._remove_old_scene_objs()
+        self._objs_file_path = None
 
     def _remove_old_workspaces(self):
         logging.info('removing old workspaces')
+        self._tracked_persons.clear()
+        self._drop_cpu_caster()
         ents = list(self._person_entities)
         self._person_entities.clear()
         for pe in ents:
@@ -671,15 +734,32 @@ class AttentionScene3DService(QObject):
             self._scene_objs_loader.setParent(None) # type: ignore
             self._scene_objs_loader.deleteLater()
             self._scene_objs_loader = None
+        self._mesh_cache = None
         
 
     def _make_new_scene_obj_loader(self, src:QUrl):
         bind_entity = Qt3DCore.QEntity(self._scene_objs_root)
         bind_entity.addComponent(Qt3DCore.QTransform())
-        self._scene_objs_loader = Qt3DRender.QSceneLoader(bind_entity)
-        bind_entity.addComponent(self._scene_objs_loader)
+        obj_path = Path(src.toLocalFile())
+        self._mesh_cache = MeshCache.open_for(obj_path)
+        if self._mesh_cache is not None:
+            self._scene_objs_loader = CachedSceneLoader(self._mesh_cache, bind_entity)
+            self._scene_objs_loader.setParent(bind_entity)
+        else:
+            self._scene_objs_loader = Qt3DRender.QSceneLoader(bind_entity)
+            bind_entity.addComponent(self._scene_objs_loader)
+            # the next activation of the project loads the preprocessed model
+            threading.Thread(target=self._write_mesh_cache, args=(obj_path,), daemon=True).start()
         self._scene_objs_loader.statusChanged.connect(self._handle_scene_load_status_changed)
-        self._scene_objs_loader.setSource(src)
+        if isinstance(self._scene_objs_loader, Qt3DRender.QSceneLoader):
+            self._scene_objs_loader.setSource(src)
+
+    @staticmethod
+    def _write_mesh_cache(obj_path:Path):
+        try:
+            write_mesh_cache(obj_path)
+        except Exception as e:
+            logging.warning(f'Failed to write mesh cache for {obj_path}: {e}')
 
     @Slot(Qt3DRender.QSceneLoader.Status)
     def _handle_scene_load_status_changed(self, status):
@@ -706,5 +786,7 @@ class AttentionScene3DService(QObject):
     
     @Slot()
     def _emit_load_ready(self):
+        if self._ray_casting_backend == RayCastingBackend.CPU:
+            self._build_cpu_caster()
         self.scene_objs_ready.emit()
 
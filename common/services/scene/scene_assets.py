@@ -0,0 +1,154 @@
+from functools import partial
+import logging
+from pathlib import Path
+from PySide6.QtCore import QObject, Signal, Slot, QUrl
+from PySide6.Qt3DCore import Qt3DCore
+from PySide6.Qt3DRender import Qt3DRender
+from PySide6.Qt3DExtras import Qt3DExtras
+from PySide6.QtGui import QColor, QMatrix4x4
+
+from common.services.scene.landmark_markers import LandmarkMarkersResources
+
+
+src3d = Path(__file__).parent/"src3d"
+
+# meshes with a single material, rendered with a phong material of the caller's color
+MESH_ASSETS = ('canonical head processed.obj', 'attention_point.obj', 'pointer.obj')
+# scenes with their own .mtl materials, instantiated from a prototype loaded once
+SCENE_ASSETS = ('webcam.obj', 'canonical head eyes.obj')
+
+
+class _ScenePrototype(QObject):
+    """
+    Сцена из OBJ-файла, загруженная один раз через QSceneLoader.
+
+    После загрузки запоминаются её QGeometryRenderer, материалы и трансформации,
+    а экземпляры собираются из тех же компонентов без повторного разбора файла.
+    """
+    ready = Signal()
+
+    def __init__(self, file_path:Path, parent_node:Qt3DCore.QNode) -> None:
+        super().__init__()
+        self._file_path = file_path
+        self._root = Qt3DCore.QEntity(parent_node)
+        self._root.setObjectName(f'Prototype {file_path.name}')
+        # zero scale keeps the loaded scene invisible until it is disabled
+        hidden_transform = Qt3DCore.QTransform(self._root)
+        hidden_transform.setScale(0)
+        self._root.addComponent(hidden_transform)
+        self._parts:list[tuple[QMatrix4x4, list[Qt3DCore.QComponent]]]|None = None
+        self._pending:list[Qt3DCore.QEntity] = []
+
+        self._loader = Qt3DRender.QSceneLoader(self._root)
+        self._loader.statusChanged.connect(self._handle_status_changed)
+        self._root.addComponent(self._loader)
+        self._loader.setSource(QUrl.fromLocalFile(file_path))
+
+    def is_ready(self) -> bool:
+        return self._parts is not None
+
+    def instantiate(self, parent:Qt3DCore.QEntity) -> Qt3DCore.QEntity:
+        """Сущность с компонентами прототипа, заполняется после его загрузки"""
+        entity = Qt3DCore.QEntity(parent)
+        if self._parts is not None:
+            self._fill(entity)
+        else:
+            self._pending.append(entity)
+            entity.destroyed.connect(partial(self._forget_pending, entity))
+        return entity
+
+    def _forget_pending(self, entity:Qt3DCore.QEntity):
+        if entity in self._pending:
+            self._pending.remove(entity)
+
+    def _fill(self, entity:Qt3DCore.QEntity):
+        for matrix, components in self._parts or []:
+            part = Qt3DCore.QEntity(entity)
+            transform = Qt3DCore.QTransform(part)
+            transform.setMatrix(matrix)
+            part.addComponent(transform)
+            for component in components:
+                part.addComponent(component)
+
+    @Slot(Qt3DRender.QSceneLoader.Status)
+    def _handle_status_changed(self, status:Qt3DRender.QSceneLoader.Status):
+        if status == Qt3DRender.QSceneLoader.Status.Error:
+            logging.warning(f'Failed to load scene asset {self._file_path}')
+            return
+        if status != Qt3DRender.QSceneLoader.Status.Ready or self._parts is not None:
+            return
+
+        parts = []
+        for ent in self._root.findChildren(Qt3DCore.QEntity):
+            components = [c for c in ent.components()
+                          if isinstance(c, (Qt3DRender.QGeometryRenderer, Qt3DRender.QMaterial))]
+            if not any(isinstance(c, Qt3DRender.QGeometryRenderer) for c in components):
+                continue
+            parts.append((self._matrix_to_root(ent), components))
+        self._parts = parts
+        # the prototype itself is not drawn, its components stay alive for the instances
+        self._root.setEnabled(False)
+
+        pending, self._pending = self._pending, []
+        for entity in pending:
+            self._fill(entity)
+        self.ready.emit()
+
+    def _matrix_to_root(self, ent:Qt3DCore.QEntity) -> QMatrix4x4:
+        matrix = QMatrix4x4()
+        node = ent
+        while node is not None and node is not self._root:
+            if isinstance(node, Qt3DCore.QEntity):
+                transform = next((c for c in node.components() if isinstance(c, Qt3DCore.QTransform)), None)
+                if transform is not None:
+                    matrix = transform.matrix() * matrix
+            node = node.parentNode()
+        return matrix
+
+
+class SceneAssetsCache(Qt3DCore.QNode):
+    """
+    Общие для всех операторов меши и материалы сцены.
+
+    Каждый OBJ-файл разбирается один раз, QMesh и материалы разделяются сущностями всех операторов,
+    поэтому создание рабочего места оператора не читает файлы и не порождает новых ресурсов GPU.
+    """
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent)
+        self._meshes:dict[str, Qt3DRender.QMesh] = dict()
+        self._phong_materials:dict[int, Qt3DExtras.QPhongMaterial] = dict()
+        self._prototypes:dict[str, _ScenePrototype] = dict()
+        self._landmark_markers = LandmarkMarkersResources(parent=self)
+
+    def prewarm(self):
+        for name in MESH_ASSETS:
+            self.mesh(name)
+        for name in SCENE_ASSETS:
+            self._prototype(name)
+
+    def mesh(self, name:str) -> Qt3DRender.QMesh:
+        mesh = self._meshes.get(name)
+        if mesh is None:
+            mesh = self._meshes[name] = Qt3DRender.QMesh(self)
+            mesh.setSource(QUrl.fromLocalFile(src3d / name))
+        return mesh
+
+    def phong_material(self, ambient:QColor) -> Qt3DExtras.QPhongMaterial:
+        key = ambient.rgba()
+        material = self._phong_materials.get(key)
+        if material is None:
+            material = self._phong_materials[key] = Qt3DExtras.QPhongMaterial(self)
+            material.setAmbient(ambient)
+        return material
+
+    def landmark_markers(self) -> LandmarkMarkersResources:
+        return self._landmark_markers
+
+    def instantiate_scene(self, name:str, parent:Qt3DCore.QEntity) -> Qt3DCore.QEntity:
+        return self._prototype(name).instantiate(parent)
+
+    def _prototype(self, name:str) -> _ScenePrototype:
+        prototype = self._prototypes.get(name)
+        if prototype is None:
+            prototype = self._prototypes[name] = _ScenePrototype(src3d / name, self)
+        return prototype
@@ -0,0 +1,198 @@
+from datetime import datetime
+from functools import partial
+import logging
+from pathlib import Path
+import shutil
+import time
+from PySide6.QtCore import QObject, Signal, Slot
+from PySide6.QtGui import QQuaternion, QVector3D
+
+from common.domain.interfaces import AttentionRule, AttentionScene, Person, SceneObj
+from common.domain.session_log import (DEFAULT_SEGMENT_SIZE, SessionLogWriter, SessionRecordKind, encode_aggregated_hits,
+                                       encode_cast_result, encode_face_scan, encode_head_data, encode_rule_state)
+from common.dtos.head_data import HeadData
+from common.dtos.hits import AggregatedHit, ColumnarRayCastResult
+from common.services.face_scanning.face_scanner import FaceScanResult, FaceScannerService
+from common.services.scene.initializer import AttentionSceneInitializerService
+
+
+# codes of the head data view origins in the session log
+_VIEW_ORIGIN_CODES = {view_origin: code for code, view_origin in enumerate(HeadData.ViewOrigin)}
+
+
+def _pose(position:QVector3D, rotation:QQuaternion) -> tuple[float, ...]:
+    return (position.x(), position.y(), position.z(), rotation.scalar(), rotation.x(), rotation.y(), rotation.z())
+
+
+def _empty_payload(value) -> bytes:
+    return b''
+
+
+def _cast_result_payload(value:tuple[int, ColumnarRayCastResult]) -> bytes:
+    person_id, cast_result = value
+    return encode_cast_result(person_id, list(cast_result.obj_ids), cast_result.obj_index, cast_result.world, cast_result.local)
+
+
+def _aggregated_hits_payload(value:tuple[str, list[AggregatedHit]]) -> bytes:
+    scene_obj_id, hits = value
+    return encode_aggregated_hits(scene_obj_id, [hit.timestamp.timestamp() for hit in hits], [hit.person_id for hit in hits])
+
+
+def _rule_state_payload(value:tuple[int, bool, datetime]) -> bytes:
+    rule_id, errored, last_refresh_timestamp = value
+    return encode_rule_state(rule_id, errored, last_refresh_timestamp.timestamp())
+
+
+class SessionRecorder(QObject):
+    """
+    Запись конвейера отслеживания в журнал сессии для разбора проблем, возникших у пользователя.
+
+    Пишутся результаты сканирования лица, данные головы и результаты бросания лучей операторов,
+    добавленные агрегированные попадания, переходы состояния ошибки правил и обновления сцены.
+    Обработчики сигналов только ставят объекты в очередь SessionLogWriter, кодирование и запись выполняются
+    в его потоке. Каждая сессия пишется в свою папку, хранятся последние keep_sessions сессий.
+    Журнал читается SessionLogReader.
+    """
+    recording_changed = Signal(bool)
+
+    def __init__(self,
+                 face_scanner:FaceScannerService,
+                 scene_initializer:AttentionSceneInitializerService,
+                 sessions_dir:Path,
+                 record_keypoints:bool=False,
+                 segment_size:int=DEFAULT_SEGMENT_SIZE,
+                 keep_sessions:int=10) -> None:
+        super().__init__()
+        self._face_scanner = face_scanner
+        self._scene_initializer = scene_initializer
+        self._sessions_dir = sessions_dir
+        self._record_keypoints = record_keypoints
+        self._segment_size = segment_size
+        self._keep_sessions = keep_sessions
+        self._writer:SessionLogWriter|None = None
+        self._scene:AttentionScene|None = None
+        self._connected:list[tuple[object, object]] = []
+
+    def is_recording(self) -> bool:
+        return self._writer is not None
+
+    def session_dir(self) -> Path|None:
+        return self._writer.session_dir() if self._writer is not None else None
+
+    def start(self) -> Path:
+        if self._writer is not None:
+            return self._writer.session_dir()
+        self._remove_old_sessions()
+        session_dir = self._sessions_dir / datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        self._writer = SessionLogWriter(session_dir, self._segment_size)
+        self._face_scanner.face_scanned.connect(self._record_face_scan)
+        self._scene_initializer.attention_project_changed.connect(self._observe_project_changed)
+        self._observe_project_changed()
+        logging.info(f'Recording session to {session_dir}')
+        self.recording_changed.emit(True)
+        return session_dir
+
+    def stop(self):
+        if self._writer is None:
+            return
+        self._face_scanner.face_scanned.disconnect(self._record_face_scan)
+        self._scene_initializer.attention_project_changed.disconnect(self._observe_project_changed)
+        self._set_scene(None)
+        writer, self._writer = self._writer, None
+        writer.close()
+        if writer.dropped():
+            logging.warning(f'Session log {writer.session_dir()} dropped {writer.dropped()} records')
+        self.recording_changed.emit(False)
+
+    def _remove_old_sessions(self):
+        if not self._sessions_dir.is_dir():
+            return
+        sessions = sorted(d for d in self._sessions_dir.iterdir() if d.is_dir())
+        for session_dir in sessions[:max(len(sessions) - self._keep_sessions + 1, 0)]:
+            shutil.rmtree(session_dir, ignore_errors=True)
+
+    def _append(self, kind:SessionRecordKind, timestamp:float, value, encode):
+        if (writer:=self._writer) is not None:
+            writer.append(kind, timestamp, value, encode)
+
+    @Slot(FaceScanResult)
+    def _record_face_scan(self, scan:FaceScanResult):
+        self._append(SessionRecordKind.FACE_SCAN, scan.timestamp.timestamp(), scan, self._face_scan_payload)
+
+    def _face_scan_payload(self, scan:FaceScanResult) -> bytes:
+        if not scan.head_visible or (head_props:=scan.head_props) is None:
+            return encode_face_scan(None)
+        return encode_face_scan(_pose(head_props.position, head_props.rotation),
+                                head_props.keypoints if self._record_keypoints else None)
+
+    def _head_data_payload(self, value:tuple[int, HeadData]) -> bytes:
+        person_id, data = value
+        view_origin = _VIEW_ORIGIN_CODES[data.view_origin]
+        if (head_props:=data.head_props) is None or (eyes:=data.eyes_transforms) is None:
+            return encode_head_data(person_id, view_origin, None)
+        poses = _pose(head_props.position, head_props.rotation) \
+            + _pose(eyes.left_eye_transform.position, eyes.left_eye_transform.rotation) \
+            + _pose(eyes.right_eye_transform.position, eyes.right_eye_transform.rotation)
+        return encode_head_data(person_id, view_origin, poses, head_props.keypoints if self._record_keypoints else None)
+
+    @Slot()
+    def _observe_project_changed(self):
+        project = self._scene_initializer.project()
+        self._set_scene(project.scene() if project is not None else None)
+
+    def _set_scene(self, scene:AttentionScene|None):
+        if scene is self._scene:
+            return
+        self._disconnect_all()
+        self._scene = scene
+        if scene is None:
+            return
+        self._connect(scene.updated, lambda: self._append(SessionRecordKind.SCENE_UPDATE, time.time(), None, _empty_payload))
+        self._connect(scene.person_created, self._attach_person)
+        self._connect(scene.attention_rule_created, self._attach_rule)
+        for person in scene.persons():
+            self._attach_person(person)
+        for scene_obj in scene.scene_objs():
+            self._attach_scene_obj(scene_obj)
+        for rule in scene.attention_rules():
+            self._attach_rule(rule)
+
+    def _connect(self, signal, slot):
+        signal.connect(slot)
+        self._connected.append((signal, slot))
+
+    def _disconnect_all(self):
+        for signal, slot in self._connected:
+            try:
+                signal.disconnect(slot)
+            except (RuntimeError, TypeError):
+                # the element is already deleted
+                pass
+        self._connected.clear()
+
+    @Slot(Person)
+    def _attach_person(self, person:Person):
+        person_id = int(person.element_id())
+        self._connect(person.head_data_changed, partial(self._record_head_data, person_id))
+        self._connect(person.performed_ray_cast_result_changed, partial(self._record_cast_result, person))
+
+    def _record_head_data(self, person_id:int, data:HeadData):
+        self._append(SessionRecordKind.HEAD_DATA, data.timestamp.timestamp(), (person_id, data), self._head_data_payload)
+
+    def _record_cast_result(self, person:Person):
+        if (cast_result:=person.performed_ray_cast_result()) is not None:
+            self._append(SessionRecordKind.CAST_RESULT, cast_result.timestamp.timestamp(),
+                         (int(person.element_id()), cast_result), _cast_result_payload)
+
+    def _attach_scene_obj(self, scene_obj:SceneObj):
+        scene_obj_id = str(scene_obj.element_id())
+        self._connect(scene_obj.aggregated_attention_hits_added,
+                      lambda hits: self._append(SessionRecordKind.AGGREGATED_HITS, time.time(),
+                                                (scene_obj_id, list(hits)), _aggregated_hits_payload))
+
+    @Slot(AttentionRule)
+    def _attach_rule(self, rule:AttentionRule):
+        rule_id = int(rule.element_id())
+        self._connect(rule.is_errored_changed,
+                      lambda errored: self._append(SessionRecordKind.RULE_STATE, time.time(),
+                                                   (rule_id, errored, rule.last_refresh_timestamp()), _rule_state_payload))
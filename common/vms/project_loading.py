@@ -19,6 +19,7 @@ class ProjectImportVM(QWidget):
     scene_import_ready = Signal()
     scene_import_failed = Signal(str)
     scene_import_cancelled = Signal()
+    scene_import_progress = Signal(float)
 
     request_aggrement_to_override_project = Signal(str)
 
@@ -75,7 +76,7 @@ class ProjectImportVM(QWidget):
 
     def accept_project_override(self):
         if self._import_process is not None:
-            self._import_process.run(True)
+            self._import_process.run_in_background(True)
 
     def reject_project_override(self):
         if self._import_process is not None:
@@ -107,12 +108,13 @@ class ProjectImportVM(QWidget):
         if self._import_process.project_already_exists():
             self.request_aggrement_to_override_project.emit()
             return
-        self._import_process.run()
+        self._import_process.run_in_background()
 
     def _bind_import_process_signals(self, import_process:ProjectImportProcess):
         import_process.failed.connect(self._handle_import_failed)
         import_process.complete.connect(self._handle_import_ready)
         import_process.cancelled.connect(self._handle_import_cancelled)
+        import_process.progress.connect(self.scene_import_progress)
 
     def _clear_import_process(self,):
         self._import_process = None
\ No newline at end of file
@@ -1,7 +1,7 @@
 from datetime import date, datetime, timedelta
 from PySide6.QtCore import Qt, Slot, QTimer
-from PySide6.QtGui import QColor
-from PySide6.QtWidgets import QSizePolicy, QWidget, QLabel, QPushButton, QHBoxLayout, QDoubleSpinBox, QGridLayout, QVBoxLayout, QLineEdit, QTabWidget, QProgressBar
+from PySide6.QtGui import QColor, QPainter
+from PySide6.QtWidgets import QSizePolicy, QWidget, QLabel, QPushButton, QHBoxLayout, QDoubleSpinBox, QGridLayout, QVBoxLayout, QLineEdit, QTabWidget, QProgressBar, QStyle, QStyleOptionProgressBar
 
 from common.collections.persons_in_rule import PersonItem, PersonsInRuleCollection
 from common.collections.scene_obj_in_rule import SceneObjItem, SceneObjsInRuleCollection
@@ -30,7 +30,32 @@ pb_error_stylesheet = """
     }
 """
 
+
+class RuleProgressBar(QProgressBar):
+    """
+    Полоса времени без наблюдения правила.
+
+    Значение не хранится, а вычисляется из срока правила при каждой отрисовке.
+    """
+    def __init__(self, rule:AttentionRule) -> None:
+        super().__init__()
+        self._rule = rule
+        self.setMinimum(0)
+        self.setMaximum(100)
+        self.setTextVisible(False)
+
+    def paintEvent(self, event):
+        progress_to_error = 1 - self._rule.until_error_progress(self._rule.scene().timer().now())
+        option = QStyleOptionProgressBar()
+        self.initStyleOption(option)
+        option.progress = min(max(int(progress_to_error*100), self.minimum()), self.maximum())
+        painter = QPainter(self)
+        self.style().drawControl(QStyle.ControlElement.CE_ProgressBar, option, painter, self)
+
+
 class AttentionRuleInfoWidget(QWidget):
+    REPAINT_INTERVAL_MSEC = 100
+
     def __init__(self, 
                  attention_rule:AttentionRule,) -> None:
         super().__init__()
@@ -46,10 +71,16 @@ class AttentionRuleInfoWidget(QWidget):
         self._rule.is_selected_changed.connect(self._observe_selected_changed)
         # self._rule.last_refresh_timestamp_changed.connect(self._observe_last_refresh_timestamp_changed)
         self._rule.without_attention_timedelta_changed.connect(self._observe_without_attention_timedelta_changed)
-        self._rule.scene().updated.connect(self._observe_scene_updated)
+        self._rule.is_errored_changed.connect(self._observe_errored_changed)
+        self._rule.last_refresh_timestamp_changed.connect(self._observe_last_refresh_timestamp_changed)
+        # progress moves with time only, so it is repainted while the widget is visible
+        self._repaint_timer = QTimer(self)
+        self._repaint_timer.setInterval(self.REPAINT_INTERVAL_MSEC)
+        self._repaint_timer.timeout.connect(self._update_progress)
         self._set_visible_name(self._rule.element_name())
         self._id.setText(str(self._rule.element_id()))
         self._set_selected(self._rule.is_selected())
+        self._set_errored(self._rule.is_errored())
         self._update_progress()
         
     def setup_ui(self):
@@ -82,10 +113,7 @@ class AttentionRuleInfoWidget(QWidget):
         vbox.addWidget(QLabel('Время без наблюдения'))
 
         self._time_without_attention_progress_lbl = QLabel('?/? сек.')
-        self._progress_to_error_progress_bar = QProgressBar()
-        self._progress_to_error_progress_bar.setMinimum(0)
-        self._progress_to_error_progress_bar.setMaximum(100)
-        self._progress_to_error_progress_bar.setTextVisible(False)
+        self._progress_to_error_progress_bar = RuleProgressBar(self._rule)
         hbox = QHBoxLayout()
         hbox.addWidget(self._progress_to_error_progress_bar, 1)
         hbox.addWidget(self._time_without_attention_progress_lbl, 0)
@@ -105,35 +133,33 @@ class AttentionRuleInfoWidget(QWidget):
         vbox.addWidget(persons_scene_objs_tabs)
         self.setLayout(vbox)
 
-    # @Slot(datetime)
-    # def _observe_last_refresh_timestamp_changed(self, last_refresh_timestamp:datetime):
-    #     self._update_progress()
+    def showEvent(self, event):
+        super().showEvent(event)
+        self._update_progress()
+        self._repaint_timer.start()
 
-    @Slot()
-    def _observe_scene_updated(self):
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self._repaint_timer.stop()
+
+    @Slot(datetime)
+    def _observe_last_refresh_timestamp_changed(self, last_refresh_timestamp:datetime):
         self._update_progress()
-    
+
+    @Slot(bool)
+    def _observe_errored_changed(self, errored:bool):
+        self._set_errored(errored)
+
+    def _set_errored(self, errored:bool):
+        self._progress_to_error_progress_bar.setStyleSheet(pb_error_stylesheet if errored else '')
+
+    @Slot()
     def _update_progress(self):
-        # last_refresh_timestamp = self._rule.last_refresh_timestamp()
-        timestamp = self._rule.scene().timer().now()
         without_attention_max_sec = self._rule.without_attention_timedelta().total_seconds()
-        # print(f'{timestamp=}')
-        # print(f'{self._rule.until_error_progress(last_refresh_timestamp)=}')
-        progress_to_error = 1 - self._rule.until_error_progress(timestamp)
-        time_until_error = self._rule.time_util_error(timestamp)
-        # print(f'{timestamp=}, {time_until_error=}')
-        if time_until_error is not None:
-            seconds_passed_from_refresh = without_attention_max_sec - time_until_error.total_seconds()
-        else:
-            seconds_passed_from_refresh = float(0)
-
-        if progress_to_error > 1:
-            self._progress_to_error_progress_bar.setStyleSheet(pb_error_stylesheet)
-        else:
-            self._progress_to_error_progress_bar.setStyleSheet('')
-        
-        self._progress_to_error_progress_bar.setValue(int(progress_to_error*100))
+        now = self._rule.scene().timer().now()
+        seconds_passed_from_refresh = (now - self._rule.last_refresh_timestamp()).total_seconds()
         self._time_without_attention_progress_lbl.setText(f'{seconds_passed_from_refresh:.1f} / {without_attention_max_sec:.1f} сек.')
+        self._progress_to_error_progress_bar.update()
 
     @Slot(timedelta)
     def _observe_without_attention_timedelta_changed(self, time_without_attention:timedelta):
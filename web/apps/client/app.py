@@ -6,6 +6,8 @@ import threading
 from uuid import uuid4
 from PySide6.QtCore import QObject, Slot, Signal
 import asyncio
+import requests
+from typing import Callable
 from socketio import AsyncClient #type:ignore
 
 from common.domain.interfaces import AttentionScene, Person
@@ -13,10 +15,18 @@ from common.dtos.head_data import PersonHeadDataAdapter
 from common.dtos.hits import PersonPerformedRayCastResultAdapter, SceneObjAggregatedHitsAdapter
 from common.dtos.states import AttentionSceneStateAdapter
 from common.services.active_person import ActivePersonSelector
-from common.services.scene.importers import ProjectFromLocalArchiveImporter
+from common.services.scene.importers import ProjectFromFilesImporter, ProjectFromLocalArchiveImporter
 from common.services.scene.initializer import AttentionSceneInitializerService
 from common.services.scene.repo import AttentionProjectsRepo, ProjectImportProcess
+from web.dtos.project_manifest import ProjectManifestAdapter
+from web.dtos.state_changes import StateChangesAdapter, StateChangesRequest, StateChangesRequestAdapter
+from web.project_manifest import BlobCache
+from web.jitter_buffer import RemoteHeadDataPlayback
+from web.publisher import PersonDataPublisher, PublisherStats
+from web.state_log import apply_state_changes
 from web.utils import ConnectionEventsNames, PersonIdDataAdapter, download_file
+from web.wire import (WireFormat, WireProtocolChoiceAdapter, WireProtocolOffer, WireProtocolOfferAdapter,
+                      decode_person_cast_result, decode_person_head_data, known_keypoints, peek_person_id)
 
 
 class ClientApp(QObject):
@@ -42,7 +52,17 @@ class ClientApp(QObject):
                  person_selector:ActivePersonSelector,
                  projects_repo:AttentionProjectsRepo,
                  scene_initializer:AttentionSceneInitializerService,
+                 wire_formats:list[WireFormat]|None=None,
+                 receive_keypoints:bool=True,
+                 publish_max_rate_hz:float=20,
+                 playout_delay_sec:float=0.1,
                  ) -> None:
+        """
+        wire_formats - поддерживаемые форматы кадров в порядке предпочтения, JSON используется, если сервер не поддерживает другие.
+        receive_keypoints=False просит сервер не присылать ключевые точки лица других операторов.
+        publish_max_rate_hz - наибольшая частота отправки данных головы оператора клиента.
+        playout_delay_sec - задержка воспроизведения данных головы других операторов для сглаживания неравномерной доставки.
+        """
         super().__init__()
         self._projects_archives_dir = projects_archives_dir
         self._client = client
@@ -50,6 +70,7 @@ class ClientApp(QObject):
         self._projects_repo = projects_repo
         self._scene_initializer = scene_initializer
         self._import_processes: list[ProjectImportProcess] = []
+        self._blob_cache = BlobCache(projects_archives_dir / 'blobs')
         
         self._old_active_person:Person|None = None
         self._person_selector.active_person_changed.connect(self._handle_selector_person_changed)
@@ -63,7 +84,25 @@ class ClientApp(QObject):
         self._client.on(ConnectionEventsNames.recieved_others_cast_result.value, self._handle_recieved_others_cast_result)
         self._client.on(ConnectionEventsNames.recieved_others_aggregated_hits.value, self._handle_recieved_others_aggregated_hits)
         self._client.on(ConnectionEventsNames.recieved_state.value, self._handle_recieved_state)
+        self._client.on(ConnectionEventsNames.recieved_state_changes.value, self._handle_recieved_state_changes)
+        self._client.on(ConnectionEventsNames.recieved_protocol.value, self._handle_recieved_protocol)
+        self._client.on(ConnectionEventsNames.recieved_batch.value, self._handle_recieved_batch)
+        self._batched_handlers = {
+            ConnectionEventsNames.recieved_others_head_data.value: self._handle_recieved_others_head_data,
+            ConnectionEventsNames.recieved_others_cast_result.value: self._handle_recieved_others_cast_result,
+        }
         self._enabled = True
+        self._wire_formats = wire_formats if wire_formats is not None else [WireFormat.BINARY, WireFormat.JSON]
+        self._receive_keypoints = receive_keypoints
+        self._wire_format = WireFormat.JSON
+        self._publisher = PersonDataPublisher(self._publish, self.wire_format, max_rate_hz=publish_max_rate_hz)
+        self.connected.connect(self._publisher.start)
+        self.disconnected.connect(self._publisher.stop)
+        self._head_data_playback = RemoteHeadDataPlayback(playout_delay_sec)
+        self.disconnected.connect(self._head_data_playback.clear)
+        # position in the server state log of the last applied changes
+        self._state_log_id:str|None = None
+        self._state_seq:int|None = None
 
     def _handle_enabled_changed(self, enabled:bool):
         if not enabled and self.is_connected():
@@ -85,6 +124,19 @@ class ClientApp(QObject):
     def is_connected(self) -> bool:
         return self._client.connected
 
+    def wire_format(self) -> WireFormat:
+        """Формат, в котором клиент отправляет кадры, согласованный с сервером"""
+        return self._wire_format
+
+    def publisher_stats(self) -> PublisherStats:
+        """Частота отправки, время подтверждения сервером и число отправленных и пропущенных сообщений"""
+        return self._publisher.stats()
+
+    def _publish(self, event:str, payload:bytes, on_ack:Callable[..., None]):
+        if self._event_loop is None or not self.is_connected():
+            return
+        asyncio.run_coroutine_threadsafe(self._client.emit(event, payload, callback=on_ack), self._event_loop)
+
     def _get_client_event_loop(self) -> asyncio.AbstractEventLoop:
         if self._event_loop is None:
             raise RuntimeError('ClientApp event loop is not initialized')
@@ -124,15 +176,25 @@ class ClientApp(QObject):
             self.disconnected.emit()
 
     async def _handle_connected(self):
-        # self.connected.emit()
-        pass
+        self._wire_format = WireFormat.JSON
+        offer = WireProtocolOffer(self._wire_formats, keypoints=self._receive_keypoints)
+        await self._client.emit(ConnectionEventsNames.negotiate_protocol.value, WireProtocolOfferAdapter.dump_json(offer))
+        if self._active_scene() is not None:
+            # catch up with changes made while disconnected
+            await self._client.emit(ConnectionEventsNames.request_state_changes.value, self._state_changes_request())
 
     async def _handle_disconnected(self):
         self._client_thread = None
+        self._wire_format = WireFormat.JSON
         # self.di
 
+    def _state_changes_request(self) -> bytes:
+        return StateChangesRequestAdapter.dump_json(StateChangesRequest(self._state_log_id, self._state_seq))
+
     def _request_update_state(self):
-        asyncio.run_coroutine_threadsafe(self._client.emit(ConnectionEventsNames.request_state.value), self._get_client_event_loop())
+        asyncio.run_coroutine_threadsafe(self._client.emit(ConnectionEventsNames.request_state_changes.value,
+                                                           self._state_changes_request()),
+                                         self._get_client_event_loop())
 
     def _active_scene(self) -> AttentionScene|None:
         return pr.scene() if (pr:=self._scene_initializer.project()) is not None else None
@@ -145,6 +207,8 @@ class ClientApp(QObject):
 
     # networking handlers
     async def _handle_project_changed(self, project_info_json:str):
+        self._state_log_id = None
+        self._state_seq = None
         if not project_info_json:
             self._scene_initializer.set_project_data(None)
         else:
@@ -162,19 +226,23 @@ class ClientApp(QObject):
             self._person_selector.set_active_person(None)
         
     async def _handle_recieved_others_head_data(self, data:bytes):
-        person_head_data = PersonHeadDataAdapter.validate_json(data)
         active_person = self._person_selector.active_person()
 
-        person_id = person_head_data.person_id
+        person_id = peek_person_id(data)
         
-        if active_person and active_person.element_id() == person_id:
+        if person_id is None or active_person and active_person.element_id() == person_id:
             return
         
         scene = self._get_active_scene_strict()
-        scene.persons_by_id()[person_id].set_head_data(person_head_data.head_data)
+        person = scene.persons_by_id()[person_id]
+        # frames between keyframes carry no keypoints
+        latest = self._head_data_playback.latest(person_id) or person.head_data()
+        person_head_data = decode_person_head_data(data, known_keypoints(latest))
+        # applied to the person at the render tick
+        self._head_data_playback.push(person, person_head_data.head_data)
         
     async def _handle_recieved_others_cast_result(self, data:bytes):
-        cast_resuls = PersonPerformedRayCastResultAdapter.validate_json(data)
+        cast_resuls = decode_person_cast_result(data)
         person_id = cast_resuls.person_id
 
         scene = self._get_active_scene_strict()
@@ -188,11 +256,29 @@ class ClientApp(QObject):
         scene = self._get_active_scene_strict()
         scene.scene_objs_by_id()[scene_obj_id].set_aggregated_hits(scene_obj_aggregated_hits.hits)
 
+    async def _handle_recieved_batch(self, messages:list):
+        for event, payload in messages:
+            if (handler:=self._batched_handlers.get(event)) is not None:
+                await handler(payload)
+
+    async def _handle_recieved_protocol(self, data:bytes):
+        self._wire_format = WireProtocolChoiceAdapter.validate_json(data).format
+
     async def _handle_recieved_state(self, data:bytes):
-        scene_state = AttentionSceneStateAdapter.validate_json(data)
+        if not data:
+            return
         scene = self._get_active_scene_strict()
+        # validators of the state check it against the scene from the context
+        scene_state = AttentionSceneStateAdapter.validate_json(data, context={'scene': scene})
         scene.update_with_state(scene_state)
 
+    async def _handle_recieved_state_changes(self, data:bytes):
+        changes = StateChangesAdapter.validate_json(data)
+        scene = self._get_active_scene_strict()
+        apply_state_changes(scene, changes)
+        self._state_log_id = changes.log_id
+        self._state_seq = changes.seq
+
     # helper functions
         
     @Slot()
@@ -203,6 +289,7 @@ class ClientApp(QObject):
                 self._old_active_person.disconnect(self)
             
             self._old_active_person = new_person
+            self._publisher.set_person(new_person)
 
 
     def _start_project_download(self,):
@@ -212,17 +299,37 @@ class ClientApp(QObject):
     def _threaded_active_project_download(self):
         try:
             self.active_project_fetch_started.emit()
-            save_file = self._projects_archives_dir / f'{datetime.now().isoformat}.zip'
-            download_file(f'http://{self._server_ip}:{self._server_port}/{ConnectionEventsNames.active_project_download}', 
-                        save_file)
+            importer = self._fetch_active_project_files()
+            if importer is None:
+                save_file = self._projects_archives_dir / f'{datetime.now().isoformat}.zip'
+                download_file(self._server_url(ConnectionEventsNames.active_project_download), save_file)
+                importer = ProjectFromLocalArchiveImporter(save_file)
             self.active_project_fetch_complete.emit()
-            project_import_process = self._projects_repo.create_import_project_process(ProjectFromLocalArchiveImporter(save_file))
+            project_import_process = self._projects_repo.create_import_project_process(importer)
             self._import_processes.append(project_import_process)
             self._bind_import_process_signals(project_import_process)
             
         except Exception as e:
             self.active_project_fetch_failed.emit(str(e))
 
+    def _server_url(self, event:ConnectionEventsNames) -> str:
+        return f'http://{self._server_ip}:{self._server_port}{event.value}'
+
+    def _fetch_active_project_files(self) -> ProjectFromFilesImporter|None:
+        """
+        Скачивает в хранилище только отсутствующие в нём файлы проекта.
+        None, если сервер не отдаёт список файлов проекта, тогда проект скачивается архивом.
+        """
+        r = requests.get(self._server_url(ConnectionEventsNames.active_project_manifest))
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        manifest = ProjectManifestAdapter.validate_json(r.content)
+        files_url = self._server_url(ConnectionEventsNames.active_project_files)
+        for file in self._blob_cache.missing(manifest):
+            self._blob_cache.download(f'{files_url}/{file.sha256}', file)
+        return ProjectFromFilesImporter(self._blob_cache.project_files(manifest))
+
     def _bind_import_process_signals(self, import_process:ProjectImportProcess):
         import_process.complete.connect(self._handle_import_complete)
         import_process.failed.connect(self._handle_import_failed)
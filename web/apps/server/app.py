@@ -13,10 +13,22 @@ from web.collections.connected_clients import ConnectedClientsCollection
 from web.collections.exposed_persons import ExposedPersonsCollection
 from web.domain.connected_client import ConnectedClient
 import asyncio
+import logging
+from functools import partial
+from typing import cast
 from threading import Thread
+import numpy as np
 
+from web.dtos.project_manifest import ProjectManifestAdapter
+from web.dtos.state_changes import StateChanges, StateChangesAdapter, StateChangesRequestAdapter
+from web.state_log import SceneStateLog
+from web.broadcast_scheduler import BroadcastScheduler, ClientBroadcastStats
+from web.relay_queue import CoalescingRelayQueue, RelayQueueStats
 from web.utils import ConnectionEventsNames, PersonIdData, PersonIdDataAdapter, find_free_port, get_ip
-
+from web.wire import (WireFormat, WireProtocolChoiceAdapter, WireProtocolOfferAdapter, carry_keypoints, choose_wire_protocol,
+                      decode_person_cast_result, decode_person_head_data, encode_person_cast_result,
+                      encode_person_head_data, is_binary_frame, head_data_frame_has_keypoints, peek_person_id,
+                      peek_scene_obj_id, strip_keypoints)
 
 
 class ServerApp(QObject):
@@ -24,15 +36,25 @@ class ServerApp(QObject):
 
     project_prepare_started = Signal()
     project_prepare_ready = Signal()
+    # share of the active project archived, from 0 to 1
+    project_prepare_progress = Signal(float)
     project_prepare_failed = Signal(str)
 
+    # validated relay data is applied to the models in the thread of ServerApp
+    _head_data_validated = Signal(object, object)
+    _cast_result_validated = Signal(object, object)
+    _aggregated_hits_validated = Signal(str, object)
+
     def __init__(self, 
                  active_project_exporter:ActiveProjectExporter,
                  app:aio_web.Application,
                  io_server:socketio.AsyncServer,
                  scene_initializer:AttentionSceneInitializerService,
                  exposed_persons_collection:ExposedPersonsCollection,
-                 connected_clients_collection:ConnectedClientsCollection
+                 connected_clients_collection:ConnectedClientsCollection,
+                 relay_queue_max_depth:int=256,
+                 max_send_rate_hz:float=30,
+                 state_log_max_entries:int=4096,
                  ) -> None:
         super().__init__()
         self._active_project_exporter = active_project_exporter
@@ -51,8 +73,11 @@ class ServerApp(QObject):
         self._active_project_exporter.active_project_archive_started.connect(self._active_project_export_started)
         self._active_project_exporter.active_project_archive_failed.connect(self._active_project_export_failed)
         self._active_project_exporter.active_project_archive_complete.connect(self._active_project_export_complete)
+        self._active_project_exporter.active_project_archive_progress.connect(self._active_project_export_progress)
 
-        self._app.add_routes([aio_web.get(ConnectionEventsNames.active_project_download.value, self._send_active_project_archive)]) # type:ignore
+        self._app.add_routes([aio_web.get(ConnectionEventsNames.active_project_download.value, self._send_active_project_archive), # type:ignore
+                              aio_web.get(ConnectionEventsNames.active_project_manifest.value, self._send_active_project_manifest), # type:ignore
+                              aio_web.get(ConnectionEventsNames.active_project_files.value + '/{sha256}', self._send_active_project_file)]) # type:ignore
 
         self._active_project_exporter.active_project_archive_changed.connect(self._active_project_archive_changed)
         self._io_server.on(ConnectionEventsNames.connect.value, self._handle_connect)
@@ -61,9 +86,28 @@ class ServerApp(QObject):
         self._io_server.on(ConnectionEventsNames.generated_scene_obj_aggregated_hits.value, self._handle_generated_aggregated_hits)
         self._io_server.on(ConnectionEventsNames.generated_cast_result.value, self._handle_generated_cast_result)
         self._io_server.on(ConnectionEventsNames.request_state.value, self._handle_request_state) #type:ignore
+        self._io_server.on(ConnectionEventsNames.request_state_changes.value, self._handle_request_state_changes)
+        self._io_server.on(ConnectionEventsNames.negotiate_protocol.value, self._handle_negotiate_protocol)
+
+        self._relay_queue = CoalescingRelayQueue(relay_queue_max_depth)
+        self._relay_worker:Thread|None = None
+        # keypoints of the last keyframe per person id, used by the relay worker only
+        self._relay_keypoints:dict[int, np.ndarray] = dict()
+        self._broadcast_scheduler = BroadcastScheduler(self._send_batch, max_send_rate_hz, merge_payloads=carry_keypoints)
+        self._head_data_validated.connect(self._apply_validated_head_data)
+        self._cast_result_validated.connect(self._apply_validated_cast_result)
+        self._aggregated_hits_validated.connect(self._apply_validated_aggregated_hits)
+
+        self._state_log = SceneStateLog(state_log_max_entries)
+        self._scene_initializer.attention_project_changed.connect(self._handle_attention_project_changed)
+        self._handle_attention_project_changed()
 
         self._app_running = False
 
+    def relay_queue_stats(self) -> RelayQueueStats:
+        """Глубина очереди проверки пересылаемых данных, число объединённых и отброшенных задач"""
+        return self._relay_queue.stats()
+
     def run(self):
         if self.running():
             return
@@ -91,10 +135,17 @@ class ServerApp(QObject):
         return self._app_running
     
     async def _observe_app_startup(self, app):
+        self._relay_keypoints.clear()
+        self._relay_queue.reopen()
+        self._relay_worker = Thread(target=self._process_relay_queue, daemon=True)
+        self._relay_worker.start()
         self._app_running = True
         self.running_changed.emit(self._app_running)
 
     async def _observe_app_shutdown(self, app):
+        self._broadcast_scheduler.clear()
+        self._relay_queue.close()
+        self._relay_worker = None
         self._app_running = False
         self.running_changed.emit(self._app_running)
     
@@ -109,6 +160,10 @@ class ServerApp(QObject):
     def _active_project_export_failed(self, project_info:ProjectInfo, reason:str):
         self.project_prepare_failed.emit(reason)
     
+    @Slot(ProjectInfo, float)
+    def _active_project_export_progress(self, project_info:ProjectInfo, progress:float):
+        self.project_prepare_progress.emit(progress)
+
     @Slot(ProjectInfo)
     def _active_project_export_complete(self, project_info:ProjectInfo):
         self.project_prepare_ready.emit()
@@ -128,6 +183,10 @@ class ServerApp(QObject):
     def _active_scene(self) -> AttentionScene|None:
         return pr.scene() if (pr:=self._scene_initializer.project()) is not None else None
 
+    @Slot()
+    def _handle_attention_project_changed(self):
+        self._state_log.set_scene(self._active_scene())
+
     @Slot()
     def _active_project_archive_changed(self):
         # asyncio.run_coroutine_threadsafe(self._io_server.emit(ConnectionEventsNames.recieved_project_changed), self._get_server_event_loop())
@@ -144,6 +203,21 @@ class ServerApp(QObject):
             return aio_web.FileResponse(archive_path)
         else:
             return aio_web.Response(status=404, text=f'No active project')
+
+    async def _send_active_project_manifest(self, request):
+        loop = asyncio.get_running_loop()
+        # hashing changed files must not block the event loop
+        manifest = await loop.run_in_executor(None, self._active_project_exporter.active_project_manifest)
+        if manifest is None:
+            return aio_web.Response(status=404, text=f'No active project')
+        return aio_web.Response(body=ProjectManifestAdapter.dump_json(manifest), content_type='application/json')
+
+    async def _send_active_project_file(self, request):
+        # FileResponse answers Range requests with partial content
+        file_path = self._active_project_exporter.active_project_file(request.match_info['sha256'])
+        if file_path is None or not file_path.is_file():
+            return aio_web.Response(status=404, text=f'No such file in the active project')
+        return aio_web.FileResponse(file_path)
     
     @Slot()
     def _connected_client_person_changed(self):
@@ -157,51 +231,169 @@ class ServerApp(QObject):
                                             PersonIdDataAdapter.dump_json(person_id_data), 
                                             to=client.sid()), self._get_server_event_loop())
 
-    async def _handle_connect(self):
-        sid:str = request.sid # type:ignore
+    async def _handle_connect(self, sid:str, environ, auth=None):
         connected_client = ConnectedClient(sid)
         connected_client.person_changed.connect(self._connected_client_person_changed)
         self._connected_clients.add_client(connected_client)
 
     # Handlers
-    async def _handle_disconnect(self):
-        sid:str = request.sid #type:ignore
+    async def _handle_disconnect(self, sid:str, *_):
+        self._broadcast_scheduler.remove_client(sid)
         cl = self._connected_clients.get_by_sid(sid)
         if cl:
             cl.notify_connection_closed()
 
-    async def _handle_generated_head_data(self, person_head_data_jsonb:bytes):
-        person_head_data = PersonHeadDataAdapter.validate_json(person_head_data_jsonb)
-
-        sid:str = request.sid # type:ignore
+    async def _handle_negotiate_protocol(self, sid:str, data:bytes):
+        choice = choose_wire_protocol(WireProtocolOfferAdapter.validate_json(data))
         cl = self._connected_clients.get_by_sid(sid)
-        if cl and (person:=cl.person()) is not None:
-            person.set_head_data(person_head_data.head_data)
-            await self._io_server.emit(ConnectionEventsNames.recieved_others_head_data, person_head_data_jsonb, skip_sid=sid)
-
-    async def _handle_generated_aggregated_hits(self, data:bytes):
-        scene_obj_aggregated_hits = SceneObjAggregatedHitsAdapter.validate_json(data)
+        if cl:
+            cl.set_wire_protocol(choice.format, choice.keypoints)
+        await self._io_server.emit(ConnectionEventsNames.recieved_protocol.value,
+                                   WireProtocolChoiceAdapter.dump_json(choice), to=sid)
+
+    def _peers_by_wire_protocol(self, skip_sid:str) -> dict[tuple[WireFormat, bool], list[str]]:
+        peers:dict[tuple[WireFormat, bool], list[str]] = dict()
+        for c in self._connected_clients.clients():
+            if c.sid() != skip_sid and c.is_connected():
+                protocol = (c.wire_format(), c.wants_keypoints() or c.wire_format() == WireFormat.JSON)
+                peers.setdefault(protocol, []).append(c.sid())
+        return peers
+
+    def _broadcast(self, sids:list[str], event:str, person_id:int, payload:bytes):
+        for sid in sids:
+            self._broadcast_scheduler.enqueue(sid, event, person_id, payload)
+
+    def _broadcast_threadsafe(self, sids:list[str], event:str, person_id:int, payload:bytes):
+        self._get_server_event_loop().call_soon_threadsafe(self._broadcast, sids, event, person_id, payload)
+
+    async def _send_batch(self, sid:str, batch:list[tuple[str, bytes]]):
+        if len(batch) == 1:
+            event, payload = batch[0]
+            await self._io_server.emit(event, payload, to=sid)
+        else:
+            await self._io_server.emit(ConnectionEventsNames.recieved_batch.value, [list(message) for message in batch], to=sid)
 
-        sid:str = request.sid # type:ignore
-        
-        scene = self._active_scene()
-        if scene:
-            scene_obj = scene.scene_objs_by_id()[scene_obj_aggregated_hits.scene_obj_id]
-            scene_obj.set_aggregated_hits(scene_obj_aggregated_hits.hits)
-            await self._io_server.emit(ConnectionEventsNames.recieved_others_aggregated_hits.value, data, skip_sid=sid)
+    def broadcast_stats(self) -> dict[str, ClientBroadcastStats]:
+        """Число поставленных в очередь, объединённых, отброшенных и отправленных сообщений по sid клиентов"""
+        return self._broadcast_scheduler.stats()
 
-    async def _handle_generated_cast_result(self, cast_result_jsonb:bytes):
-        cast_result = PersonPerformedRayCastResultAdapter.validate_json(cast_result_jsonb)
+    def _process_relay_queue(self):
+        while (task:=self._relay_queue.get()) is not None:
+            try:
+                task()
+            except Exception as e:
+                logging.warning(f'Dropped invalid relayed data: {e}')
 
-        sid:str = request.sid # type:ignore
+    def _owned_person(self, sid:str, person_id:int|None) -> Person|None:
         cl = self._connected_clients.get_by_sid(sid)
-        if cl and (person:=cl.person()) is not None:
-            person.set_performed_ray_cast_result(cast_result.cast_result)
-            await self._io_server.emit(ConnectionEventsNames.recieved_others_cast_result.value, cast_result_jsonb, skip_sid=sid)
+        if person_id is None or cl is None or (person:=cl.person()) is None or person.element_id() != person_id:
+            return None
+        return person
+
+    # Relay: frames are forwarded to peers in the same format right away, after cheap header checks.
+    # Validation, conversion for peers in other formats and applying to models happen in the relay worker.
+    async def _handle_generated_head_data(self, sid:str, data:bytes):
+        person_id = peek_person_id(data)
+        if (person:=self._owned_person(sid, person_id)) is None:
+            return
+        person_id = cast(int, person_id)
+
+        event = ConnectionEventsNames.recieved_others_head_data.value
+        source_format = WireFormat.BINARY if is_binary_frame(data) else WireFormat.JSON
+        source_keypoints = source_format == WireFormat.JSON or head_data_frame_has_keypoints(data)
+        converted_protocols:list[tuple[WireFormat, bool, list[str]]] = []
+        for (wire_format, keypoints), sids in self._peers_by_wire_protocol(sid).items():
+            if wire_format == source_format and (keypoints or not source_keypoints):
+                # binary frames without keypoints are completed by peers from the last keyframe
+                self._broadcast(sids, event, person_id, data)
+            elif wire_format == WireFormat.BINARY and source_format == WireFormat.BINARY:
+                self._broadcast(sids, event, person_id, strip_keypoints(data))
+            else:
+                converted_protocols.append((wire_format, keypoints, sids))
+
+        # only the latest head data of a person is worth validating
+        self._relay_queue.put(('head_data', person_id),
+                              partial(self._validate_and_apply_head_data, person, person_id, data, converted_protocols),
+                              self._merge_head_data_tasks)
+
+    def _validate_and_apply_head_data(self,
+                                      person:Person,
+                                      person_id:int,
+                                      data:bytes,
+                                      converted_protocols:list[tuple[WireFormat, bool, list[str]]]):
+        # frames without keypoints are completed from the last keyframe seen by this worker,
+        # the person model is updated later on the GUI thread and may lag behind
+        person_head_data = decode_person_head_data(data, self._relay_keypoints.get(person_id))
+        if person_head_data.person_id != person_id:
+            raise ValueError(f'Head data of person {person_head_data.person_id} does not match header')
+        if (head_props:=person_head_data.head_data.head_props) is not None \
+                and (not is_binary_frame(data) or head_data_frame_has_keypoints(data)):
+            self._relay_keypoints[person_id] = head_props.keypoints
+        self._head_data_validated.emit(person, person_head_data.head_data)
+        event = ConnectionEventsNames.recieved_others_head_data.value
+        for wire_format, keypoints, sids in converted_protocols:
+            self._broadcast_threadsafe(sids, event, person_id, encode_person_head_data(person_head_data, wire_format, keypoints))
+
+    def _merge_head_data_tasks(self, replaced:partial, latest:partial) -> partial:
+        # keypoints of a keyframe replaced before validation are carried by the frame replacing it
+        person, person_id, data, converted_protocols = latest.args
+        return partial(self._validate_and_apply_head_data, person, person_id,
+                       carry_keypoints(replaced.args[2], data), converted_protocols)
+
+    async def _handle_generated_aggregated_hits(self, sid:str, data:bytes):
+        scene_obj_id = peek_scene_obj_id(data)
+        if scene_obj_id is None or self._active_scene() is None:
+            return
+        await self._io_server.emit(ConnectionEventsNames.recieved_others_aggregated_hits.value, data, skip_sid=sid)
+
+        def validate_and_apply():
+            scene_obj_aggregated_hits = SceneObjAggregatedHitsAdapter.validate_json(data)
+            self._aggregated_hits_validated.emit(scene_obj_aggregated_hits.scene_obj_id, scene_obj_aggregated_hits.hits)
+        # each message carries only newly added hits, so they are not coalesced
+        self._relay_queue.put(None, validate_and_apply)
 
-    async def _handle_request_state(self, _):
-        sid:str = request.sid # type:ignore
+    async def _handle_generated_cast_result(self, sid:str, data:bytes):
+        person_id = peek_person_id(data)
+        if (person:=self._owned_person(sid, person_id)) is None:
+            return
+        person_id = cast(int, person_id)
+
+        event = ConnectionEventsNames.recieved_others_cast_result.value
+        source_format = WireFormat.BINARY if is_binary_frame(data) else WireFormat.JSON
+        converted_formats:dict[WireFormat, list[str]] = dict()
+        for (wire_format, _), sids in self._peers_by_wire_protocol(sid).items():
+            if wire_format == source_format:
+                self._broadcast(sids, event, person_id, data)
+            else:
+                converted_formats.setdefault(wire_format, []).extend(sids)
+
+        def validate_and_apply():
+            cast_result = decode_person_cast_result(data)
+            if cast_result.person_id != person_id:
+                raise ValueError(f'Cast result of person {cast_result.person_id} does not match header')
+            self._cast_result_validated.emit(person, cast_result.cast_result)
+            for wire_format, sids in converted_formats.items():
+                self._broadcast_threadsafe(sids, event, person_id, encode_person_cast_result(cast_result, wire_format))
+        # every cast result adds hits, so they are not coalesced
+        self._relay_queue.put(None, validate_and_apply)
+
+    @Slot(object, object)
+    def _apply_validated_head_data(self, person:Person, head_data:HeadData):
+        if not person.is_removed_from_scene():
+            person.set_head_data(head_data)
+
+    @Slot(object, object)
+    def _apply_validated_cast_result(self, person:Person, cast_result):
+        if not person.is_removed_from_scene():
+            person.set_performed_ray_cast_result(cast_result)
+
+    @Slot(str, object)
+    def _apply_validated_aggregated_hits(self, scene_obj_id:str, hits):
+        scene = self._active_scene()
+        if scene and (scene_obj:=scene.scene_objs_by_id().get(scene_obj_id)) is not None:
+            scene_obj.set_aggregated_hits(hits)
 
+    async def _handle_request_state(self, sid:str, *_):
         scene = self._active_scene()
         if scene:
             state_jsonb = AttentionSceneStateAdapter.dump_json(scene.export_state())
@@ -209,3 +401,20 @@ class ServerApp(QObject):
             state_jsonb = b''
         
         await self._io_server.emit(ConnectionEventsNames.recieved_state.value, state_jsonb, to=sid)
+
+    async def _handle_request_state_changes(self, sid:str, data:bytes):
+        scene = self._active_scene()
+        if scene is None:
+            await self._io_server.emit(ConnectionEventsNames.recieved_state.value, b'', to=sid)
+            return
+        request = StateChangesRequestAdapter.validate_json(data)
+        changes = self._state_log.changes_since(request.log_id, request.since_seq)
+        if changes is None:
+            # too far behind or another scene: snapshot, then the seq it corresponds to.
+            # Changes made while exporting are sent again next time, applying them twice is harmless
+            log_id, seq = self._state_log.current()
+            state_jsonb = AttentionSceneStateAdapter.dump_json(scene.export_state())
+            await self._io_server.emit(ConnectionEventsNames.recieved_state.value, state_jsonb, to=sid)
+            changes = StateChanges(log_id, seq, [], [], [])
+        await self._io_server.emit(ConnectionEventsNames.recieved_state_changes.value,
+                                   StateChangesAdapter.dump_json(changes), to=sid)
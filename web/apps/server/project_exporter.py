@@ -1,10 +1,15 @@
+import hashlib
 from pathlib import Path
+import threading
 from typing import cast
 from PySide6.QtCore import QObject, Slot, Signal
 from common.services.scene.exporters import ProjectArchiverExporter
 from common.services.scene.initializer import AttentionSceneInitializerService
 from common.services.scene.project import AttentionProject
+from common.services.scene.project_data import AttentionProjectData
 from common.services.scene.utils import ProjectInfo
+from web.dtos.project_manifest import ProjectManifest
+from web.project_manifest import ProjectManifestBuilder
 import os
 import shutil
 
@@ -22,19 +27,30 @@ def clear_directory(directory):
 
 
 class ActiveProjectExporter(QObject):
+    """
+    Архив активного проекта для клиентов.
+
+    Архив собирается в отдельном потоке и называется по хешу файлов проекта,
+    поэтому повторная активация неизменённого проекта использует уже собранный архив.
+    """
     active_project_archive_changed = Signal()
     active_project_archive_started = Signal(ProjectInfo)
+    active_project_archive_progress = Signal(ProjectInfo, float)
     active_project_archive_complete = Signal(ProjectInfo)
     active_project_archive_failed = Signal(ProjectInfo, str)
     def __init__(self, 
                  projects_archives_dir:Path,
                  scene_initializer:AttentionSceneInitializerService,
+                 archive_max_workers:int|None=None,
                  ) -> None:
         super().__init__()
         self._projects_archives_dir = projects_archives_dir
+        self._archive_max_workers = archive_max_workers
+        self._project_archiver:ProjectArchiverExporter|None = None
         self._scene_initializer = scene_initializer
         self._scene_initializer.attention_project_changed.connect(self._observe_active_project_changed)
         self._active_project_archive:Path|None = None
+        self._manifest_builder = ProjectManifestBuilder()
         self._set_project(self._scene_initializer.project())
     
     def active_project_archive(self) -> Path|None:
@@ -47,17 +63,33 @@ class ActiveProjectExporter(QObject):
             return archive_path
         return None
     
+    def active_project_manifest(self) -> ProjectManifest|None:
+        """Файлы активного проекта с хешами, читает изменённые файлы проекта, поэтому вызывается вне потока GUI"""
+        project = self._scene_initializer.project()
+        if not project:
+            return None
+        project_data = project.project_data()
+        return self._manifest_builder.build(project_data.project_id(), project_data.storage())
+
+    def active_project_file(self, sha256:str) -> Path|None:
+        """Файл последнего построенного списка файлов по его хешу"""
+        if not self._scene_initializer.project():
+            return None
+        return self._manifest_builder.file_by_hash(sha256)
+
     def active_project_info(self) -> ProjectInfo|None:
         project = self._scene_initializer.project()
         if not project:
             return None
         return project.project_data().info
 
-    @staticmethod
-    def _create_path_for_active_project_archive(project:AttentionProject,
-                                                base_dir:Path) -> Path:
-        archive_path = base_dir / f'{project.project_data().project_id()}.zip'
-        return archive_path
+    def _create_path_for_active_project_archive(self, project_data:AttentionProjectData) -> Path:
+        # the manifest lists every file the archive is made of
+        manifest = self._manifest_builder.build(project_data.project_id(), project_data.storage())
+        files_hash = hashlib.sha256()
+        for file in manifest.files:
+            files_hash.update(f'{file.path}\0{file.sha256}\n'.encode('utf-8'))
+        return self._projects_archives_dir / f'{project_data.project_id()}-{files_hash.hexdigest()[:16]}.zip'
 
     @Slot()
     def _observe_active_project_changed(self):
@@ -65,37 +97,76 @@ class ActiveProjectExporter(QObject):
         self._set_project(project)
         
     def _set_project(self, project:AttentionProject|None):
+        self._manifest_builder.reset_files()
+        if self._project_archiver is not None:
+            # the result of the previous project archiving is ignored
+            self._project_archiver.disconnect(self)
+            self._project_archiver = None
+        # clients are notified about the new project when its archive is ready
+        self._active_project_archive = None
         if project:
-            archive_path = self._create_path_for_active_project_archive(project, self._projects_archives_dir)
-            self._project_archiver = ProjectArchiverExporter(archive_path, project.project_data())
-            self.active_project_archive_started.emit(self._project_archiver.project_info())
-            self._project_archiver.export_complete.connect(self._archive_complete)
-            self._project_archiver.export_failed.connect(self._archive_failed)
-            self._project_archiver.export_project()
+            # the archive path is known only after hashing the project files in the worker
+            archiver = ProjectArchiverExporter(self._projects_archives_dir / f'{project.project_data().project_id()}.zip',
+                                               project.project_data(),
+                                               max_workers=self._archive_max_workers)
+            self._project_archiver = archiver
+            self.active_project_archive_started.emit(archiver.project_info())
+            archiver.export_complete.connect(self._archive_complete)
+            archiver.export_failed.connect(self._archive_failed)
+            archiver.export_progress.connect(self._archive_progress)
+            threading.Thread(target=self._export_in_background, args=(archiver,), daemon=True).start()
+
+    def _export_in_background(self, archiver:ProjectArchiverExporter):
+        try:
+            archive_path = self._create_path_for_active_project_archive(archiver.project_data)
+        except Exception as e:
+            archiver.export_failed.emit(str(e))
+            return
+        archiver.export_archive_path = archive_path
+        if archive_path.exists():
+            archiver.export_complete.emit()
+        else:
+            archiver.export_project()
 
     def _update_last_project(self, new_project_archive:Path):
         self._active_project_archive = new_project_archive
 
+    @Slot(float)
+    def _archive_progress(self, progress:float):
+        archiver = self.sender()
+        if isinstance(archiver, ProjectArchiverExporter) and archiver is self._project_archiver:
+            self.active_project_archive_progress.emit(archiver.project_info(), progress)
+
     @Slot()
     def _archive_complete(self):
-        archiver = cast(ProjectArchiverExporter, self._project_archiver)
+        archiver = self.sender()
+        if not isinstance(archiver, ProjectArchiverExporter) or archiver is not self._project_archiver:
+            return
         project_info = archiver.project_info()
         self._active_project_archive = archiver.export_archive_path
         self._project_archiver = None
+        self._remove_outdated_archives(archiver.project_data.project_id(), archiver.export_archive_path)
 
         self.active_project_archive_complete.emit(project_info)
         self.active_project_archive_changed.emit()
     
     @Slot(str)
     def _archive_failed(self, reason:str):
-        archiver = cast(ProjectArchiverExporter, self._project_archiver)
+        archiver = self.sender()
+        if not isinstance(archiver, ProjectArchiverExporter) or archiver is not self._project_archiver:
+            return
         project_info = archiver.project_info()
-        self._active_project_archive = archiver.export_archive_path
+        self._active_project_archive = None
         self._project_archiver = None
 
         self.active_project_archive_failed.emit(project_info, reason)
         self.active_project_archive_changed.emit()
 
+    def _remove_outdated_archives(self, project_id:str, actual_archive:Path):
+        # archives of the other projects stay cached until they are activated again
+        for archive_path in self._projects_archives_dir.glob(f'{project_id}-*.zip'):
+            if archive_path != actual_archive:
+                archive_path.unlink(missing_ok=True)
 
     def _remove_active_project_archive(self):
         if self._active_project_archive:
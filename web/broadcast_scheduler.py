@@ -0,0 +1,124 @@
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+import logging
+import time
+from typing import Awaitable, Callable, Hashable
+
+
+@dataclass
+class ClientBroadcastStats:
+    enqueued:int = 0
+    coalesced:int = 0
+    dropped:int = 0
+    sent_messages:int = 0
+    sent_batches:int = 0
+    pending:int = 0
+
+
+# send(sid, [(event, payload), ...]) sends one batch to the client
+SendBatch = Callable[[str, list[tuple[str, bytes]]], Awaitable[None]]
+# merge(replaced_payload, latest_payload) returns the payload that replaces a pending message
+MergePayloads = Callable[[bytes, bytes], bytes]
+
+
+class _ClientSendQueue:
+    def __init__(self, max_pending:int, merge_payloads:MergePayloads|None) -> None:
+        self.messages:OrderedDict[Hashable, tuple[str, bytes]] = OrderedDict()
+        self.max_pending = max_pending
+        self.merge_payloads = merge_payloads
+        self.stats = ClientBroadcastStats()
+        self.has_messages = asyncio.Event()
+        self.task:asyncio.Task|None = None
+
+    def put(self, key:Hashable, event:str, payload:bytes):
+        stats = self.stats
+        stats.enqueued += 1
+        if (replaced:=self.messages.get(key)) is not None:
+            # latest wins, the message keeps its place in the queue
+            if self.merge_payloads is not None:
+                payload = self.merge_payloads(replaced[1], payload)
+            self.messages[key] = (event, payload)
+            stats.coalesced += 1
+        else:
+            if len(self.messages) >= self.max_pending:
+                self.messages.popitem(last=False)
+                stats.dropped += 1
+            self.messages[key] = (event, payload)
+        stats.pending = len(self.messages)
+        self.has_messages.set()
+
+    def take_all(self) -> list[tuple[str, bytes]]:
+        batch = list(self.messages.values())
+        self.messages.clear()
+        self.has_messages.clear()
+        self.stats.pending = 0
+        return batch
+
+
+class BroadcastScheduler:
+    """
+    Планировщик отправки данных операторов клиентам сервера.
+
+    У каждого клиента своя очередь с ключами (событие, person_id): новое сообщение заменяет ещё не отправленное
+    с тем же ключом. Очередь отправляется одним пакетом не чаще max_rate_hz раз в секунду,
+    поэтому медленный клиент получает только последние данные и не копит буферы python-socketio.
+    merge_payloads позволяет сохранить в заменяющем сообщении данные заменённого, например ключевые точки опорного кадра.
+    Все методы вызываются в цикле событий сервера.
+    """
+    def __init__(self,
+                 send_batch:SendBatch,
+                 max_rate_hz:float=30,
+                 max_pending:int=256,
+                 merge_payloads:MergePayloads|None=None) -> None:
+        self._send_batch = send_batch
+        self._merge_payloads = merge_payloads
+        self._min_interval = 1 / max_rate_hz if max_rate_hz > 0 else 0
+        self._max_pending = max_pending
+        self._queues:dict[str, _ClientSendQueue] = dict()
+
+    def max_rate_hz(self) -> float:
+        return 1 / self._min_interval if self._min_interval else 0
+
+    def set_max_rate_hz(self, max_rate_hz:float):
+        self._min_interval = 1 / max_rate_hz if max_rate_hz > 0 else 0
+
+    def enqueue(self, sid:str, event:str, person_id:int, payload:bytes):
+        queue = self._queues.get(sid)
+        if queue is None:
+            queue = self._queues[sid] = _ClientSendQueue(self._max_pending, self._merge_payloads)
+            queue.task = asyncio.get_running_loop().create_task(self._run_client(sid, queue))
+        queue.put((event, person_id), event, payload)
+
+    def remove_client(self, sid:str):
+        if (queue:=self._queues.pop(sid, None)) is not None and queue.task is not None:
+            queue.task.cancel()
+
+    def clear(self):
+        for sid in list(self._queues):
+            self.remove_client(sid)
+
+    def stats(self) -> dict[str, ClientBroadcastStats]:
+        return {sid: ClientBroadcastStats(**vars(queue.stats)) for sid, queue in self._queues.items()}
+
+    async def _run_client(self, sid:str, queue:_ClientSendQueue):
+        last_sent = 0.0
+        while True:
+            await queue.has_messages.wait()
+            wait_sec = last_sent + self._min_interval - time.monotonic()
+            if wait_sec > 0:
+                # messages arriving meanwhile are coalesced into the same batch
+                await asyncio.sleep(wait_sec)
+            batch = queue.take_all()
+            last_sent = time.monotonic()
+            if not batch:
+                continue
+            try:
+                await self._send_batch(sid, batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f'Failed to send batch to {sid}: {e}')
+                continue
+            queue.stats.sent_batches += 1
+            queue.stats.sent_messages += len(batch)
@@ -3,6 +3,7 @@ from PySide6.QtCore import QObject, Slot, Signal
 from common.domain.interfaces import Person
 from common.dtos.head_data import HeadData
 from common.dtos.hits import PerformedRayCastResult
+from web.wire import WireFormat
 
 
 class ConnectedClient(QObject):
@@ -17,6 +18,8 @@ class ConnectedClient(QObject):
         self._name:str = ''
         self._person:Person|None = None
         self._is_connected = True
+        self._wire_format = WireFormat.JSON
+        self._wants_keypoints = True
 
     def sid(self):
         return self._sid
@@ -45,6 +48,16 @@ class ConnectedClient(QObject):
         if p:=self._person:
             p.set_performed_ray_cast_result(cast_result)
 
+    def wire_format(self) -> WireFormat:
+        return self._wire_format
+
+    def wants_keypoints(self) -> bool:
+        return self._wants_keypoints
+
+    def set_wire_protocol(self, wire_format:WireFormat, wants_keypoints:bool):
+        self._wire_format = wire_format
+        self._wants_keypoints = wants_keypoints
+
     def is_connected(self) -> bool:
         return self._is_connected
 
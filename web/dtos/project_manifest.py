@@ -0,0 +1,21 @@
+from pydantic import TypeAdapter
+from pydantic.dataclasses import dataclass
+
+from common.dtos.utils import BaseConfig
+
+
+@dataclass(frozen=True, config=BaseConfig)
+class ManifestFile:
+    # path relative to the project folder, with "/" separators
+    path:str
+    sha256:str
+    size:int
+
+
+@dataclass(frozen=True, config=BaseConfig)
+class ProjectManifest:
+    project_id:str
+    files:list[ManifestFile]
+
+
+ProjectManifestAdapter = TypeAdapter(ProjectManifest)
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+from pydantic import TypeAdapter
+from pydantic.dataclasses import dataclass
+
+from common.dtos.hits import AggregatedHit
+from common.dtos.utils import AttentionRuleId, BaseConfig, Color, PersonId, Quat, SceneObjId, Vec3D
+
+
+# Fields left as None did not change since the requested seq
+
+@dataclass(frozen=True, config=BaseConfig)
+class PersonPatch:
+    id:PersonId
+    name:str|None = None
+    head_color:Color|None = None
+    camera_position:Vec3D|None = None
+    camera_rotation:Quat|None = None
+
+
+@dataclass(frozen=True, config=BaseConfig)
+class SceneObjPatch:
+    id:SceneObjId
+    name:str|None = None
+    keep_attention_timedelta:timedelta|None = None
+    aggregated_hits_added:list[AggregatedHit]|None = None
+
+
+@dataclass(frozen=True, config=BaseConfig)
+class AttentionRulePatch:
+    id:AttentionRuleId
+    name:str|None = None
+    without_attention_timedelta:timedelta|None = None
+    last_refresh_timestamp:datetime|None = None
+
+
+@dataclass(frozen=True, config=BaseConfig)
+class StateChangesRequest:
+    # log_id and seq of the last applied changes, None for a client without state
+    log_id:str|None = None
+    since_seq:int|None = None
+
+
+@dataclass(frozen=True, config=BaseConfig)
+class StateChanges:
+    log_id:str
+    seq:int
+    persons:list[PersonPatch]
+    scene_objs:list[SceneObjPatch]
+    rules:list[AttentionRulePatch]
+
+
+StateChangesRequestAdapter = TypeAdapter(StateChangesRequest)
+StateChangesAdapter = TypeAdapter(StateChanges)
@@ -0,0 +1,220 @@
+from collections import deque
+from datetime import datetime
+import threading
+import time
+from typing import Any
+import numpy as np
+from PySide6.QtCore import QObject, QTimer, Slot
+from PySide6.QtGui import QQuaternion, QVector3D
+
+from common.domain.interfaces import Person
+from common.dtos.head_data import EyeTransform, EyesTransforms, HeadData, HeadProps
+
+
+def _lerp_vector(a:QVector3D, b:QVector3D, t:float) -> QVector3D:
+    return a + (b - a) * t
+
+
+def _slerp(a:QQuaternion, b:QQuaternion, t:float) -> QQuaternion:
+    """Сферическая интерполяция, при t > 1 продолжает вращение за b"""
+    q0 = np.array((a.scalar(), a.x(), a.y(), a.z()), dtype=np.float64)
+    q1 = np.array((b.scalar(), b.x(), b.y(), b.z()), dtype=np.float64)
+    q0 /= np.linalg.norm(q0) or 1
+    q1 /= np.linalg.norm(q1) or 1
+    dot = float(q0 @ q1)
+    if dot < 0:
+        q1, dot = -q1, -dot
+    if dot > 0.9995:
+        q = q0 + (q1 - q0) * t
+    else:
+        theta = np.arccos(min(dot, 1.0))
+        q = (np.sin((1 - t) * theta) * q0 + np.sin(t * theta) * q1) / np.sin(theta)
+    q /= np.linalg.norm(q) or 1
+    return QQuaternion(*q.tolist())
+
+
+def _interpolate_eye(a:EyeTransform, b:EyeTransform, t:float) -> EyeTransform:
+    return EyeTransform(_lerp_vector(a.position, b.position, t), _slerp(a.rotation, b.rotation, t))
+
+
+def interpolate_head_data(a:HeadData, b:HeadData, t:float, timestamp:datetime) -> HeadData:
+    """
+    Положение головы и глаз между видимыми кадрами a и b, t=0 соответствует a, t=1 - b, t > 1 экстраполирует.
+    Ключевые точки берутся из ближайшего кадра.
+    """
+    a_props, b_props = a.head_props, b.head_props
+    a_eyes, b_eyes = a.eyes_transforms, b.eyes_transforms
+    if a_props is None or b_props is None or a_eyes is None or b_eyes is None:
+        raise ValueError('Only visible head data can be interpolated')
+    head_props = HeadProps(_lerp_vector(a_props.position, b_props.position, t),
+                           _slerp(a_props.rotation, b_props.rotation, t),
+                           a_props.keypoints if t < 0.5 else b_props.keypoints)
+    eyes = EyesTransforms(_interpolate_eye(a_eyes.left_eye_transform, b_eyes.left_eye_transform, t),
+                          _interpolate_eye(a_eyes.right_eye_transform, b_eyes.right_eye_transform, t))
+    return HeadData(timestamp, b.view_origin if t >= 0.5 else a.view_origin, head_props, eyes)
+
+
+class HeadDataJitterBuffer:
+    """
+    Буфер кадров данных головы одного удалённого оператора.
+
+    Кадры воспроизводятся с задержкой playout_delay_sec относительно времени отправки,
+    приведённого к локальным часам по наименьшей наблюдаемой задержке доставки.
+    Положение между кадрами интерполируется, при опоздании кадров экстраполируется
+    не дальше max_extrapolation_sec, после чего удерживается последнее - один и тот же объект.
+    """
+    def __init__(self, playout_delay_sec:float=0.1, max_extrapolation_sec:float=0.25, max_frames:int=64) -> None:
+        self._playout_delay_sec = playout_delay_sec
+        self._max_extrapolation_sec = max_extrapolation_sec
+        # (sender timestamp in seconds, head data)
+        self._frames:deque[tuple[float, HeadData]] = deque(maxlen=max_frames)
+        # (arrival in local monotonic seconds - sender timestamp) of the recent frames
+        self._delays:deque[float] = deque(maxlen=max_frames)
+        self._playout_sec = float('-inf')
+        self._last_arrival_sec = float('-inf')
+        # (sender timestamp of the last frame, extrapolation clamped at max_extrapolation_sec)
+        self._clamped:tuple[float, HeadData]|None = None
+
+    def __len__(self):
+        return len(self._frames)
+
+    def latest(self) -> HeadData|None:
+        return self._frames[-1][1] if self._frames else None
+
+    def last_arrival_sec(self) -> float:
+        return self._last_arrival_sec
+
+    def push(self, head_data:HeadData, arrival_sec:float|None=None):
+        timestamp_sec = head_data.timestamp.timestamp()
+        if self._frames and timestamp_sec <= self._frames[-1][0]:
+            # late or duplicated frame
+            return
+        arrival_sec = time.monotonic() if arrival_sec is None else arrival_sec
+        self._last_arrival_sec = arrival_sec
+        self._frames.append((timestamp_sec, head_data))
+        self._delays.append(arrival_sec - timestamp_sec)
+
+    def sample(self, now_sec:float|None=None) -> HeadData|None:
+        """Данные головы для кадра отрисовки в момент now_sec локальных монотонных часов"""
+        if not self._frames:
+            return None
+        now_sec = time.monotonic() if now_sec is None else now_sec
+        # playout time does not go back when the least delayed frame leaves the window
+        playout_sec = self._playout_sec = max(self._playout_sec, now_sec - min(self._delays) - self._playout_delay_sec)
+        frames = self._frames
+
+        # frames older than the one preceding the playout time are not needed anymore
+        while len(frames) > 2 and frames[1][0] <= playout_sec:
+            frames.popleft()
+
+        first_sec, first = frames[0]
+        if playout_sec <= first_sec or len(frames) == 1:
+            return first if playout_sec <= first_sec else self._extrapolate(playout_sec)
+        next_sec, next_frame = frames[1]
+        if playout_sec >= next_sec:
+            return self._extrapolate(playout_sec)
+        if not self._visible(first) or not self._visible(next_frame):
+            return first
+        t = (playout_sec - first_sec) / (next_sec - first_sec)
+        return interpolate_head_data(first, next_frame, t, datetime.fromtimestamp(playout_sec))
+
+    def _extrapolate(self, playout_sec:float) -> HeadData:
+        last_sec, last = self._frames[-1]
+        if len(self._frames) < 2 or not self._visible(last):
+            return last
+        prev_sec, prev = self._frames[-2]
+        if not self._visible(prev) or last_sec - prev_sec <= 0:
+            return last
+        if playout_sec - last_sec <= 0:
+            return last
+        if playout_sec - last_sec < self._max_extrapolation_sec:
+            t = 1 + (playout_sec - last_sec) / (last_sec - prev_sec)
+            return interpolate_head_data(prev, last, t, datetime.fromtimestamp(playout_sec))
+        # the held pose is computed once while no newer frame arrives
+        if self._clamped is None or self._clamped[0] != last_sec:
+            ahead_sec = self._max_extrapolation_sec
+            t = 1 + ahead_sec / (last_sec - prev_sec)
+            self._clamped = (last_sec, interpolate_head_data(prev, last, t, datetime.fromtimestamp(last_sec + ahead_sec)))
+        return self._clamped[1]
+
+    @staticmethod
+    def _visible(head_data:HeadData) -> bool:
+        return head_data.view_origin != HeadData.ViewOrigin.NOT_VISIBLE
+
+
+class RemoteHeadDataPlayback(QObject):
+    """
+    Воспроизведение данных головы удалённых операторов через HeadDataJitterBuffer.
+
+    push можно вызывать из любого потока, модели операторов обновляются в потоке объекта
+    не чаще одного раза за такт tick_interval_ms, и только если изменилась метка времени данных.
+    Оператор, от которого кадры не приходят silence_timeout_sec, становится невидимым, и его буфер удаляется.
+    """
+    def __init__(self,
+                 playout_delay_sec:float=0.1,
+                 max_extrapolation_sec:float=0.25,
+                 tick_interval_ms:int=16,
+                 silence_timeout_sec:float=2.0) -> None:
+        super().__init__()
+        self._playout_delay_sec = playout_delay_sec
+        self._max_extrapolation_sec = max_extrapolation_sec
+        self._silence_timeout_sec = silence_timeout_sec
+        self._lock = threading.Lock()
+        self._buffers:dict[Any, tuple[Person, HeadDataJitterBuffer]] = dict()
+        self._applied:dict[Any, HeadData] = dict()
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(tick_interval_ms)
+        self._timer.setSingleShot(False)
+        self._timer.timeout.connect(self.tick)
+        self._timer.start()
+
+    def push(self, person:Person, head_data:HeadData):
+        person_id = person.element_id()
+        with self._lock:
+            entry = self._buffers.get(person_id)
+            if entry is None or entry[0] is not person:
+                entry = self._buffers[person_id] = (person, HeadDataJitterBuffer(self._playout_delay_sec, self._max_extrapolation_sec))
+            entry[1].push(head_data)
+
+    def latest(self, person_id) -> HeadData|None:
+        """Последний полученный кадр оператора, в том числе ещё не воспроизведённый"""
+        with self._lock:
+            entry = self._buffers.get(person_id)
+            return entry[1].latest() if entry is not None else None
+
+    def remove_person(self, person_id):
+        with self._lock:
+            self._buffers.pop(person_id, None)
+        self._applied.pop(person_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._buffers.clear()
+        self._applied.clear()
+
+    @Slot()
+    def tick(self):
+        now_sec = time.monotonic()
+        with self._lock:
+            silent = [(person_id, person) for person_id, (person, buffer) in self._buffers.items()
+                      if now_sec - buffer.last_arrival_sec() > self._silence_timeout_sec]
+            for person_id, _ in silent:
+                del self._buffers[person_id]
+            samples = [(person_id, person, buffer.sample(now_sec)) for person_id, (person, buffer) in self._buffers.items()]
+        for person_id, person in silent:
+            applied = self._applied.pop(person_id, None)
+            if applied is not None and applied.view_origin != HeadData.ViewOrigin.NOT_VISIBLE \
+                    and not person.is_removed_from_scene():
+                person.set_head_data(HeadData(datetime.now()))
+        for person_id, person, head_data in samples:
+            if head_data is None:
+                continue
+            # samples are rebuilt every tick, a change shows up in the timestamp
+            if (applied:=self._applied.get(person_id)) is not None and applied.timestamp == head_data.timestamp:
+                continue
+            if person.is_removed_from_scene():
+                self.remove_person(person_id)
+                continue
+            self._applied[person_id] = head_data
+            person.set_head_data(head_data)
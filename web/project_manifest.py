@@ -0,0 +1,130 @@
+import hashlib
+import os
+from pathlib import Path
+import threading
+import requests
+
+from common.services.scene.exporters import project_files
+from common.services.scene.utils import ProjectStorageStructure
+from web.dtos.project_manifest import ManifestFile, ProjectManifest
+
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_sha256(path:Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ProjectManifestBuilder:
+    """
+    Список файлов проекта с их хешами SHA-256.
+
+    Хеш файла пересчитывается, только если изменились его размер или время изменения,
+    поэтому после правки описания сцены заново читается только файл описания.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # absolute path -> (size, mtime_ns, sha256)
+        self._hashes:dict[Path, tuple[int, int, str]] = dict()
+        # sha256 -> file of the last built manifest
+        self._files_by_hash:dict[str, Path] = dict()
+
+    def build(self, project_id:str, storage:ProjectStorageStructure) -> ProjectManifest:
+        project_folder = storage.project_folder.resolve()
+        files, files_by_hash = [], dict()
+        for path in project_files(storage):
+            stat = path.stat()
+            with self._lock:
+                cached = self._hashes.get(path)
+            if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+                sha256 = cached[2]
+            else:
+                sha256 = file_sha256(path)
+                with self._lock:
+                    self._hashes[path] = (stat.st_size, stat.st_mtime_ns, sha256)
+            files.append(ManifestFile(path.relative_to(project_folder).as_posix(), sha256, stat.st_size))
+            files_by_hash[sha256] = path
+        with self._lock:
+            self._files_by_hash = files_by_hash
+        return ProjectManifest(project_id, files)
+
+    def file_by_hash(self, sha256:str) -> Path|None:
+        with self._lock:
+            return self._files_by_hash.get(sha256)
+
+    def reset_files(self):
+        """Забывает файлы последнего списка, хеши файлов остаются"""
+        with self._lock:
+            self._files_by_hash.clear()
+
+
+class BlobCache:
+    """
+    Локальное хранилище файлов, адресуемых хешем содержимого.
+
+    Файл скачивается во временный .part и переносится на место только после проверки хеша,
+    прерванная загрузка продолжается с места обрыва запросом Range.
+    """
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, cache_dir:Path) -> None:
+        self._cache_dir = cache_dir
+        self._cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def blob_path(self, sha256:str) -> Path:
+        return self._cache_dir / sha256[:2] / sha256
+
+    def has(self, sha256:str) -> bool:
+        return self.blob_path(sha256).is_file()
+
+    def missing(self, manifest:ProjectManifest) -> list[ManifestFile]:
+        missing, seen = [], set()
+        for file in manifest.files:
+            if file.sha256 not in seen and not self.has(file.sha256):
+                missing.append(file)
+            seen.add(file.sha256)
+        return missing
+
+    def download(self, url:str, file:ManifestFile) -> int:
+        """Скачивает файл, если его нет в хранилище, возвращает число полученных байт"""
+        blob_path = self.blob_path(file.sha256)
+        if blob_path.is_file():
+            return 0
+        blob_path.parent.mkdir(exist_ok=True)
+        part_path = blob_path.with_suffix('.part')
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        if offset > file.size:
+            part_path.unlink()
+            offset = 0
+        headers = {'Range': f'bytes={offset}-'} if 0 < offset < file.size else {}
+
+        received = 0
+        if offset < file.size or file.size == 0:
+            with requests.get(url, headers=headers, stream=True) as r:
+                r.raise_for_status()
+                # the server may ignore the range and send the whole file
+                mode = 'ab' if r.status_code == 206 else 'wb'
+                with open(part_path, mode) as f:
+                    for chunk in r.iter_content(chunk_size=self.CHUNK_SIZE):
+                        f.write(chunk)
+                        received += len(chunk)
+
+        if file_sha256(part_path) != file.sha256:
+            part_path.unlink()
+            raise ValueError(f'Downloaded file {file.path} does not match its hash')
+        os.replace(part_path, blob_path)
+        return received
+
+    def project_files(self, manifest:ProjectManifest) -> dict[str, Path]:
+        """Расположение файлов проекта в хранилище, все файлы должны быть скачаны"""
+        files = dict()
+        for file in manifest.files:
+            if not self.has(file.sha256):
+                raise ValueError(f'File {file.path} is not downloaded')
+            files[file.path] = self.blob_path(file.sha256)
+        return files
@@ -0,0 +1,279 @@
+from dataclasses import dataclass
+import itertools
+import threading
+import time
+from typing import Callable
+import numpy as np
+from PySide6.QtCore import QObject, QTimer, Slot
+
+from common.domain.interfaces import Person, SceneObj
+from common.dtos.head_data import HeadData, PersonHeadData
+from common.dtos.hits import AggregatedHit, ColumnarRayCastResult, PersonPerformedRayCastResult, SceneObjAggregatedHits, SceneObjAggregatedHitsAdapter
+from web.utils import ConnectionEventsNames
+from web.wire import WireFormat, encode_person_cast_result, encode_person_head_data
+
+
+@dataclass(frozen=True)
+class PublisherStats:
+    rate_hz:float
+    rtt_sec:float|None
+    in_flight:int
+    sent_head_data:int
+    sent_keyframes:int
+    skipped_head_data:int
+    sent_cast_results:int
+    skipped_cast_results:int
+    sent_aggregated_hits:int
+    sent_bytes:int
+
+
+# send(event, payload, on_ack) emits the message from the client event loop, on_ack is called on server acknowledgement
+PublishSend = Callable[[str, bytes, Callable[..., None]], None]
+
+
+class PersonDataPublisher(QObject):
+    """
+    Отправка на сервер данных оператора, которым управляет клиент.
+
+    Данные головы берутся не с частотой камеры, а с частотой отправки: между отправками остаётся только последний кадр.
+    В бинарном формате ключевые точки лица передаются только в опорных кадрах - раз в keyframe_interval_sec
+    или при их изменении больше keypoints_tolerance, остальные кадры содержат только положение головы и глаз.
+    Результаты бросания лучей без изменений не отправляются.
+    Частота отправки снижается, когда растёт время подтверждения сервером или число неподтверждённых сообщений,
+    и постепенно возвращается к max_rate_hz.
+    """
+    # messages not acknowledged for this long are considered lost
+    ACK_TIMEOUT_SEC = 5.0
+    RATE_DECREASE_FACTOR = 0.7
+    RATE_INCREASE_HZ_PER_SEC = 2.0
+    RTT_SMOOTHING = 0.2
+
+    def __init__(self,
+                 send:PublishSend,
+                 wire_format:Callable[[], WireFormat],
+                 max_rate_hz:float=20,
+                 min_rate_hz:float=2,
+                 keyframe_interval_sec:float=1.0,
+                 keypoints_tolerance:float=1e-3,
+                 max_in_flight:int=8,
+                 rtt_budget_sec:float=0.15,
+                 ) -> None:
+        super().__init__()
+        self._send = send
+        self._wire_format = wire_format
+        self._max_rate_hz = max(max_rate_hz, min_rate_hz)
+        self._min_rate_hz = min_rate_hz
+        self._rate_hz = self._max_rate_hz
+        self._keyframe_interval_sec = keyframe_interval_sec
+        self._keypoints_tolerance = keypoints_tolerance
+        self._max_in_flight = max_in_flight
+        self._rtt_budget_sec = rtt_budget_sec
+
+        self._person:Person|None = None
+        self._scene_objs:list[SceneObj] = []
+
+        self._pending_head_data:HeadData|None = None
+        self._last_sent_view_origin:HeadData.ViewOrigin|None = None
+        self._keyframe_keypoints:np.ndarray|None = None
+        self._keyframe_time = 0.0
+        self._last_cast_result:ColumnarRayCastResult|None = None
+
+        # acknowledgements arrive in the client event loop thread
+        self._ack_lock = threading.Lock()
+        self._seq = itertools.count()
+        self._unacked:dict[int, float] = dict()
+        self._rtt_sec:float|None = None
+
+        self._sent_head_data = 0
+        self._sent_keyframes = 0
+        self._skipped_head_data = 0
+        self._sent_cast_results = 0
+        self._skipped_cast_results = 0
+        self._sent_aggregated_hits = 0
+        self._sent_bytes = 0
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(False)
+        self._timer.timeout.connect(self._publish_head_data)
+        self._apply_rate()
+
+    def person(self) -> Person|None:
+        return self._person
+
+    def set_person(self, person:Person|None):
+        if person == self._person:
+            return
+        self._disconnect_person()
+        self._person = person
+        self._reset_stream()
+        if person is None:
+            return
+        person.head_data_changed.connect(self._handle_head_data_changed)
+        person.performed_ray_cast_result_changed.connect(self._handle_cast_result_changed)
+        # scene objs come from the project model and do not change while the scene exists
+        for scene_obj in person.scene().scene_objs():
+            scene_obj.aggregated_attention_hits_added.connect(self._handle_aggregated_hits_added)
+            self._scene_objs.append(scene_obj)
+
+    def start(self):
+        self._reset_stream()
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def stop(self):
+        self._timer.stop()
+        self._reset_stream()
+
+    def is_running(self) -> bool:
+        return self._timer.isActive()
+
+    def rate_hz(self) -> float:
+        return self._rate_hz
+
+    def max_rate_hz(self) -> float:
+        return self._max_rate_hz
+
+    def set_max_rate_hz(self, max_rate_hz:float):
+        self._max_rate_hz = max(max_rate_hz, self._min_rate_hz)
+        self._rate_hz = min(self._rate_hz, self._max_rate_hz)
+        self._apply_rate()
+
+    def stats(self) -> PublisherStats:
+        with self._ack_lock:
+            rtt_sec, in_flight = self._rtt_sec, len(self._unacked)
+        return PublisherStats(self._rate_hz, rtt_sec, in_flight,
+                              self._sent_head_data, self._sent_keyframes, self._skipped_head_data,
+                              self._sent_cast_results, self._skipped_cast_results,
+                              self._sent_aggregated_hits, self._sent_bytes)
+
+    def _disconnect_person(self):
+        if self._person is not None:
+            self._person.head_data_changed.disconnect(self._handle_head_data_changed)
+            self._person.performed_ray_cast_result_changed.disconnect(self._handle_cast_result_changed)
+        for scene_obj in self._scene_objs:
+            scene_obj.aggregated_attention_hits_added.disconnect(self._handle_aggregated_hits_added)
+        self._scene_objs.clear()
+
+    def _reset_stream(self):
+        self._pending_head_data = None
+        self._last_sent_view_origin = None
+        self._keyframe_keypoints = None
+        self._last_cast_result = None
+        with self._ack_lock:
+            self._unacked.clear()
+
+    # Sending
+    def _emit(self, event:ConnectionEventsNames, payload:bytes):
+        seq = next(self._seq)
+        with self._ack_lock:
+            self._unacked[seq] = time.monotonic()
+        self._sent_bytes += len(payload)
+        self._send(event.value, payload, lambda *_: self._handle_ack(seq))
+
+    def _handle_ack(self, seq:int):
+        with self._ack_lock:
+            sent_at = self._unacked.pop(seq, None)
+            if sent_at is None:
+                return
+            rtt_sec = time.monotonic() - sent_at
+            self._rtt_sec = rtt_sec if self._rtt_sec is None else \
+                self._rtt_sec + self.RTT_SMOOTHING * (rtt_sec - self._rtt_sec)
+
+    def _in_flight(self) -> int:
+        now = time.monotonic()
+        with self._ack_lock:
+            for seq in [seq for seq, sent_at in self._unacked.items() if now - sent_at > self.ACK_TIMEOUT_SEC]:
+                del self._unacked[seq]
+            return len(self._unacked)
+
+    def _adapt_rate(self, in_flight:int):
+        with self._ack_lock:
+            rtt_sec = self._rtt_sec
+        congested = in_flight > self._max_in_flight or (rtt_sec is not None and rtt_sec > self._rtt_budget_sec)
+        if congested:
+            rate_hz = max(self._min_rate_hz, self._rate_hz * self.RATE_DECREASE_FACTOR)
+        else:
+            rate_hz = min(self._max_rate_hz, self._rate_hz + self.RATE_INCREASE_HZ_PER_SEC / self._rate_hz)
+        if rate_hz != self._rate_hz:
+            self._rate_hz = rate_hz
+            self._apply_rate()
+
+    def _apply_rate(self):
+        self._timer.setInterval(max(int(1000 / self._rate_hz), 1))
+
+    # Head data
+    @Slot(HeadData)
+    def _handle_head_data_changed(self, head_data:HeadData):
+        if self._pending_head_data is not None:
+            self._skipped_head_data += 1
+        self._pending_head_data = head_data
+
+    def _needs_keyframe(self, head_data:HeadData) -> bool:
+        head_props = head_data.head_props
+        if head_props is None:
+            return False
+        now = time.monotonic()
+        if self._keyframe_keypoints is not None and now - self._keyframe_time < self._keyframe_interval_sec \
+                and np.abs(head_props.keypoints - self._keyframe_keypoints).max() <= self._keypoints_tolerance:
+            return False
+        self._keyframe_keypoints = np.array(head_props.keypoints)
+        self._keyframe_time = now
+        return True
+
+    @Slot()
+    def _publish_head_data(self):
+        in_flight = self._in_flight()
+        self._adapt_rate(in_flight)
+        head_data = self._pending_head_data
+        if self._person is None or head_data is None or in_flight > self._max_in_flight:
+            return
+        self._pending_head_data = None
+
+        not_visible = head_data.view_origin == HeadData.ViewOrigin.NOT_VISIBLE
+        if not_visible and self._last_sent_view_origin == HeadData.ViewOrigin.NOT_VISIBLE:
+            self._skipped_head_data += 1
+            return
+        if not_visible:
+            # the face may change while it is not tracked
+            self._keyframe_keypoints = None
+        self._last_sent_view_origin = head_data.view_origin
+
+        wire_format = self._wire_format()
+        # JSON frames always carry keypoints
+        keyframe = wire_format == WireFormat.JSON or self._needs_keyframe(head_data)
+        payload = encode_person_head_data(PersonHeadData(self._person.element_id(), head_data), wire_format, keyframe)
+        self._emit(ConnectionEventsNames.generated_head_data, payload)
+        self._sent_head_data += 1
+        self._sent_keyframes += int(keyframe and not not_visible)
+
+    # Cast results and aggregated hits are not sampled: every one of them adds attention hits
+    @Slot()
+    def _handle_cast_result_changed(self):
+        if self._person is None or not self.is_running():
+            return
+        cast_result = self._person.performed_ray_cast_result()
+        if cast_result is None:
+            return
+        last = self._last_cast_result
+        if last is not None and (cast_result.timestamp <= last.timestamp or
+                                 (len(cast_result) == 0 and len(last) == 0)):
+            self._skipped_cast_results += 1
+            return
+        self._last_cast_result = cast_result
+        payload = encode_person_cast_result(PersonPerformedRayCastResult(self._person.element_id(), cast_result.to_dto()),
+                                            self._wire_format())
+        self._emit(ConnectionEventsNames.generated_cast_result, payload)
+        self._sent_cast_results += 1
+
+    @Slot(list)
+    def _handle_aggregated_hits_added(self, hits:list[AggregatedHit]):
+        scene_obj = self.sender()
+        if self._person is None or not self.is_running() or not isinstance(scene_obj, SceneObj):
+            return
+        person_id = self._person.element_id()
+        own_hits = [hit for hit in hits if hit.person_id == person_id]
+        if not own_hits:
+            return
+        payload = SceneObjAggregatedHitsAdapter.dump_json(SceneObjAggregatedHits(scene_obj.element_id(), own_hits))
+        self._emit(ConnectionEventsNames.generated_scene_obj_aggregated_hits, payload)
+        self._sent_aggregated_hits += 1
@@ -0,0 +1,81 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import itertools
+import threading
+from typing import Callable, Hashable
+
+
+RelayTask = Callable[[], None]
+# merge(replaced_task, latest_task) returns the task that replaces a pending one
+MergeTasks = Callable[[RelayTask, RelayTask], RelayTask]
+
+
+@dataclass(frozen=True)
+class RelayQueueStats:
+    depth:int
+    enqueued:int
+    coalesced:int
+    dropped:int
+    processed:int
+
+
+class CoalescingRelayQueue:
+    """
+    Ограниченная очередь задач для потока-обработчика.
+
+    Задача с ключом заменяет ещё не взятую задачу с тем же ключом, сохраняя её место в очереди,
+    задачи без ключа не объединяются. merge позволяет сохранить в заменяющей задаче данные заменённой.
+    При переполнении отбрасывается самая старая задача.
+    """
+    def __init__(self, max_depth:int=256) -> None:
+        self._max_depth = max(int(max_depth), 1)
+        self._tasks:OrderedDict[Hashable, RelayTask] = OrderedDict()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._unique_keys = itertools.count()
+        self._enqueued = 0
+        self._coalesced = 0
+        self._dropped = 0
+        self._processed = 0
+
+    def put(self, key:Hashable|None, task:RelayTask, merge:MergeTasks|None=None):
+        with self._condition:
+            if self._closed:
+                return
+            self._enqueued += 1
+            if key is None:
+                key = ('unique', next(self._unique_keys))
+            elif (replaced:=self._tasks.get(key)) is not None:
+                self._tasks[key] = merge(replaced, task) if merge is not None else task
+                self._coalesced += 1
+                return
+            if len(self._tasks) >= self._max_depth:
+                self._tasks.popitem(last=False)
+                self._dropped += 1
+            self._tasks[key] = task
+            self._condition.notify()
+
+    def get(self, timeout:float|None=None) -> RelayTask|None:
+        """Следующая задача или None, если очередь закрыта либо истёк timeout"""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._tasks or self._closed, timeout):
+                return None
+            if not self._tasks:
+                return None
+            _, task = self._tasks.popitem(last=False)
+            self._processed += 1
+            return task
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._tasks.clear()
+            self._condition.notify_all()
+
+    def reopen(self):
+        with self._condition:
+            self._closed = False
+
+    def stats(self) -> RelayQueueStats:
+        with self._condition:
+            return RelayQueueStats(len(self._tasks), self._enqueued, self._coalesced, self._dropped, self._processed)
@@ -0,0 +1,174 @@
+from collections import deque
+from functools import partial
+import threading
+from typing import Any
+from uuid import uuid4
+from PySide6.QtCore import QObject, Slot
+from PySide6.QtGui import QColor, QQuaternion, QVector3D
+
+from common.domain.interfaces import AttentionRule, AttentionScene, Person, SceneObj
+from web.dtos.state_changes import AttentionRulePatch, PersonPatch, SceneObjPatch, StateChanges
+
+
+_PERSON = 'person'
+_SCENE_OBJ = 'scene_obj'
+_RULE = 'rule'
+_AGGREGATED_HITS_ADDED = 'aggregated_hits_added'
+
+
+class SceneStateLog(QObject):
+    """
+    Журнал изменений состояния сцены сервера.
+
+    Каждое изменение элемента получает следующий номер seq. Клиент, применивший изменения до seq N,
+    получает от changes_since только поля элементов, изменённые после N, объединённые в один патч на элемент.
+    Журнал хранит не больше max_entries изменений, более отставшим клиентам нужен полный снимок состояния.
+    Данные головы и результаты бросания лучей в журнал не попадают: они передаются потоком.
+    """
+    def __init__(self, max_entries:int=4096) -> None:
+        super().__init__()
+        self._lock = threading.Lock()
+        # (seq, element kind, element id, changed fields)
+        self._entries:deque[tuple[int, str, Any, dict[str, Any]]] = deque(maxlen=max_entries)
+        self._log_id = uuid4().hex
+        self._seq = 0
+        self._scene:AttentionScene|None = None
+        self._connected:list[tuple[Any, Any]] = []
+
+    def log_id(self) -> str:
+        return self._log_id
+
+    def current(self) -> tuple[str, int]:
+        with self._lock:
+            return self._log_id, self._seq
+
+    def set_scene(self, scene:AttentionScene|None):
+        """Новая сцена начинает новый журнал с другим log_id"""
+        self._disconnect_all()
+        with self._lock:
+            self._entries.clear()
+            self._log_id = uuid4().hex
+            self._seq = 0
+        self._scene = scene
+        if scene is None:
+            return
+        self._connect(scene.person_created, self._attach_person)
+        self._connect(scene.attention_rule_created, self._attach_rule)
+        for person in scene.persons():
+            self._attach_person(person)
+        for scene_obj in scene.scene_objs():
+            self._attach_scene_obj(scene_obj)
+        for rule in scene.attention_rules():
+            self._attach_rule(rule)
+
+    def changes_since(self, log_id:str|None, since_seq:int|None) -> StateChanges|None:
+        """Изменения после since_seq или None, если нужен полный снимок"""
+        with self._lock:
+            if log_id != self._log_id or since_seq is None or since_seq > self._seq:
+                return None
+            oldest_seq = self._entries[0][0] if self._entries else self._seq + 1
+            if since_seq < oldest_seq - 1:
+                return None
+            merged:dict[tuple[str, Any], dict[str, Any]] = dict()
+            for seq, kind, element_id, fields in self._entries:
+                if seq <= since_seq:
+                    continue
+                patch = merged.setdefault((kind, element_id), dict())
+                for name, value in fields.items():
+                    if name == _AGGREGATED_HITS_ADDED:
+                        patch.setdefault(name, []).extend(value)
+                    else:
+                        patch[name] = value
+            log_id, seq = self._log_id, self._seq
+
+        persons, scene_objs, rules = [], [], []
+        for (kind, element_id), fields in merged.items():
+            if kind == _PERSON:
+                persons.append(PersonPatch(element_id, **fields))
+            elif kind == _SCENE_OBJ:
+                scene_objs.append(SceneObjPatch(element_id, **fields))
+            else:
+                rules.append(AttentionRulePatch(element_id, **fields))
+        return StateChanges(log_id, seq, persons, scene_objs, rules)
+
+    def _record(self, kind:str, element_id:Any, **fields):
+        with self._lock:
+            self._seq += 1
+            self._entries.append((self._seq, kind, element_id, fields))
+
+    def _connect(self, signal, slot):
+        signal.connect(slot)
+        self._connected.append((signal, slot))
+
+    def _disconnect_all(self):
+        for signal, slot in self._connected:
+            try:
+                signal.disconnect(slot)
+            except (RuntimeError, TypeError):
+                # the element is already deleted
+                pass
+        self._connected.clear()
+
+    @Slot(Person)
+    def _attach_person(self, person:Person):
+        person_id = person.element_id()
+        record = partial(self._record, _PERSON, person_id)
+        self._connect(person.element_name_changed, lambda name: record(name=name))
+        self._connect(person.head_color_changed, lambda color: record(head_color=QColor(color)))
+        self._connect(person.camera_position_changed, lambda pos: record(camera_position=QVector3D(pos)))
+        self._connect(person.camera_rotation_changed, lambda rot: record(camera_rotation=QQuaternion(rot)))
+
+    def _attach_scene_obj(self, scene_obj:SceneObj):
+        record = partial(self._record, _SCENE_OBJ, scene_obj.element_id())
+        self._connect(scene_obj.element_name_changed, lambda name: record(name=name))
+        self._connect(scene_obj.keep_attention_timedelta_changed,
+                      lambda tdelta: record(keep_attention_timedelta=tdelta))
+        self._connect(scene_obj.aggregated_attention_hits_added,
+                      lambda hits: record(**{_AGGREGATED_HITS_ADDED: list(hits)}))
+
+    @Slot(AttentionRule)
+    def _attach_rule(self, rule:AttentionRule):
+        record = partial(self._record, _RULE, rule.element_id())
+        self._connect(rule.element_name_changed, lambda name: record(name=name))
+        self._connect(rule.without_attention_timedelta_changed,
+                      lambda tdelta: record(without_attention_timedelta=tdelta))
+        self._connect(rule.last_refresh_timestamp_changed,
+                      lambda timestamp: record(last_refresh_timestamp=timestamp))
+
+
+def apply_state_changes(scene:AttentionScene, changes:StateChanges):
+    """Применяет патчи к сцене клиента, элементы, которых нет в сцене, пропускаются"""
+    persons_by_id = scene.persons_by_id()
+    for person_patch in changes.persons:
+        if (person:=persons_by_id.get(person_patch.id)) is None:
+            continue
+        if person_patch.name is not None:
+            person.set_element_name(person_patch.name)
+        if person_patch.head_color is not None:
+            person.set_head_color(person_patch.head_color)
+        if person_patch.camera_position is not None:
+            person.set_camera_position(person_patch.camera_position)
+        if person_patch.camera_rotation is not None:
+            person.set_camera_rotation(person_patch.camera_rotation)
+
+    scene_objs_by_id = scene.scene_objs_by_id()
+    for scene_obj_patch in changes.scene_objs:
+        if (scene_obj:=scene_objs_by_id.get(scene_obj_patch.id)) is None:
+            continue
+        if scene_obj_patch.name is not None:
+            scene_obj.set_element_name(scene_obj_patch.name)
+        if scene_obj_patch.keep_attention_timedelta is not None:
+            scene_obj.set_keep_attention_timedelta(scene_obj_patch.keep_attention_timedelta)
+        if scene_obj_patch.aggregated_hits_added:
+            scene_obj.set_aggregated_hits(scene_obj_patch.aggregated_hits_added)
+
+    rules_by_id = scene.attention_rules_by_id()
+    for rule_patch in changes.rules:
+        if (rule:=rules_by_id.get(rule_patch.id)) is None:
+            continue
+        if rule_patch.name is not None:
+            rule.set_element_name(rule_patch.name)
+        if rule_patch.without_attention_timedelta is not None:
+            rule.set_without_attention_timedelta(rule_patch.without_attention_timedelta)
+        if rule_patch.last_refresh_timestamp is not None:
+            rule.set_last_refresh_timestamp(rule_patch.last_refresh_timestamp)
@@ -11,16 +11,26 @@ class ConnectionEventsNames(Enum):
     connect='/connect'
     disconnect='/disconnect'
     active_project_download='/active_project_download'
+    # ProjectManifest of the active project, its files are served by hash with range support
+    active_project_manifest='/active_project_manifest'
+    active_project_files='/active_project_files'
     generated_head_data='/generated_head_data'
     generated_scene_obj_aggregated_hits='/generated_aggregated_hits'
     generated_cast_result='/generated_cast_result'
     request_state='/request_state'
+    # StateChangesRequest, answered with recieved_state_changes or with recieved_state followed by it
+    request_state_changes='/request_state_changes'
     recieved_project_changed='/recieved_project_changed'
     recieved_current_person_id='/recieved_current_person_id'
     recieved_others_head_data='/recieved_others_head_data'
     recieved_others_aggregated_hits='/recieved_others_aggregated_hits'
     recieved_others_cast_result='/recieved_others_cast_result'
     recieved_state='/recieved_state'
+    recieved_state_changes='/recieved_state_changes'
+    negotiate_protocol='/negotiate_protocol'
+    recieved_protocol='/recieved_protocol'
+    # list of [event, payload] sent by the server broadcast scheduler at once
+    recieved_batch='/recieved_batch'
 
 
 
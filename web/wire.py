@@ -0,0 +1,291 @@
+from datetime import datetime
+from enum import Enum
+import re
+import struct
+import numpy as np
+from pydantic import TypeAdapter
+from pydantic.dataclasses import dataclass
+from PySide6.QtGui import QQuaternion, QVector3D
+
+from common.dtos.head_data import EyeTransform, EyesTransforms, HeadData, HeadProps, PersonHeadData, PersonHeadDataAdapter
+from common.dtos.hits import PerformedRayCastResult, PersonPerformedRayCastResult, PersonPerformedRayCastResultAdapter
+from common.dtos.utils import FACE_KEYPOINTS_SHAPE
+
+
+WIRE_PROTOCOL_VERSION = 1
+
+
+class WireFormat(Enum):
+    JSON='json'
+    BINARY='binary'
+
+
+@dataclass(frozen=True)
+class WireProtocolOffer:
+    formats:list[WireFormat]
+    version:int=WIRE_PROTOCOL_VERSION
+    # peer renders only head pose and does not need face keypoints
+    keypoints:bool=True
+
+@dataclass(frozen=True)
+class WireProtocolChoice:
+    format:WireFormat
+    version:int
+    keypoints:bool
+
+WireProtocolOfferAdapter = TypeAdapter(WireProtocolOffer)
+WireProtocolChoiceAdapter = TypeAdapter(WireProtocolChoice)
+
+
+def choose_wire_protocol(offer:WireProtocolOffer) -> WireProtocolChoice:
+    if WireFormat.BINARY in offer.formats and offer.version == WIRE_PROTOCOL_VERSION:
+        return WireProtocolChoice(WireFormat.BINARY, WIRE_PROTOCOL_VERSION, offer.keypoints)
+    # JSON frames always carry keypoints
+    return WireProtocolChoice(WireFormat.JSON, WIRE_PROTOCOL_VERSION, True)
+
+
+# Head data frame:
+#   header: magic, version, flags, person_id, timestamp
+#   pose (if visible): head position, head rotation, left eye position, rotation, right eye position, rotation as float32
+#   keypoints (if flag set): per axis minimum and step as float32, then uint16 quantized [478, 3]
+_HEAD_DATA_MAGIC = b'HD'
+_HEAD_DATA_HEADER = struct.Struct('<2sBBqd')
+_HEAD_DATA_POSE = struct.Struct('<21f')
+_KEYPOINTS_RANGE = struct.Struct('<6f')
+_KEYPOINTS_BYTES = FACE_KEYPOINTS_SHAPE[0] * FACE_KEYPOINTS_SHAPE[1] * 2
+_FLAG_HAS_KEYPOINTS = 0b100
+_VIEW_ORIGIN_MASK = 0b011
+_VIEW_ORIGIN_CODES = {
+    HeadData.ViewOrigin.NOT_VISIBLE: 0,
+    HeadData.ViewOrigin.FACE: 1,
+    HeadData.ViewOrigin.LEFT_EYE: 2,
+    HeadData.ViewOrigin.RIGHT_EYE: 3,
+}
+_CODE_VIEW_ORIGINS = {code: view_origin for view_origin, code in _VIEW_ORIGIN_CODES.items()}
+_QUANTIZATION_LEVELS = 65535
+
+# Cast result frame:
+#   header: magic, version, flags, person_id, timestamp, number of hits, number of distinct scene obj ids
+#   scene obj ids: uint16 length and utf-8 bytes each
+#   uint16 index of scene obj id per hit, float32 [n, 3] global hits, float32 [n, 3] local hits
+_CAST_RESULT_MAGIC = b'CR'
+_CAST_RESULT_HEADER = struct.Struct('<2sBBqdIH')
+_STR_LENGTH = struct.Struct('<H')
+
+
+class WireDecodeError(ValueError):
+    pass
+
+
+def is_binary_frame(data:bytes) -> bool:
+    return data[:2] in (_HEAD_DATA_MAGIC, _CAST_RESULT_MAGIC)
+
+
+def _check_header(data:bytes, magic:bytes, header:struct.Struct):
+    if len(data) < header.size or data[:2] != magic:
+        raise WireDecodeError('Not a binary frame of expected kind')
+    if data[2] != WIRE_PROTOCOL_VERSION:
+        raise WireDecodeError(f'Unsupported wire protocol version {data[2]}')
+
+
+def _pose_values(position:QVector3D, rotation:QQuaternion) -> tuple[float, ...]:
+    return (position.x(), position.y(), position.z(), rotation.scalar(), rotation.x(), rotation.y(), rotation.z())
+
+
+def _pose_from_values(values:tuple[float, ...]) -> tuple[QVector3D, QQuaternion]:
+    return QVector3D(*values[:3]), QQuaternion(*values[3:7])
+
+
+def _encode_keypoints(keypoints:np.ndarray) -> bytes:
+    keypoints = np.asarray(keypoints, dtype=np.float32)
+    lo = keypoints.min(axis=0)
+    step = (keypoints.max(axis=0) - lo) / _QUANTIZATION_LEVELS
+    step[step == 0] = 1
+    quantized = np.rint((keypoints - lo) / step).astype('<u2')
+    return _KEYPOINTS_RANGE.pack(*lo.tolist(), *step.tolist()) + quantized.tobytes()
+
+
+def _decode_keypoints(data:bytes, offset:int) -> np.ndarray:
+    values = _KEYPOINTS_RANGE.unpack_from(data, offset)
+    lo = np.array(values[:3], dtype=np.float64)
+    step = np.array(values[3:], dtype=np.float64)
+    quantized = np.frombuffer(data, dtype='<u2', count=FACE_KEYPOINTS_SHAPE[0] * FACE_KEYPOINTS_SHAPE[1],
+                              offset=offset + _KEYPOINTS_RANGE.size)
+    return quantized.reshape(FACE_KEYPOINTS_SHAPE) * step + lo
+
+
+def encode_person_head_data_binary(person_head_data:PersonHeadData, include_keypoints:bool=True) -> bytes:
+    head_data = person_head_data.head_data
+    flags = _VIEW_ORIGIN_CODES[head_data.view_origin]
+    parts:list[bytes] = []
+    if head_data.head_props is not None and head_data.eyes_transforms is not None:
+        head_props = head_data.head_props
+        eyes = head_data.eyes_transforms
+        parts.append(_HEAD_DATA_POSE.pack(*_pose_values(head_props.position, head_props.rotation),
+                                          *_pose_values(eyes.left_eye_transform.position, eyes.left_eye_transform.rotation),
+                                          *_pose_values(eyes.right_eye_transform.position, eyes.right_eye_transform.rotation)))
+        if include_keypoints:
+            flags |= _FLAG_HAS_KEYPOINTS
+            parts.append(_encode_keypoints(head_props.keypoints))
+    header = _HEAD_DATA_HEADER.pack(_HEAD_DATA_MAGIC, WIRE_PROTOCOL_VERSION, flags,
+                                    person_head_data.person_id, head_data.timestamp.timestamp())
+    return header + b''.join(parts)
+
+
+def decode_person_head_data_binary(data:bytes, fallback_keypoints:np.ndarray|None=None) -> PersonHeadData:
+    """
+    Кадр без ключевых точек лица декодируется с fallback_keypoints - ключевыми точками последнего опорного кадра,
+    или с нулевыми, если они не известны.
+    """
+    _check_header(data, _HEAD_DATA_MAGIC, _HEAD_DATA_HEADER)
+    _, _, flags, person_id, timestamp = _HEAD_DATA_HEADER.unpack_from(data)
+    view_origin = _CODE_VIEW_ORIGINS[flags & _VIEW_ORIGIN_MASK]
+    head_data_timestamp = datetime.fromtimestamp(timestamp)
+    if view_origin == HeadData.ViewOrigin.NOT_VISIBLE:
+        return PersonHeadData(person_id, HeadData(head_data_timestamp))
+
+    offset = _HEAD_DATA_HEADER.size
+    if len(data) < offset + _HEAD_DATA_POSE.size:
+        raise WireDecodeError('Head data frame is truncated')
+    values = _HEAD_DATA_POSE.unpack_from(data, offset)
+    offset += _HEAD_DATA_POSE.size
+    if flags & _FLAG_HAS_KEYPOINTS:
+        if len(data) < offset + _KEYPOINTS_RANGE.size + _KEYPOINTS_BYTES:
+            raise WireDecodeError('Head data frame is truncated')
+        keypoints = _decode_keypoints(data, offset)
+    elif fallback_keypoints is not None:
+        keypoints = fallback_keypoints
+    else:
+        keypoints = np.zeros(FACE_KEYPOINTS_SHAPE)
+
+    head_position, head_rotation = _pose_from_values(values[0:7])
+    left_position, left_rotation = _pose_from_values(values[7:14])
+    right_position, right_rotation = _pose_from_values(values[14:21])
+    return PersonHeadData(person_id, HeadData(head_data_timestamp,
+                                              view_origin,
+                                              HeadProps(head_position, head_rotation, keypoints),
+                                              EyesTransforms(EyeTransform(left_position, left_rotation),
+                                                             EyeTransform(right_position, right_rotation))))
+
+
+def head_data_frame_has_keypoints(data:bytes) -> bool:
+    return bool(data[3] & _FLAG_HAS_KEYPOINTS)
+
+
+def known_keypoints(head_data:HeadData) -> np.ndarray|None:
+    """Ключевые точки, которыми дополняются кадры без них"""
+    return head_data.head_props.keypoints if head_data.head_props is not None else None
+
+
+def strip_keypoints(data:bytes) -> bytes:
+    """Убирает ключевые точки из бинарного кадра данных головы без полного декодирования"""
+    _check_header(data, _HEAD_DATA_MAGIC, _HEAD_DATA_HEADER)
+    if not head_data_frame_has_keypoints(data):
+        return data
+    return data[:3] + bytes((data[3] & ~_FLAG_HAS_KEYPOINTS,)) + data[4:_HEAD_DATA_HEADER.size + _HEAD_DATA_POSE.size]
+
+
+def carry_keypoints(replaced:bytes, latest:bytes) -> bytes:
+    """
+    Кадр latest, заменяющий в очереди отправки ещё не отправленный replaced.
+    Если replaced - опорный кадр данных головы, а latest - видимый кадр без ключевых точек,
+    ключевые точки replaced переносятся в latest, иначе получатель дополнил бы его устаревшими.
+    """
+    if replaced[:2] != _HEAD_DATA_MAGIC or latest[:2] != _HEAD_DATA_MAGIC \
+            or not head_data_frame_has_keypoints(replaced) or head_data_frame_has_keypoints(latest) \
+            or latest[3] & _VIEW_ORIGIN_MASK == _VIEW_ORIGIN_CODES[HeadData.ViewOrigin.NOT_VISIBLE]:
+        return latest
+    pose_end = _HEAD_DATA_HEADER.size + _HEAD_DATA_POSE.size
+    return latest[:3] + bytes((latest[3] | _FLAG_HAS_KEYPOINTS,)) + latest[4:pose_end] + replaced[pose_end:]
+
+
+def encode_person_cast_result_binary(person_cast_result:PersonPerformedRayCastResult) -> bytes:
+    cast_result = person_cast_result.cast_result
+    obj_ids = list(dict.fromkeys(cast_result.scene_obj_ids))
+    obj_id2index = {obj_id: index for index, obj_id in enumerate(obj_ids)}
+    num_hits = len(cast_result.scene_obj_ids)
+
+    parts = [_CAST_RESULT_HEADER.pack(_CAST_RESULT_MAGIC, WIRE_PROTOCOL_VERSION, 0, person_cast_result.person_id,
+                                      cast_result.timestamp.timestamp(), num_hits, len(obj_ids))]
+    for obj_id in obj_ids:
+        encoded = obj_id.encode('utf-8')
+        parts.append(_STR_LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+    parts.append(np.array([obj_id2index[obj_id] for obj_id in cast_result.scene_obj_ids], dtype='<u2').tobytes())
+    for hits in (cast_result.hits_global, cast_result.hits_local):
+        parts.append(np.array([(p.x(), p.y(), p.z()) for p in hits], dtype='<f4').reshape(num_hits, 3).tobytes())
+    return b''.join(parts)
+
+
+def decode_person_cast_result_binary(data:bytes) -> PersonPerformedRayCastResult:
+    _check_header(data, _CAST_RESULT_MAGIC, _CAST_RESULT_HEADER)
+    _, _, _, person_id, timestamp, num_hits, num_obj_ids = _CAST_RESULT_HEADER.unpack_from(data)
+    offset = _CAST_RESULT_HEADER.size
+    obj_ids:list[str] = []
+    try:
+        for _ in range(num_obj_ids):
+            length, = _STR_LENGTH.unpack_from(data, offset)
+            offset += _STR_LENGTH.size
+            obj_ids.append(data[offset:offset + length].decode('utf-8'))
+            offset += length
+        indices = np.frombuffer(data, dtype='<u2', count=num_hits, offset=offset)
+        offset += indices.nbytes
+        hits_global = np.frombuffer(data, dtype='<f4', count=num_hits * 3, offset=offset).reshape(num_hits, 3)
+        offset += hits_global.nbytes
+        hits_local = np.frombuffer(data, dtype='<f4', count=num_hits * 3, offset=offset).reshape(num_hits, 3)
+    except (struct.error, ValueError) as e:
+        raise WireDecodeError(f'Cast result frame is truncated: {e}')
+
+    return PersonPerformedRayCastResult(person_id, PerformedRayCastResult(
+        datetime.fromtimestamp(timestamp),
+        [obj_ids[i] for i in indices.tolist()],
+        [QVector3D(*p) for p in hits_global.tolist()],
+        [QVector3D(*p) for p in hits_local.tolist()]))
+
+
+# pydantic dumps dataclass fields in declaration order, so the id is at the very beginning of JSON frames
+_JSON_PERSON_ID = re.compile(rb'\s*\{\s*"person_id"\s*:\s*(-?\d+)')
+_JSON_SCENE_OBJ_ID = re.compile(rb'\s*\{\s*"scene_obj_id"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+def peek_person_id(data:bytes) -> int|None:
+    """person_id кадра данных головы или результата бросания лучей по заголовку, без проверки остального содержимого"""
+    if data[:2] == _HEAD_DATA_MAGIC or data[:2] == _CAST_RESULT_MAGIC:
+        header = _HEAD_DATA_HEADER if data[:2] == _HEAD_DATA_MAGIC else _CAST_RESULT_HEADER
+        if len(data) < header.size or data[2] != WIRE_PROTOCOL_VERSION:
+            return None
+        return header.unpack_from(data)[3]
+    if (match:=_JSON_PERSON_ID.match(data)) is not None:
+        return int(match.group(1))
+    return None
+
+
+def peek_scene_obj_id(data:bytes) -> str|None:
+    """scene_obj_id JSON кадра агрегированных попаданий без полной проверки"""
+    if (match:=_JSON_SCENE_OBJ_ID.match(data)) is not None:
+        return match.group(1).decode('utf-8')
+    return None
+
+
+def encode_person_head_data(person_head_data:PersonHeadData, wire_format:WireFormat, include_keypoints:bool=True) -> bytes:
+    if wire_format == WireFormat.BINARY:
+        return encode_person_head_data_binary(person_head_data, include_keypoints)
+    return PersonHeadDataAdapter.dump_json(person_head_data)
+
+
+def decode_person_head_data(data:bytes, fallback_keypoints:np.ndarray|None=None) -> PersonHeadData:
+    if data[:2] == _HEAD_DATA_MAGIC:
+        return decode_person_head_data_binary(data, fallback_keypoints)
+    return PersonHeadDataAdapter.validate_json(data)
+
+
+def encode_person_cast_result(person_cast_result:PersonPerformedRayCastResult, wire_format:WireFormat) -> bytes:
+    if wire_format == WireFormat.BINARY:
+        return encode_person_cast_result_binary(person_cast_result)
+    return PersonPerformedRayCastResultAdapter.dump_json(person_cast_result)
+
+
+def decode_person_cast_result(data:bytes) -> PersonPerformedRayCastResult:
+    if data[:2] == _CAST_RESULT_MAGIC:
+        return decode_person_cast_result_binary(data)
+    return PersonPerformedRayCastResultAdapter.validate_json(data)